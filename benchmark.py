@@ -0,0 +1,337 @@
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+from main import (InventoryManager, BillingSystem, Product, OrderItem, Promotion, PromotionEngine,
+                  LEDGER_FIELDNAMES, peak_memory_mb)
+
+# Synthetic-data benchmarks for the hot paths. Each (operation, size) runs in
+# a fresh child process so peak RSS belongs to that measurement alone.
+#
+#   python benchmark.py --skus 10000,100000,1000000 --sales 100000,10000000
+#   python benchmark.py --only evaluate_promotions --promotions 100,1000,10000
+#   python benchmark.py --baseline bench_baseline.json --save-baseline
+#   python benchmark.py --baseline bench_baseline.json      (exits 1 on regression)
+
+ADJECTIVES = ['Fresh', 'Spicy', 'Classic', 'Organic', 'Crunchy', 'Sweet', 'Salted', 'Premium',
+              'Golden', 'Roasted', 'Instant', 'Creamy', 'Masala', 'Lite', 'Family', 'Mini']
+NOUNS = ['Noodles', 'Cola', 'Biscuits', 'Oats', 'Chips', 'Tea', 'Coffee', 'Rice', 'Soap',
+         'Shampoo', 'Juice', 'Butter', 'Paneer', 'Atta', 'Dal', 'Ketchup', 'Chocolate', 'Bread']
+
+def product_name(rng, i):
+    return f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}"
+
+def generate_catalog(path, skus, seed=0):
+    """Write an inventory.csv-format catalog of skus products"""
+    rng = random.Random(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['product_id', 'name', 'price', 'stock_quantity'])
+        for i in range(skus):
+            writer.writerow([str(100000 + i), product_name(rng, i), round(rng.uniform(5, 500), 2),
+                             rng.randint(0, 1000)])
+
+def generate_sales(path, rows, seed=0, days=365):
+    """Write a sales.csv-format ledger of rows sales spread over the last days, oldest first"""
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=days)
+    step = days * 86400 / max(rows, 1)
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(LEDGER_FIELDNAMES)
+        for i in range(rows):
+            total = round(rng.uniform(10, 2000), 2)
+            discount = round(total * rng.choice((0, 0, 0, 0.05, 0.1)), 2)
+            when = start + timedelta(seconds=i * step + rng.random() * step)
+            writer.writerow([i, when.isoformat(), total, discount, round(total - discount, 2)])
+
+def dataset(data_dir, kind, size):
+    """Path to a cached synthetic file, generating it on first use"""
+    path = os.path.join(data_dir, f"{kind}_{size}.csv")
+    if not os.path.exists(path):
+        partial = path + '.partial'
+        (generate_catalog if kind == 'catalog' else generate_sales)(partial, size)
+        os.replace(partial, path)
+    return path
+
+def catalog_ids(path):
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return [row[0] for row in reader]
+
+# Each benchmark gets a scratch directory holding copies of its inputs and
+# returns (operations performed, seconds spent on them); setup is not timed.
+
+def bench_load_data(data_dir, size, work_dir):
+    data_file = os.path.join(work_dir, 'inventory.csv')
+    shutil.copy(dataset(data_dir, 'catalog', size), data_file)
+    start = time.perf_counter()
+    InventoryManager(data_file)
+    return size, time.perf_counter() - start
+
+def bench_load_snapshot(data_dir, size, work_dir):
+    data_file = os.path.join(work_dir, 'inventory.csv')
+    shutil.copy(dataset(data_dir, 'catalog', size), data_file)
+    InventoryManager(data_file, snapshot=True)  # first load writes the snapshot
+    start = time.perf_counter()
+    InventoryManager(data_file, snapshot=True)
+    return size, time.perf_counter() - start
+
+def bench_save_data(data_dir, size, work_dir):
+    data_file = os.path.join(work_dir, 'inventory.csv')
+    shutil.copy(dataset(data_dir, 'catalog', size), data_file)
+    inventory_manager = InventoryManager(data_file)
+    start = time.perf_counter()
+    inventory_manager.save_data()
+    return size, time.perf_counter() - start
+
+def bench_search_product(data_dir, size, work_dir, queries=2000):
+    data_file = os.path.join(work_dir, 'inventory.csv')
+    shutil.copy(dataset(data_dir, 'catalog', size), data_file)
+    inventory_manager = InventoryManager(data_file)
+    rng = random.Random(1)
+    keywords = [rng.choice((rng.choice(NOUNS), rng.choice(ADJECTIVES)[:4], str(rng.randrange(size))))
+                for _ in range(queries)]
+    start = time.perf_counter()
+    for keyword in keywords:
+        inventory_manager.search_product(keyword, limit=20)
+    return queries, time.perf_counter() - start
+
+def bench_add_to_cart(data_dir, size, work_dir, adds=20000):
+    catalog = dataset(data_dir, 'catalog', size)
+    shutil.copy(catalog, os.path.join(work_dir, 'inventory.csv'))
+    inventory_manager = InventoryManager(os.path.join(work_dir, 'inventory.csv'))
+    billing_system = BillingSystem(inventory_manager, os.path.join(work_dir, 'sales.csv'))
+    session = billing_system.open_session()
+    session.quiet = True
+    rng = random.Random(2)
+    ids = catalog_ids(catalog)
+    picks = [rng.choice(ids) for _ in range(adds)]
+    start = time.perf_counter()
+    for i, product_id in enumerate(picks):
+        session.add_to_cart(product_id, 1)
+        if i % 20 == 19:
+            session.release()
+    session.release()
+    return adds, time.perf_counter() - start
+
+def bench_checkout(data_dir, size, work_dir, orders=2000):
+    # The configuration open_store() uses for the server: journal plus group-committed ledger
+    catalog = dataset(data_dir, 'catalog', size)
+    shutil.copy(catalog, os.path.join(work_dir, 'inventory.csv'))
+    inventory_manager = InventoryManager(os.path.join(work_dir, 'inventory.csv'), journal=True)
+    billing_system = BillingSystem(inventory_manager, os.path.join(work_dir, 'sales.csv'), flush_interval=1.0)
+    session = billing_system.open_session()
+    session.quiet = True
+    rng = random.Random(3)
+    ids = [product_id for product_id in catalog_ids(catalog)
+           if inventory_manager.get_product(product_id).stock_quantity > 0]
+    carts = [rng.sample(ids, min(3, len(ids))) for _ in range(orders)]
+    start = time.perf_counter()
+    for cart in carts:
+        for product_id in cart:
+            session.add_to_cart(product_id, 1)
+        if session.checkout() is None:
+            session.release()
+    billing_system.flush_sales()
+    return orders, time.perf_counter() - start
+
+def bench_load_sales(data_dir, size, work_dir):
+    sales_file = os.path.join(work_dir, 'sales.csv')
+    shutil.copy(dataset(data_dir, 'sales', size), sales_file)
+    inventory_manager = InventoryManager(os.path.join(work_dir, 'inventory.csv'))
+    start = time.perf_counter()
+    BillingSystem(inventory_manager, sales_file)
+    return size, time.perf_counter() - start
+
+def bench_get_sales_report(data_dir, size, work_dir, reports=500):
+    sales_file = os.path.join(work_dir, 'sales.csv')
+    shutil.copy(dataset(data_dir, 'sales', size), sales_file)
+    inventory_manager = InventoryManager(os.path.join(work_dir, 'inventory.csv'))
+    billing_system = BillingSystem(inventory_manager, sales_file)
+    rng = random.Random(4)
+    today = datetime.now().date()
+    ranges = []
+    for _ in range(reports):
+        end = today - timedelta(days=rng.randrange(365))
+        ranges.append((end - timedelta(days=rng.choice((0, 6, 29))), end))
+    start = time.perf_counter()
+    for start_date, end_date in ranges:
+        billing_system.get_sales_report(start_date, end_date)
+    return reports, time.perf_counter() - start
+
+def bench_import_products(data_dir, size, work_dir):
+    import_file = os.path.join(work_dir, 'import.csv')
+    shutil.copy(dataset(data_dir, 'catalog', size), import_file)
+    inventory_manager = InventoryManager(os.path.join(work_dir, 'inventory.csv'))
+    start = time.perf_counter()
+    inventory_manager.import_products(import_file)
+    return size, time.perf_counter() - start
+
+def generate_promotions(rules, skus, seed=0):
+    """rules random promotions of every kind over product IDs 100000..100000+skus; a third are time-windowed"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    promotions = []
+    for i in range(rules):
+        kind = ('markdown', 'buy_x_get_y', 'bundle')[i % 3]
+        product_ids = [str(100000 + rng.randrange(skus)) for _ in range(rng.randint(1, 30 if kind == 'bundle' else 5))]
+        window = {}
+        if i % 3 == 0:
+            start = now + timedelta(days=rng.uniform(-30, 30))
+            window = {'start': start, 'end': start + timedelta(days=rng.uniform(1, 14))}
+        if kind == 'markdown':
+            promotions.append(Promotion(f"m{i}", kind, product_ids, percent=rng.choice((5, 10, 20)), **window))
+        elif kind == 'buy_x_get_y':
+            promotions.append(Promotion(f"x{i}", kind, product_ids, buy=rng.randint(1, 3), get=1, **window))
+        else:
+            promotions.append(Promotion(f"b{i}", kind, product_ids, quantity=3, percent=15, **window))
+    return promotions
+
+def bench_evaluate_promotions(data_dir, size, work_dir, carts=20000, skus_per_rule=20):
+    # The catalog grows with the rule count so each product carries about the
+    # same number of rules; what changes is only how many rules exist in total.
+    # Pricing looks up only the cart's products in the window's table, so the
+    # rules it touches per cart (about 1.3 to 1.4) and its multi-buy checks do
+    # not grow with the total. Throughput still falls by about a third from 10
+    # to 100,000 rules, as the table outgrows the CPU caches.
+    skus = size * skus_per_rule
+    engine = PromotionEngine(generate_promotions(size, skus))
+    rng = random.Random(5)
+    baskets = [[OrderItem(Product(str(100000 + rng.randrange(skus)), 'Item', round(rng.uniform(5, 500), 2), 100),
+                          rng.randint(1, 4)) for _ in range(rng.randint(1, 8))] for _ in range(carts)]
+    now = datetime.now()
+    engine.evaluate(baskets[0], now)  # compile the current window's table
+    start = time.perf_counter()
+    for basket in baskets:
+        engine.evaluate(basket, now)
+    return carts, time.perf_counter() - start
+
+# operation -> (function, which size list it scales with)
+BENCHMARKS = {
+    'load_data': (bench_load_data, 'skus'),
+    'load_snapshot': (bench_load_snapshot, 'skus'),
+    'save_data': (bench_save_data, 'skus'),
+    'search_product': (bench_search_product, 'skus'),
+    'add_to_cart': (bench_add_to_cart, 'skus'),
+    'checkout': (bench_checkout, 'skus'),
+    'import_products': (bench_import_products, 'skus'),
+    'load_sales': (bench_load_sales, 'sales'),
+    'get_sales_report': (bench_get_sales_report, 'sales'),
+    'evaluate_promotions': (bench_evaluate_promotions, 'promotions'),
+}
+
+def run_one(operation, size, data_dir):
+    """Child-process entry point: run one benchmark and report its numbers"""
+    function = BENCHMARKS[operation][0]
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+    try:
+        with redirect_stdout(io.StringIO()):
+            ops, seconds = function(data_dir, size, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'operation': operation,
+        'size': size,
+        'ops': ops,
+        'seconds': seconds,
+        'ops_per_sec': ops / seconds if seconds > 0 else None,
+        'peak_rss_mb': peak_memory_mb()
+    }
+
+def run_benchmarks(operations, sizes_by_kind, data_dir):
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for operation in operations:
+        kind = BENCHMARKS[operation][1]
+        for size in sizes_by_kind[kind]:
+            # Generate here so data creation never counts towards a child's RSS
+            if kind in ('skus', 'sales'):
+                dataset(data_dir, 'catalog' if kind == 'skus' else 'sales', size)
+            with context.Pool(1, maxtasksperchild=1) as pool:
+                result = pool.apply(run_one, (operation, size, data_dir))
+            results.append(result)
+            print(f"{operation:<18} {size:>10,}  {result['seconds']:9.3f}s  "
+                  f"{result['ops_per_sec'] or 0:14,.0f} ops/s  {result['peak_rss_mb'] or 0:8.1f} MB")
+    return results
+
+def compare(results, baseline, tolerance):
+    """Regressions against a baseline: slower by more than tolerance, or that much more memory"""
+    previous = {(entry['operation'], entry['size']): entry for entry in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['operation'], result['size']))
+        if before is None:
+            continue
+        if before['ops_per_sec'] and result['ops_per_sec'] is not None \
+                and result['ops_per_sec'] < before['ops_per_sec'] * (1 - tolerance):
+            regressions.append(f"{result['operation']} @ {result['size']:,}: "
+                               f"{result['ops_per_sec']:,.0f} ops/s vs {before['ops_per_sec']:,.0f} baseline")
+        if before['peak_rss_mb'] and result['peak_rss_mb'] is not None \
+                and result['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{result['operation']} @ {result['size']:,}: "
+                               f"{result['peak_rss_mb']:.1f} MB peak vs {before['peak_rss_mb']:.1f} MB baseline")
+    return regressions
+
+def parse_sizes(text):
+    return [int(size.replace('_', '')) for size in text.split(',') if size]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the store's hot paths on synthetic catalogs and sales histories")
+    parser.add_argument('--skus', type=parse_sizes, default=[10000, 100000], help="catalog sizes, e.g. 10000,1000000,5000000")
+    parser.add_argument('--sales', type=parse_sizes, default=[100000, 1000000], help="sales history sizes, e.g. 1000000,50000000")
+    parser.add_argument('--promotions', type=parse_sizes, default=[100, 1000, 10000], help="promotion rule counts, e.g. 100,10000")
+    parser.add_argument('--only', help="comma-separated operations to run (default all): " + ', '.join(BENCHMARKS))
+    parser.add_argument('--data-dir', default='bench_data', help="where generated CSVs are cached between runs")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="write these results to --baseline instead of comparing")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown or memory growth (default 0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    operations = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [operation for operation in operations if operation not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown operation(s): {', '.join(unknown)}")
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    sizes_by_kind = {'skus': args.skus, 'sales': args.sales, 'promotions': args.promotions}
+    results = run_benchmarks(operations, sizes_by_kind, args.data_dir)
+    report = {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline and args.save_baseline:
+        shutil.copy(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("REGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,99 +1,3123 @@
-import os
+import argparse
 import csv
+import functools
+import gzip
+import heapq
+import io
+import json
+import math
+import mmap
+import os
+import random
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext, redirect_stdout
 from datetime import datetime, date, timedelta
+from itertools import islice
+from operator import itemgetter
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:  # analytics fall back to plain Python
+    np = None
+
+class Product:
+    def __init__(self, product_id, name, price, stock_quantity):
+        self.product_id = product_id
+        self.name = name
+        self.price = price
+        self.stock_quantity = stock_quantity
+    
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'name': self.name,
+            'price': self.price,
+            'stock_quantity': self.stock_quantity
+        }
+    
+    def __str__(self):
+        return f"{self.product_id}: {self.name} - ${self.price:.2f} (Stock: {self.stock_quantity})"
+
+class ProductView:
+    """Product-like view of one row of a ColumnarProductStore"""
+    __slots__ = ('_store', '_row')
+    
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+    
+    @property
+    def product_id(self):
+        return self._store.ids[self._row]
+    
+    @property
+    def name(self):
+        return self._store.get_name(self._row)
+    
+    @name.setter
+    def name(self, value):
+        self._store.set_name(self._row, value)
+    
+    @property
+    def price(self):
+        return self._store.prices[self._row]
+    
+    @price.setter
+    def price(self, value):
+        self._store.prices[self._row] = value
+    
+    @property
+    def stock_quantity(self):
+        return self._store.stocks[self._row]
+    
+    @stock_quantity.setter
+    def stock_quantity(self, value):
+        self._store.stocks[self._row] = value
+    
+    to_dict = Product.to_dict
+    __str__ = Product.__str__
+
+class ColumnarProductStore(MutableMapping):
+    """Products held as columns with an ID-to-row map.
+    
+    Price and stock live in typed arrays and names in one UTF-8 buffer, so a
+    SKU costs no Python objects beyond its ID string and map entry. Behaves
+    like the {product_id: Product} dict but returns ProductView objects.
+    Deleted rows are not reused, so views held elsewhere keep their last values.
+    """
+    
+    def __init__(self):
+        self.ids = []
+        self.name_data = bytearray()
+        self.name_offsets = array('Q')
+        self.name_lengths = array('I')
+        self.prices = array('d')
+        self.stocks = array('q')
+        self.rows = {}
+    
+    def get_name(self, row):
+        offset = self.name_offsets[row]
+        return self.name_data[offset:offset + self.name_lengths[row]].decode('utf-8')
+    
+    def set_name(self, row, name):
+        # Renames append to the buffer; the old bytes are left unreferenced
+        encoded = name.encode('utf-8')
+        self.name_offsets[row] = len(self.name_data)
+        self.name_lengths[row] = len(encoded)
+        self.name_data += encoded
+    
+    def put(self, product_id, name, price, stock_quantity):
+        row = self.rows.get(product_id)
+        if row is None:
+            row = self.rows[product_id] = len(self.ids)
+            self.ids.append(product_id)
+            self.name_offsets.append(0)
+            self.name_lengths.append(0)
+            self.prices.append(price)
+            self.stocks.append(stock_quantity)
+        else:
+            self.prices[row] = price
+            self.stocks[row] = stock_quantity
+        if self.get_name(row) != name:
+            self.set_name(row, name)
+    
+    def __getitem__(self, product_id):
+        return ProductView(self, self.rows[product_id])
+    
+    def __setitem__(self, product_id, product):
+        self.put(product_id, product.name, product.price, product.stock_quantity)
+    
+    def __delitem__(self, product_id):
+        del self.rows[product_id]
+    
+    def __contains__(self, product_id):
+        return product_id in self.rows
+    
+    def __iter__(self):
+        return iter(self.rows)
+    
+    def __len__(self):
+        return len(self.rows)
+
+def product_memory_report(count=100000):
+    """Measure bytes per SKU for the dict-of-Product and columnar stores"""
+    def build_dict():
+        return {str(i): Product(str(i), f"Product {i}", i * 0.01 + 1, i % 100) for i in range(count)}
+    
+    def build_columnar():
+        store = ColumnarProductStore()
+        for i in range(count):
+            store.put(str(i), f"Product {i}", i * 0.01 + 1, i % 100)
+        return store
+    
+    report = {}
+    for label, build in (('dict', build_dict), ('columnar', build_columnar)):
+        tracemalloc.start()
+        store = build()
+        report[label] = tracemalloc.get_traced_memory()[0] / count
+        tracemalloc.stop()
+        del store
+    return report
+
+class OrderItem:
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+        self.reprice()
+    
+    def reprice(self):
+        """Charge the product's current name and price; receipts keep these, not later edits"""
+        self.name = self.product.name
+        self.price = self.product.price
+        self.total = self.price * self.quantity
+    
+    def to_dict(self):
+        return {
+            'product_id': self.product.product_id,
+            'name': self.name,
+            'price': self.price,
+            'quantity': self.quantity,
+            'total': self.total
+        }
+
+class Sale:
+    def __init__(self, items, total_amount, sale_datetime, discount=0, sale_id=None, promotions=None):
+        self.items = items
+        self.total_amount = total_amount
+        self.datetime = sale_datetime
+        self.discount = discount
+        self.final_amount = total_amount - discount
+        # Assigned by the sales storage when the sale is recorded
+        self.sale_id = sale_id
+        # Promotions applied at checkout (see PromotionEngine.evaluate); their
+        # discounts are included in discount along with any manual discount
+        self.promotions = promotions or []
+    
+    def to_dict(self):
+        return {
+            'sale_id': self.sale_id,
+            'datetime': self.datetime.isoformat(),
+            'items': [item.to_dict() for item in self.items],
+            'total_amount': self.total_amount,
+            'discount': self.discount,
+            'promotions': self.promotions,
+            'final_amount': self.final_amount
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a sale from to_dict() output, e.g. an archived receipt"""
+        items = [OrderItem(Product(item['product_id'], item['name'], item['price'], 0), item['quantity'])
+                 for item in data['items']]
+        return cls(items, data['total_amount'], datetime.fromisoformat(data['datetime']),
+                   data['discount'], data.get('sale_id'), data.get('promotions'))
+
+class ProductSearchIndex:
+    """Inverted index over product names (tokens and trigrams) plus lowercase IDs"""
+    
+    def __init__(self):
+        self.names = {}     # product_id -> lowercase name
+        self.ids = {}       # lowercase product_id -> set of product_ids
+        self.tokens = {}    # name token -> set of product_ids
+        self.trigrams = {}  # name trigram -> set of product_ids
+    
+    @staticmethod
+    def name_trigrams(name):
+        return {name[i:i + 3] for i in range(len(name) - 2)}
+    
+    def clear(self):
+        self.__init__()
+    
+    def rebuild(self, products):
+        self.clear()
+        for product in products:
+            self.add(product)
+    
+    def add(self, product):
+        product_id = product.product_id
+        name = product.name.lower()
+        old_name = self.names.get(product_id)
+        if old_name == name:
+            return
+        if old_name is not None:
+            self.discard(product_id)
+        
+        self.names[product_id] = name
+        self.ids.setdefault(product_id.lower(), set()).add(product_id)
+        for token in set(name.split()):
+            self.tokens.setdefault(token, set()).add(product_id)
+        for trigram in self.name_trigrams(name):
+            self.trigrams.setdefault(trigram, set()).add(product_id)
+    
+    def discard(self, product_id):
+        name = self.names.pop(product_id, None)
+        if name is None:
+            return
+        self._remove_posting(self.ids, product_id.lower(), product_id)
+        for token in set(name.split()):
+            self._remove_posting(self.tokens, token, product_id)
+        for trigram in self.name_trigrams(name):
+            self._remove_posting(self.trigrams, trigram, product_id)
+    
+    def _remove_posting(self, postings, key, product_id):
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(product_id)
+            if not ids:
+                del postings[key]
+    
+    def candidates(self, keyword):
+        if len(keyword) < 3:
+            # Too short for trigrams; scan the cached lowercase names instead
+            return self.names.keys()
+        postings = []
+        for trigram in self.name_trigrams(keyword):
+            ids = self.trigrams.get(trigram)
+            if not ids:
+                return ()
+            postings.append(ids)
+        postings.sort(key=len)
+        return set.intersection(*postings)
+    
+    def rank(self, keyword, product_id):
+        name = self.names[product_id]
+        if product_id.lower() == keyword:
+            score = 0
+        elif name == keyword:
+            score = 1
+        elif keyword in self.tokens and product_id in self.tokens[keyword]:
+            score = 2
+        elif name.startswith(keyword):
+            score = 3
+        else:
+            score = 4
+        return (score, len(name), name, product_id)
+    
+    def search(self, keyword, limit=None, offset=0):
+        """Return matching product IDs, best first; same matches as a substring scan"""
+        keyword = keyword.lower()
+        matches = set(self.ids.get(keyword, ()))
+        matches.update(product_id for product_id in self.candidates(keyword)
+                       if keyword in self.names[product_id])
+        
+        if limit is None:
+            ranked = sorted(matches, key=lambda product_id: self.rank(keyword, product_id))
+            return ranked[offset:]
+        ranked = heapq.nsmallest(offset + limit, matches, key=lambda product_id: self.rank(keyword, product_id))
+        return ranked[offset:]
+
+class SortedAttributeIndex:
+    """Products ordered by one attribute, for range queries and cursor paging"""
+    
+    def __init__(self, attribute, transform=None):
+        self.attribute = attribute
+        self.transform = transform
+        self.entries = []  # sorted (value, product_id)
+        self.values = {}   # product_id -> indexed value
+    
+    def clear(self):
+        self.entries = []
+        self.values = {}
+    
+    def value_of(self, product):
+        value = getattr(product, self.attribute)
+        return self.transform(value) if self.transform else value
+    
+    def rebuild(self, products):
+        self.values = {product.product_id: self.value_of(product) for product in products}
+        self.entries = sorted((value, product_id) for product_id, value in self.values.items())
+    
+    def add(self, product):
+        product_id = product.product_id
+        value = self.value_of(product)
+        old_value = self.values.get(product_id)
+        if old_value == value:
+            return
+        if old_value is not None:
+            self.discard(product_id)
+        self.values[product_id] = value
+        insort(self.entries, (value, product_id))
+    
+    def discard(self, product_id):
+        value = self.values.pop(product_id, None)
+        if value is not None:
+            position = bisect_left(self.entries, (value, product_id))
+            del self.entries[position]
+    
+    def _span(self, low, high):
+        start = 0 if low is None else bisect_left(self.entries, low, key=itemgetter(0))
+        stop = len(self.entries) if high is None else bisect_right(self.entries, high, key=itemgetter(0))
+        return start, stop
+    
+    def count(self, low=None, high=None):
+        """Number of products with low <= value <= high"""
+        start, stop = self._span(low, high)
+        return max(stop - start, 0)
+    
+    def contains(self, product_id, low=None, high=None):
+        value = self.values.get(product_id)
+        return value is not None and (low is None or value >= low) and (high is None or value <= high)
+    
+    def scan(self, after=None, descending=False, low=None, high=None, filters=()):
+        """Yield (value, product_id) in order, starting past the cursor after.
+        
+        low and high are inclusive bounds; filters is a list of (index, low, high)
+        ranges on other indexes that each yielded product must also fall in.
+        """
+        entries = self.entries
+        start, stop = self._span(low, high)
+        if descending:
+            if after is not None:
+                stop = min(stop, bisect_left(entries, tuple(after)))
+            positions = range(stop - 1, start - 1, -1)
+        else:
+            if after is not None:
+                start = max(start, bisect_right(entries, tuple(after)))
+            positions = range(start, stop)
+        for position in positions:
+            entry = entries[position]
+            if all(index.contains(entry[1], index_low, index_high) for index, index_low, index_high in filters):
+                yield entry
+
+class StockLevelIndex(SortedAttributeIndex):
+    """Products ordered by stock quantity for threshold queries"""
+    
+    def __init__(self):
+        super().__init__('stock_quantity')
+    
+    def _cutoff(self, threshold):
+        return bisect_left(self.entries, (math.floor(threshold) + 1,))
+    
+    def at_or_below(self, threshold):
+        """Product IDs with stock_quantity <= threshold, lowest stock first"""
+        return [product_id for stock_quantity, product_id in self.entries[:self._cutoff(threshold)]]
+    
+    def count_at_or_below(self, threshold):
+        return self._cutoff(threshold)
+
+class InventoryAggregates:
+    """Running stock value and stock-level counts, plus a heap of the most valuable products"""
+    
+    def __init__(self, low_stock_threshold=5):
+        self.low_stock_threshold = low_stock_threshold
+        self.entries = {}  # product_id -> (stock_value, stock_quantity)
+        self.total_stock_value = 0.0
+        self.low_stock_count = 0
+        self.out_of_stock_count = 0
+        # Max-heap of (-stock_value, product_id); entries left behind by
+        # updates are skipped when read and dropped when the heap is rebuilt.
+        self.heap = []
+    
+    def clear(self):
+        self.__init__(self.low_stock_threshold)
+    
+    def rebuild(self, products):
+        self.clear()
+        for product in products:
+            entry = (product.price * product.stock_quantity, product.stock_quantity)
+            self.entries[product.product_id] = entry
+            self._count(entry, 1)
+        self._rebuild()
+    
+    def add(self, product):
+        stock_value = product.price * product.stock_quantity
+        entry = (stock_value, product.stock_quantity)
+        if self.entries.get(product.product_id) == entry:
+            return
+        self.discard(product.product_id)
+        self.entries[product.product_id] = entry
+        self._count(entry, 1)
+        heapq.heappush(self.heap, (-stock_value, product.product_id))
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self._rebuild()
+    
+    def discard(self, product_id):
+        entry = self.entries.pop(product_id, None)
+        if entry is not None:
+            self._count(entry, -1)
+    
+    def _count(self, entry, sign):
+        stock_value, stock_quantity = entry
+        self.total_stock_value += sign * stock_value
+        if stock_quantity <= self.low_stock_threshold:
+            self.low_stock_count += sign
+        if stock_quantity == 0:
+            self.out_of_stock_count += sign
+    
+    def _rebuild(self):
+        self.heap = [(-stock_value, product_id) for product_id, (stock_value, _) in self.entries.items()]
+        heapq.heapify(self.heap)
+        # Also resets floating point drift from the running total
+        self.total_stock_value = math.fsum(stock_value for stock_value, _ in self.entries.values())
+    
+    def top(self, k=5):
+        """(product_id, stock_value) pairs for the k most valuable products.
+        
+        Reorders the heap, so callers hold the same lock as add() and discard().
+        """
+        result = []
+        valid = []
+        while self.heap and len(result) < k:
+            item = heapq.heappop(self.heap)
+            neg_value, product_id = item
+            entry = self.entries.get(product_id)
+            if entry is None or entry[0] != -neg_value or any(product_id == seen for seen, _ in result):
+                continue
+            result.append((product_id, -neg_value))
+            valid.append(item)
+        for item in valid:
+            heapq.heappush(self.heap, item)
+        return result
+
+class InventoryChangeFeed:
+    """Versioned log of product changes for downstream sync.
+    
+    Each change to a product gets the next version number. The newest change
+    per product is kept in version order, so changes_since(v) walks back from
+    the end and stops at v: the cost follows the churn, not the catalog size.
+    Records are appended to changes_file as put,version,product_id and
+    del,version,product_id rows and replayed at startup; compaction starts the
+    file with a floor,floor_version,current_version row. Changes at or below the
+    floor have been compacted away, so callers that far behind need a full copy.
+    """
+    
+    def __init__(self, changes_file, compact_threshold=10000):
+        self.changes_file = changes_file
+        self.compact_threshold = compact_threshold
+        self.version = 0
+        self.floor = 0
+        self.latest = OrderedDict()  # product_id -> (version, op), oldest first
+        self.records = 0
+        self.file = None
+        self.lock = threading.RLock()
+        self.existed = os.path.exists(changes_file)
+        if self.existed:
+            self.load()
+    
+    def load(self):
+        try:
+            with open(self.changes_file, 'r', newline='', encoding='utf-8') as file:
+                reader = csv.reader(file)
+                for record in reader:
+                    try:
+                        op, version = record[0], int(record[1])
+                        if op == 'floor':
+                            self.floor = max(self.floor, version)
+                            version = max(version, int(record[2] or 0))
+                        elif op in ('put', 'del'):
+                            self.latest.pop(record[2], None)
+                            self.latest[record[2]] = (version, op)
+                        else:
+                            raise ValueError(f"unknown change operation {op!r}")
+                        self.version = max(self.version, version)
+                        self.records += 1
+                    except (ValueError, IndexError) as e:
+                        # A crash mid-append can leave a torn last record.
+                        print(f"Error parsing change record: {e}")
+                        continue
+                METRICS.count('store_rows_parsed_total', 'changes', reader.line_num)
+        except OSError as e:
+            print(f"Error reading change feed: {e}")
+    
+    def _append(self, row):
+        if self.file is None:
+            self.file = open(self.changes_file, 'a', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.file)
+        self.writer.writerow(row)
+        self.records += 1
+    
+    def record(self, product_id, op):
+        with self.lock:
+            self.version += 1
+            self.latest.pop(product_id, None)
+            self.latest[product_id] = (self.version, op)
+            self._append([op, self.version, product_id])
+            if self.records >= max(self.compact_threshold, 2 * len(self.latest)):
+                self.compact()
+    
+    def flush(self):
+        """Make the recorded changes durable; called before the inventory itself is written"""
+        with self.lock:
+            if self.file is not None:
+                start = self.file.tell()
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                METRICS.count('store_bytes_written_total', 'changes', self.file.tell() - start)
+    
+    # Inventory index protocol, so every mutation path is versioned
+    
+    def add(self, product):
+        self.record(product.product_id, 'put')
+    
+    def discard(self, product_id):
+        self.record(product_id, 'del')
+    
+    def clear(self):
+        pass
+    
+    def rebuild(self, products):
+        # A feed started on an existing catalog has no history for it yet
+        with self.lock:
+            if not self.existed and self.version == 0 and any(True for product in products):
+                self.version = self.floor = 1
+                self._append(['floor', 1, 1])
+                self.flush()
+            self.existed = True
+    
+    def changes_since(self, version):
+        """(current version, [(version, op, product_id)] after version, oldest first)"""
+        with self.lock:
+            changes = []
+            for product_id in reversed(self.latest):
+                change_version, op = self.latest[product_id]
+                if change_version <= version:
+                    break
+                changes.append((change_version, op, product_id))
+            changes.reverse()
+            return self.version, changes
+    
+    def compact(self, before_version=None):
+        """Rewrite the log with one record per product, dropping changes at or below before_version"""
+        with self.lock:
+            if before_version is not None:
+                before_version = min(before_version, self.version)
+                while self.latest:
+                    product_id, (change_version, op) = next(iter(self.latest.items()))
+                    if change_version > before_version:
+                        break
+                    del self.latest[product_id]
+                self.floor = max(self.floor, before_version)
+            temp_file = self.changes_file + '.tmp'
+            try:
+                with open(temp_file, 'w', newline='', encoding='utf-8') as file:
+                    writer = csv.writer(file)
+                    writer.writerow(['floor', self.floor, self.version])
+                    for product_id, (change_version, op) in self.latest.items():
+                        writer.writerow([op, change_version, product_id])
+                    file.flush()
+                    os.fsync(file.fileno())
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                os.replace(temp_file, self.changes_file)
+                self.records = len(self.latest) + 1
+                return True
+            except OSError as e:
+                print(f"Error compacting change feed: {e}")
+                return False
+
+class SalesIndex:
+    """Sales kept in datetime order with per-day and per-hour rollups"""
+    
+    def __init__(self, sales=()):
+        self.sales = []
+        self.keys = []    # sale datetimes, parallel to self.sales
+        self.daily = {}   # date -> [count, gross, discount, net]
+        self.hourly = {}  # (date, hour) -> [count, gross, discount, net]
+        for sale in sales:
+            self.add(sale)
+    
+    def add(self, sale):
+        sale_datetime = sale.datetime
+        if not self.keys or sale_datetime >= self.keys[-1]:
+            self.keys.append(sale_datetime)
+            self.sales.append(sale)
+        else:
+            position = bisect_right(self.keys, sale_datetime)
+            self.keys.insert(position, sale_datetime)
+            self.sales.insert(position, sale)
+        
+        day = sale_datetime.date()
+        for rollups, key in ((self.daily, day), (self.hourly, (day, sale_datetime.hour))):
+            totals = rollups.get(key)
+            if totals is None:
+                totals = rollups[key] = [0, 0, 0, 0]
+            totals[0] += 1
+            totals[1] += sale.total_amount
+            totals[2] += sale.discount
+            totals[3] += sale.final_amount
+    
+    def between(self, start, end):
+        """Sales with start <= datetime < end"""
+        return self.sales[bisect_left(self.keys, start):bisect_left(self.keys, end)]
+    
+    def iter_between(self, start, end):
+        """Yield the sales with start <= datetime < end without copying them into a list"""
+        position = bisect_left(self.keys, start)
+        while position < len(self.keys) and self.keys[position] < end:
+            yield self.sales[position]
+            position += 1
+    
+    def hourly_totals(self, target_date):
+        """{hour: [count, gross, discount, net]} for one day"""
+        hourly = {}
+        for hour in range(24):
+            totals = self.hourly.get((target_date, hour))
+            if totals is not None:
+                hourly[hour] = totals
+        return hourly
+    
+    def daily_totals(self, start_date, end_date):
+        """Summed [count, gross, discount, net] for the days in [start_date, end_date]"""
+        result = [0, 0, 0, 0]
+        days = (end_date - start_date).days + 1
+        if days <= 0:
+            return result
+        if days <= len(self.daily):
+            rows = (self.daily.get(start_date + timedelta(days=i)) for i in range(days))
+        else:
+            rows = (totals for day, totals in self.daily.items() if start_date <= day <= end_date)
+        for totals in rows:
+            if totals is not None:
+                for i in range(4):
+                    result[i] += totals[i]
+        return result
+
+class StockReservations:
+    """Stock held for open carts, per product and session; holds lapse after ttl seconds"""
+    
+    def __init__(self, ttl=900):
+        self.ttl = ttl
+        self.holds = {}  # product_id -> {session_id: (quantity, expires_at)}
+    
+    def _active(self, product_id, now):
+        holds = self.holds.get(product_id)
+        if holds:
+            for session_id in [session_id for session_id, (_, expires_at) in holds.items() if expires_at <= now]:
+                del holds[session_id]
+        return holds
+    
+    def reserved(self, product_id, exclude_session=None):
+        holds = self._active(product_id, time.monotonic())
+        if not holds:
+            return 0
+        return sum(quantity for session_id, (quantity, _) in holds.items() if session_id != exclude_session)
+    
+    def hold(self, product_id, session_id, quantity):
+        if quantity <= 0:
+            self.release(product_id, session_id)
+        else:
+            self.holds.setdefault(product_id, {})[session_id] = (quantity, time.monotonic() + self.ttl)
+    
+    def release(self, product_id, session_id):
+        holds = self.holds.get(product_id)
+        if holds is not None:
+            holds.pop(session_id, None)
+            if not holds:
+                self.holds.pop(product_id, None)
+
+def validate_import_chunk(columns, rows):
+    """Validate (line_number, row) pairs from an import file in a worker process"""
+    valid = []
+    rejects = []
+    try:
+        id_col = columns.index('product_id')
+        name_col = columns.index('name')
+        price_col = columns.index('price')
+        stock_col = columns.index('stock_quantity')
+    except ValueError as e:
+        return valid, [(line_num, '', f"missing column: {e}") for line_num, row in rows]
+    
+    for line_num, row in rows:
+        try:
+            product_id = row[id_col]
+            name = row[name_col]
+            price = float(row[price_col])
+            stock_quantity = int(row[stock_col])
+        except IndexError:
+            rejects.append((line_num, row[id_col] if len(row) > id_col else '', "missing fields"))
+            continue
+        except ValueError as e:
+            rejects.append((line_num, row[id_col], f"invalid number: {e}"))
+            continue
+        if price <= 0:
+            rejects.append((line_num, product_id, "price must be greater than zero"))
+        elif stock_quantity < 0:
+            rejects.append((line_num, product_id, "stock quantity cannot be negative"))
+        else:
+            valid.append((line_num, product_id, name, price, stock_quantity))
+    return valid, rejects
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Operation metrics. Disabled by default: an instrumented method then costs one
+# attribute check. METRICS.enable() turns on latency histograms and counters,
+# and optionally a sampling profiler that keeps the stacks of slow operations.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# counter name -> (label name, help text)
+METRIC_COUNTERS = {
+    'store_operation_errors_total': ('operation', "Instrumented operations that failed or raised"),
+    'store_bytes_written_total': ('file', "Bytes written to data files"),
+    'store_rows_parsed_total': ('file', "CSV rows and journal records parsed"),
+    'store_slow_operations_total': ('operation', "Operations slower than the profiler threshold"),
+}
+
+def metric_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class SamplingProfiler:
+    """Sample the stacks of running instrumented operations; keep those of slow ones.
+    
+    Slow operations are appended to output in folded-stack format
+    ("operation;frame;frame count" lines), which flamegraph tools read directly.
+    """
+    
+    def __init__(self, threshold=0.1, interval=0.005, output='slow_operations.folded'):
+        self.threshold = threshold
+        self.interval = interval
+        self.output = output
+        self.lock = threading.Lock()
+        self.active = {}  # thread id -> (operation, Counter of folded stacks)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='store-profiler', daemon=True)
+        self.thread.start()
+    
+    def begin(self, operation):
+        thread_id = threading.get_ident()
+        with self.lock:
+            if thread_id in self.active:
+                return None  # nested operation; the outer one is already sampled
+            self.active[thread_id] = (operation, Counter())
+        return thread_id
+    
+    def end(self, thread_id, seconds):
+        """Finish sampling; True if the operation was slow enough to keep"""
+        with self.lock:
+            operation, samples = self.active.pop(thread_id)
+        if seconds < self.threshold:
+            return False
+        try:
+            with open(self.output, 'a', encoding='utf-8') as file:
+                for stack, count in samples.items():
+                    file.write(f"{operation};{stack} {count}\n")
+        except OSError as e:
+            print(f"Error writing profile samples: {e}")
+        return True
+    
+    @staticmethod
+    def fold(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+    
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, (operation, samples) in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self.fold(frame)] += 1
+    
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+class Metrics:
+    """Latency histograms and counters, rendered in the Prometheus text format"""
+    
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.latencies = {}  # operation -> [bucket counts (last is +Inf), sum of seconds]
+        self.counters = {}   # (counter name, label value) -> total
+        self.profiler = None
+        self._writer = None
+    
+    def enable(self, profile_threshold=None, profile_output='slow_operations.folded'):
+        self.enabled = True
+        if profile_threshold is not None and self.profiler is None:
+            self.profiler = SamplingProfiler(profile_threshold, output=profile_output)
+    
+    def disable(self):
+        self.enabled = False
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+        if self._writer is not None:
+            self._writer.set()
+            self._writer = None
+    
+    def reset(self):
+        with self.lock:
+            self.latencies.clear()
+            self.counters.clear()
+    
+    def count(self, name, label, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            key = (name, label)
+            self.counters[key] = self.counters.get(key, 0) + amount
+    
+    def observe(self, operation, seconds):
+        with self.lock:
+            entry = self.latencies.get(operation)
+            if entry is None:
+                entry = self.latencies[operation] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            entry[0][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            entry[1] += seconds
+    
+    def call(self, operation, failure, method, args, kwargs):
+        profiler = self.profiler
+        token = profiler.begin(operation) if profiler is not None else None
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            self.count('store_operation_errors_total', operation)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(operation, seconds)
+            if token is not None and profiler.end(token, seconds):
+                self.count('store_slow_operations_total', operation)
+        if result is failure:
+            self.count('store_operation_errors_total', operation)
+        return result
+    
+    def render(self):
+        lines = ["# HELP store_operation_duration_seconds Latency of store operations",
+                 "# TYPE store_operation_duration_seconds histogram"]
+        with self.lock:
+            latencies = {operation: (list(buckets), total) for operation, (buckets, total) in self.latencies.items()}
+            counters = dict(self.counters)
+        for operation, (buckets, total) in sorted(latencies.items()):
+            label = metric_label(operation)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append(f'store_operation_duration_seconds_bucket{{operation="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'store_operation_duration_seconds_sum{{operation="{label}"}} {total}')
+            lines.append(f'store_operation_duration_seconds_count{{operation="{label}"}} {cumulative}')
+        for name, (label_name, help_text) in METRIC_COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter, label), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'{name}{{{label_name}="{metric_label(label)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+    
+    def write(self, path):
+        temp_file = path + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as file:
+                file.write(self.render())
+            os.replace(temp_file, path)
+            return True
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+            return False
+    
+    def write_every(self, path, interval=15.0):
+        """Rewrite the metrics file every interval seconds from a background thread"""
+        stopped = threading.Event()
+        def run():
+            while not stopped.wait(interval):
+                self.write(path)
+        threading.Thread(target=run, name='store-metrics', daemon=True).start()
+        self._writer = stopped
+
+METRICS = Metrics()
+
+def instrumented(operation, failure=False):
+    """Record latency and errors of a method under operation while METRICS is enabled.
+    
+    A return value that is failure (False by default) counts as an error.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return method(*args, **kwargs)
+            return METRICS.call(operation, failure, method, args, kwargs)
+        return wrapper
+    return decorate
+
+# Binary snapshots: a header, fixed-width records, then (for products) a string table.
+SNAPSHOT_HEADER = struct.Struct('<8sqqQ')   # magic, source CSV size, source CSV mtime_ns, record count
+PRODUCT_RECORD = struct.Struct('<IIIIdq')   # id offset, id length, name offset, name length, price, stock
+SALE_RECORD = struct.Struct('<qqdd')        # sale_id, microseconds since SNAPSHOT_EPOCH, total_amount, discount
+SNAPSHOT_EPOCH = datetime(1970, 1, 1)
+
+# Sale line items: fixed-width records appended to <sales file>.items, with
+# product ids coded through the append-only list in <sales file>.items.ids.
+LINE_ITEM_RECORD = struct.Struct('<qqIidd')  # sale id, microseconds since SNAPSHOT_EPOCH, product code, quantity, unit price, total
+if np is not None:
+    LINE_ITEM_DTYPE = np.dtype([('sale', '<i8'), ('time', '<i8'), ('product', '<u4'),
+                                ('quantity', '<i4'), ('price', '<f8'), ('total', '<f8')])
+
+def epoch_microseconds(value):
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return (value - SNAPSHOT_EPOCH) // timedelta(microseconds=1)
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def complete_length(path, chunk_size=65536):
+    """Size of path up to and including its last newline; the rest is a record torn by a crash"""
+    with open(path, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - chunk_size, 0)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+        return 0
+
+def complete_lines(file):
+    """Decoded lines of a binary file, leaving out a final line torn by a crash"""
+    for line in file:
+        if not line.endswith(b'\n'):
+            return
+        yield line.decode('utf-8')
+
+def truncate_torn_tail(path):
+    """Cut path back to its last newline before appending to it; returns the bytes dropped"""
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    end = complete_length(path)
+    if end < size:
+        os.truncate(path, end)
+        print(f"Dropped {size - end} bytes of a torn record from the end of {path}")
+    return size - end
+
+def record_checksum(fields):
+    """CRC of a journal record's fields, stored as its last field to catch torn or corrupt records"""
+    return zlib.crc32('\x1f'.join(fields).encode('utf-8'))
+
+def write_snapshot_file(path, magic, signature, count, *sections):
+    temp_file = path + '.tmp'
+    with open(temp_file, 'wb') as file:
+        file.write(SNAPSHOT_HEADER.pack(magic, signature[0], signature[1], count))
+        for section in sections:
+            file.write(section)
+        METRICS.count('store_bytes_written_total', 'snapshot', file.tell())
+    os.replace(temp_file, path)
+
+def put_product(products, product_id, name, price, stock_quantity):
+    if isinstance(products, ColumnarProductStore):
+        # Write straight into the columns without building a Product
+        products.put(product_id, name, price, stock_quantity)
+    else:
+        products[product_id] = Product(product_id, name, price, stock_quantity)
+
+# Storage backends. An inventory backend offers load_products(products),
+# save_products(products), write_changes(products, changed, deleted),
+# compact(products) and transaction(); a sales backend offers load_sales(),
+# save_sales(sales), append_sale(sale), append_sales(sales), flush(),
+# transaction() and line_item_analytics().
+# Backends with query_backed = True keep the data on disk and also provide
+# inventory_indexes() / sales_index() objects that answer queries in place.
+
+class CSVInventoryStorage:
+    """Inventory in a CSV file, with an optional change journal and binary snapshot"""
+    query_backed = False
+    
+    def __init__(self, data_file='inventory.csv', journal=False, compact_threshold=1000, snapshot=False):
+        self.data_file = data_file
+        # With snapshot=True a binary copy of the CSV is kept in <data_file>.snap
+        # and used at startup while it still matches the CSV's size and mtime.
+        self.snapshot = snapshot
+        self.snapshot_file = data_file + '.snap'
+        # In journal mode each mutation is appended to a log and the CSV is
+        # only rewritten when the journal grows past compact_threshold.
+        self.journal = journal
+        self.journal_file = data_file + '.journal'
+        self.compact_threshold = compact_threshold
+        self.journal_entries = 0
+        # Set once a torn last record has been cut off, before the first append
+        self.journal_checked = False
+    
+    def transaction(self):
+        return nullcontext()
+    
+    def load_products(self, products):
+        if self.snapshot and self.load_snapshot(products):
+            print(f"Loaded {len(products)} products from {self.snapshot_file}")
+        elif os.path.exists(self.data_file):
+            try:
+                with open(self.data_file, 'r', newline='', encoding='utf-8') as file:
+                    reader = csv.DictReader(file)
+                    for row in reader:
+                        try:
+                            put_product(
+                                products,
+                                row['product_id'],
+                                row['name'],
+                                float(row['price']),
+                                int(row['stock_quantity'])
+                            )
+                        except (ValueError, KeyError) as e:
+                            print(f"Error parsing product data: {e}")
+                            continue
+                    METRICS.count('store_rows_parsed_total', 'inventory', reader.line_num - 1)
+                print(f"Loaded {len(products)} products from {self.data_file}")
+                if self.snapshot:
+                    self.write_snapshot(products)
+            except Exception as e:
+                print(f"Error loading inventory data: {e}")
+        else:
+            print("No existing inventory file found. Starting with empty inventory.")
+        if self.journal:
+            self.replay_journal(products)
+        return products
+    
+    def replay_journal(self, products):
+        self.journal_entries = 0
+        if not os.path.exists(self.journal_file):
+            return
+        try:
+            # Replay only reads: a final record with no newline was torn by a
+            # crash and is skipped here, then cut off before the next append
+            end = complete_length(self.journal_file)
+            if end < os.path.getsize(self.journal_file):
+                print(f"Ignoring a torn record at the end of {self.journal_file}")
+            with open(self.journal_file, 'rb') as raw:
+                data = raw.read(end).decode('utf-8')
+            with io.StringIO(data, newline='') as file:
+                reader = csv.reader(file)
+                for record in reader:
+                    try:
+                        # Records have op, product_id, name, price, stock and (since
+                        # checksums were added) a CRC of those five fields
+                        if len(record) == 6 and int(record[5]) != record_checksum(record[:5]):
+                            raise ValueError("checksum mismatch")
+                        op, product_id = record[0], record[1]
+                        if op == 'put':
+                            put_product(products, product_id, record[2], float(record[3]), int(record[4]))
+                        elif op == 'del':
+                            products.pop(product_id, None)
+                        else:
+                            raise ValueError(f"unknown journal operation {op!r}")
+                        self.journal_entries += 1
+                    except (ValueError, IndexError) as e:
+                        print(f"Error parsing journal record {reader.line_num}: {e}")
+                        continue
+                METRICS.count('store_rows_parsed_total', 'journal', reader.line_num)
+            if self.journal_entries:
+                print(f"Replayed {self.journal_entries} journal records from {self.journal_file}")
+        except Exception as e:
+            print(f"Error replaying inventory journal: {e}")
+    
+    def save_products(self, products):
+        temp_file = self.data_file + '.tmp'
+        try:
+            with open(temp_file, 'w', newline='', encoding='utf-8') as file:
+                fieldnames = ['product_id', 'name', 'price', 'stock_quantity']
+                writer = csv.DictWriter(file, fieldnames=fieldnames)
+                writer.writeheader()
+                for product in products.values():
+                    writer.writerow(product.to_dict())
+                file.flush()
+                os.fsync(file.fileno())
+                METRICS.count('store_bytes_written_total', 'inventory', file.tell())
+            os.replace(temp_file, self.data_file)
+            if self.snapshot:
+                self.write_snapshot(products)
+            return True
+        except Exception as e:
+            print(f"Error saving inventory data: {e}")
+            return False
+    
+    def write_snapshot(self, products):
+        try:
+            records = bytearray()
+            strings = bytearray()
+            for product in products.values():
+                product_id = product.product_id.encode('utf-8')
+                name = product.name.encode('utf-8')
+                records += PRODUCT_RECORD.pack(len(strings), len(product_id), len(strings) + len(product_id),
+                                               len(name), product.price, product.stock_quantity)
+                strings += product_id
+                strings += name
+            write_snapshot_file(self.snapshot_file, b'INVSNAP1', file_signature(self.data_file),
+                                len(products), records, strings)
+        except Exception as e:
+            print(f"Error writing inventory snapshot: {e}")
+    
+    def load_snapshot(self, products):
+        """Fill products from the snapshot; False if it is missing or stale"""
+        if not (os.path.exists(self.snapshot_file) and os.path.exists(self.data_file)):
+            return False
+        try:
+            with open(self.snapshot_file, 'rb') as file, \
+                 mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, size, mtime_ns, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+                if magic != b'INVSNAP1' or (size, mtime_ns) != file_signature(self.data_file):
+                    print("Inventory snapshot is stale; rebuilding from CSV.")
+                    return False
+                start = SNAPSHOT_HEADER.size
+                end = start + count * PRODUCT_RECORD.size
+                strings = data[end:]
+                for id_offset, id_length, name_offset, name_length, price, stock_quantity in \
+                        PRODUCT_RECORD.iter_unpack(data[start:end]):
+                    put_product(products,
+                                strings[id_offset:id_offset + id_length].decode('utf-8'),
+                                strings[name_offset:name_offset + name_length].decode('utf-8'),
+                                price, stock_quantity)
+            return True
+        except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+            print(f"Error reading inventory snapshot: {e}")
+            products.clear()
+            return False
+    
+    def compact(self, products):
+        """Rewrite the data file from memory and start a fresh journal"""
+        if not self.save_products(products):
+            return False
+        try:
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            self.journal_entries = 0
+            return True
+        except Exception as e:
+            print(f"Error truncating inventory journal: {e}")
+            return False
+    
+    def write_changes(self, products, changed=(), deleted=()):
+        if not self.journal:
+            return self.save_products(products)
+        
+        try:
+            if not self.journal_checked:
+                truncate_torn_tail(self.journal_file)
+                self.journal_checked = True
+            with open(self.journal_file, 'a', newline='', encoding='utf-8') as file:
+                start = file.tell()
+                writer = csv.writer(file)
+                records = [['put', product.product_id, product.name, str(product.price), str(product.stock_quantity)]
+                           for product in changed]
+                records += [['del', product_id, '', '', ''] for product_id in deleted]
+                for record in records:
+                    writer.writerow(record + [record_checksum(record)])
+                file.flush()
+                os.fsync(file.fileno())
+                METRICS.count('store_bytes_written_total', 'journal', file.tell() - start)
+            self.journal_entries += len(records)
+        except Exception as e:
+            print(f"Error writing inventory journal: {e}")
+            return False
+        
+        if self.journal_entries >= self.compact_threshold:
+            return self.compact(products)
+        return True
+
+SALES_FIELDNAMES = ['datetime', 'total_amount', 'discount', 'final_amount']
+LEDGER_FIELDNAMES = ['sale_id'] + SALES_FIELDNAMES
+
+class CSVSalesStorage:
+    """Sales in an append-only CSV ledger with group commit and an optional binary snapshot"""
+    query_backed = False
+    
+    def __init__(self, sales_file='sales.csv', flush_interval=0, snapshot=False):
+        self.sales_file = sales_file
+        # The snapshot covers the ledger up to the CSV size it records; rows
+        # appended since are parsed from that offset and the snapshot refreshed.
+        self.snapshot = snapshot
+        self.snapshot_file = sales_file + '.snap'
+        # With flush_interval > 0, sales appended within the interval are
+        # written and fsynced together (group commit).
+        self.flush_interval = flush_interval
+        self.pending_sales = []
+        self._flush_lock = threading.Lock()
+        self._flush_timer = None
+        # Called as callback(sales) once the sales' ledger rows are on disk
+        self.committed_subscribers = []
+        # A sale's id is stored in its ledger row; its line items are
+        # appended to items_file under that id when the sale is flushed.
+        self.items_file = sales_file + '.items'
+        self.item_ids_file = sales_file + '.items.ids'
+        self.next_sale_id = 0
+        self.product_codes = None  # product_id -> code, read on first use
+        self.ledger_checked = False  # torn final row cut off before the first append
+        self.ledger_fieldnames = LEDGER_FIELDNAMES  # the header of a ledger written before sale ids were stored
+    
+    def transaction(self):
+        return nullcontext()
+    
+    def load_sales(self):
+        sales = []
+        if os.path.exists(self.sales_file):
+            try:
+                offset = self.load_snapshot(sales) if self.snapshot else 0
+                if offset is None:
+                    offset = 0
+                size = os.path.getsize(self.sales_file)
+                if complete_length(self.sales_file) < size:
+                    print(f"Ignoring a torn sale row at the end of {self.sales_file}")
+                if offset < size:
+                    self.read_sales_csv(sales, offset)
+                    if self.snapshot:
+                        self.write_snapshot(sales)
+                self.next_sale_id = max((sale.sale_id for sale in sales if sale.sale_id is not None), default=-1) + 1
+                print(f"Loaded {len(sales)} sales records from {self.sales_file}")
+                if self.ledger_fieldnames != LEDGER_FIELDNAMES:
+                    self.add_sale_ids(sales)
+                self.check_items()
+            except Exception as e:
+                print(f"Error loading sales data: {e}")
+        else:
+            print("No existing sales file found. Starting with empty sales history.")
+            self.check_items()
+        return sales
+    
+    def add_sale_ids(self, sales):
+        """Rewrite a ledger from before sale ids were stored, numbering its sales by position.
+        
+        Those sales were numbered that way when their line items were written,
+        so the items keep matching; from here on the ids are read from the ledger.
+        """
+        print(f"Adding sale ids to {self.sales_file}")
+        for sale_id, sale in enumerate(sales):
+            sale.sale_id = sale_id
+        self.next_sale_id = len(sales)
+        self.ledger_fieldnames = LEDGER_FIELDNAMES
+        self.save_sales(sales)
+    
+    def check_items(self):
+        """Set the line-item files aside if they name sales past the end of the ledger.
+        
+        Sale ids only grow, so that only happens when the ledger was replaced
+        or reset; the old items would otherwise be counted under new sales.
+        """
+        if not os.path.exists(self.items_file):
+            return
+        size = os.path.getsize(self.items_file) // LINE_ITEM_RECORD.size * LINE_ITEM_RECORD.size
+        if size == 0:
+            return
+        with open(self.items_file, 'rb') as file:
+            file.seek(size - LINE_ITEM_RECORD.size)
+            last_sale_id = LINE_ITEM_RECORD.unpack(file.read(LINE_ITEM_RECORD.size))[0]
+        if last_sale_id < self.next_sale_id:
+            return
+        print(f"{self.items_file} refers to sale {last_sale_id} but {self.sales_file} has {self.next_sale_id} sales; "
+              f"moving the line items to {self.items_file}.stale")
+        with self._flush_lock:
+            os.replace(self.items_file, self.items_file + '.stale')
+            if os.path.exists(self.item_ids_file):
+                os.replace(self.item_ids_file, self.item_ids_file + '.stale')
+            self.product_codes = None
+    
+    def sales_totals(self, start_date, end_date):
+        """[count, gross, discount, net] of the ledger's sales on the days in [start_date, end_date].
+        
+        Streams the CSV without building Sale objects or touching the snapshot;
+        rows outside the range are skipped on their date prefix alone.
+        """
+        totals = [0, 0.0, 0.0, 0.0]
+        if not os.path.exists(self.sales_file):
+            return totals
+        low, high = start_date.isoformat(), end_date.isoformat()
+        with open(self.sales_file, 'rb') as file:
+            reader = csv.reader(complete_lines(file))
+            columns = next(reader, [])
+            try:
+                datetime_col = columns.index('datetime')
+                total_col = columns.index('total_amount')
+            except ValueError:
+                print(f"Error reading {self.sales_file}: missing datetime or total_amount column")
+                return totals
+            discount_col = columns.index('discount') if 'discount' in columns else None
+            for row in reader:
+                try:
+                    if not low <= row[datetime_col][:10] <= high:
+                        continue
+                    total_amount = float(row[total_col])
+                    discount = float(row[discount_col]) if discount_col is not None else 0.0
+                except (ValueError, IndexError) as e:
+                    print(f"Error parsing sale data: {e}")
+                    continue
+                totals[0] += 1
+                totals[1] += total_amount
+                totals[2] += discount
+                totals[3] += total_amount - discount
+            METRICS.count('store_rows_parsed_total', 'sales', reader.line_num)
+        return totals
+    
+    def read_sales_csv(self, sales, offset=0):
+        with open(self.sales_file, 'rb') as raw:
+            fieldnames = next(csv.reader([raw.readline().decode('utf-8')]))
+            self.ledger_fieldnames = fieldnames
+            if offset:
+                raw.seek(offset)
+            # A final row without its newline was torn by a crash; skip it
+            reader = csv.DictReader(complete_lines(raw), fieldnames=fieldnames)
+            for row in reader:
+                try:
+                    total_amount = float(row['total_amount'])
+                    discount = float(row.get('discount', 0))
+                    sale_datetime = datetime.fromisoformat(row['datetime'])
+                    sale_id = int(row['sale_id']) if 'sale_id' in row else None
+                    
+                    sale = Sale([], total_amount, sale_datetime, discount, sale_id)
+                    sales.append(sale)
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Error parsing sale data: {e}")
+                    continue
+            METRICS.count('store_rows_parsed_total', 'sales', reader.line_num)
+    
+    def write_snapshot(self, sales):
+        try:
+            records = bytearray()
+            for sale in sales:
+                if sale.datetime.tzinfo is not None:
+                    return
+                if sale.sale_id is None:
+                    return
+                microseconds = (sale.datetime - SNAPSHOT_EPOCH) // timedelta(microseconds=1)
+                records += SALE_RECORD.pack(sale.sale_id, microseconds, sale.total_amount, sale.discount)
+            write_snapshot_file(self.snapshot_file, b'SALSNAP2', file_signature(self.sales_file),
+                                len(sales), records)
+        except Exception as e:
+            print(f"Error writing sales snapshot: {e}")
+    
+    def load_snapshot(self, sales):
+        """Fill sales from the snapshot and return the CSV offset it covers, or None"""
+        if not os.path.exists(self.snapshot_file):
+            return None
+        try:
+            with open(self.snapshot_file, 'rb') as file, \
+                 mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, size, mtime_ns, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+                current_size, current_mtime_ns = file_signature(self.sales_file)
+                if magic != b'SALSNAP2' or current_size < size or (current_size == size and current_mtime_ns != mtime_ns):
+                    print("Sales snapshot is stale; rebuilding from CSV.")
+                    return None
+                if current_size > size:
+                    # Only an append keeps the snapshot valid: the covered part must end on a row boundary
+                    with open(self.sales_file, 'rb') as ledger:
+                        ledger.seek(size - 1)
+                        if ledger.read(1) != b'\n':
+                            print("Sales snapshot is stale; rebuilding from CSV.")
+                            return None
+                start = SNAPSHOT_HEADER.size
+                end = start + count * SALE_RECORD.size
+                for sale_id, microseconds, total_amount, discount in SALE_RECORD.iter_unpack(data[start:end]):
+                    sales.append(Sale([], total_amount, SNAPSHOT_EPOCH + timedelta(microseconds=microseconds),
+                                      discount, sale_id))
+            return size
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Error reading sales snapshot: {e}")
+            sales.clear()
+            return None
+    
+    def save_sales(self, sales):
+        with self._flush_lock:
+            self.pending_sales.clear()
+            # Keep ledger order: sales in id order, new ones after
+            sales = sorted(sales, key=lambda sale: math.inf if sale.sale_id is None else sale.sale_id)
+            for sale in sales:
+                if sale.sale_id is None:
+                    sale.sale_id = self.next_sale_id
+                    self.next_sale_id += 1
+            try:
+                with open(self.sales_file, 'w', newline='', encoding='utf-8') as file:
+                    writer = csv.DictWriter(file, fieldnames=LEDGER_FIELDNAMES)
+                    writer.writeheader()
+                    for sale in sales:
+                        writer.writerow(self.sale_row(sale))
+                    METRICS.count('store_bytes_written_total', 'sales', file.tell())
+                self.ledger_fieldnames = LEDGER_FIELDNAMES
+                if self.snapshot:
+                    self.write_snapshot(sales)
+                return True
+            except Exception as e:
+                print(f"Error saving sales data: {e}")
+                return False
+    
+    @staticmethod
+    def sale_row(sale):
+        return {
+            'sale_id': sale.sale_id,
+            'datetime': sale.datetime.isoformat(),
+            'total_amount': float(sale.total_amount),
+            'discount': float(sale.discount),
+            'final_amount': float(sale.final_amount)
+        }
+    
+    def append_sale(self, sale):
+        return self.append_sales([sale])
+    
+    def append_sales(self, sales):
+        """Queue sales for the ledger, flushing now or within flush_interval"""
+        with self._flush_lock:
+            for sale in sales:
+                sale.sale_id = self.next_sale_id
+                self.next_sale_id += 1
+            self.pending_sales.extend(sales)
+            if self.flush_interval > 0:
+                if self._flush_timer is None:
+                    self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+                return True
+        return self.flush()
+    
+    def flush(self):
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self.pending_sales:
+                return True
+            try:
+                self.append_rows(self.pending_sales)
+                self.write_items(self.pending_sales)
+            except Exception as e:
+                print(f"Error appending sales data: {e}")
+                return False
+            for callback in self.committed_subscribers:
+                callback(self.pending_sales)
+            self.pending_sales.clear()
+            return True
+    
+    def subscribe_committed(self, callback):
+        self.committed_subscribers.append(callback)
+    
+    def append_rows(self, sales):
+        if not self.ledger_checked:
+            truncate_torn_tail(self.sales_file)
+            self.ledger_checked = True
+        new_file = not os.path.exists(self.sales_file) or os.path.getsize(self.sales_file) == 0
+        if new_file:
+            self.ledger_fieldnames = LEDGER_FIELDNAMES
+        with open(self.sales_file, 'a', newline='', encoding='utf-8') as file:
+            start = file.tell()
+            # A ledger whose ids have not been added yet keeps its old columns
+            writer = csv.DictWriter(file, fieldnames=self.ledger_fieldnames, extrasaction='ignore')
+            if new_file:
+                writer.writeheader()
+            for sale in sales:
+                writer.writerow(self.sale_row(sale))
+            file.flush()
+            os.fsync(file.fileno())
+            METRICS.count('store_bytes_written_total', 'sales', file.tell() - start)
+    
+    def item_codes(self):
+        """product_id -> code for the items file (called with _flush_lock held).
+        
+        The first call also drops a torn id line or partial record left by a crash.
+        """
+        if self.product_codes is None:
+            codes = {}
+            if os.path.exists(self.item_ids_file):
+                with open(self.item_ids_file, 'r+b') as file:
+                    data = file.read()
+                    end = data.rfind(b'\n') + 1
+                    if end < len(data):
+                        file.truncate(end)
+                for product_id in data[:end].decode('utf-8').split('\n')[:-1]:
+                    codes[product_id] = len(codes)
+            if os.path.exists(self.items_file):
+                size = os.path.getsize(self.items_file)
+                if size % LINE_ITEM_RECORD.size:
+                    os.truncate(self.items_file, size - size % LINE_ITEM_RECORD.size)
+            self.product_codes = codes
+        return self.product_codes
+    
+    def write_items(self, sales):
+        """Append the line items of flushed sales (called with _flush_lock held)"""
+        try:
+            codes = self.item_codes()
+            new_ids = []
+            records = bytearray()
+            for sale in sales:
+                microseconds = epoch_microseconds(sale.datetime)
+                for item in sale.items:
+                    product_id = item.product.product_id
+                    code = codes.get(product_id)
+                    if code is None:
+                        code = codes[product_id] = len(codes)
+                        new_ids.append(product_id)
+                    records += LINE_ITEM_RECORD.pack(sale.sale_id, microseconds, code, item.quantity,
+                                                     item.total / item.quantity, item.total)
+            # Ids first, so every code in the items file can be resolved
+            for path, data in ((self.item_ids_file, ''.join(f"{product_id}\n" for product_id in new_ids).encode('utf-8')),
+                               (self.items_file, records)):
+                if data:
+                    with open(path, 'ab') as file:
+                        file.write(data)
+                        file.flush()
+                        os.fsync(file.fileno())
+                    METRICS.count('store_bytes_written_total', 'items', len(data))
+            return True
+        except Exception as e:
+            print(f"Error appending sale line items: {e}")
+            self.product_codes = None  # reread what actually reached the disk
+            return False
+    
+    def line_item_analytics(self):
+        return LineItemAnalytics(self)
+
+class LineItemAnalytics:
+    """Product-level sales analytics over the line-item file.
+    
+    With NumPy the file is memory-mapped and aggregated with vectorized
+    operations; without it the same answers come from a plain-Python scan.
+    Dates are inclusive, as in get_sales_report(); amounts are line totals
+    before sale-level discounts.
+    """
+    
+    def __init__(self, storage):
+        self.storage = storage
+    
+    def product_ids(self):
+        with self.storage._flush_lock:
+            return list(self.storage.item_codes())
+    
+    def line_items(self, start_date, end_date):
+        """Line items sold between the dates: a NumPy record array, or a list of tuples"""
+        self.storage.flush()  # include sales still waiting for group commit
+        product_ids = self.product_ids()  # read first so every code in the file is known
+        low = epoch_microseconds(datetime.combine(start_date, datetime.min.time()))
+        high = epoch_microseconds(datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+        path = self.storage.items_file
+        count = os.path.getsize(path) // LINE_ITEM_RECORD.size if os.path.exists(path) else 0
+        if np is not None:
+            if count == 0:
+                return product_ids, np.zeros(0, dtype=LINE_ITEM_DTYPE)
+            items = np.memmap(path, dtype=LINE_ITEM_DTYPE, mode='r', shape=(count,))
+            times = items['time']
+            return product_ids, items[(times >= low) & (times < high) & (items['product'] < len(product_ids))]
+        if count == 0:
+            return product_ids, []
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return product_ids, [record for record in LINE_ITEM_RECORD.iter_unpack(data[:count * LINE_ITEM_RECORD.size])
+                                 if low <= record[1] < high and record[2] < len(product_ids)]
+    
+    def product_totals(self, start_date, end_date):
+        """{product_id: (units, revenue)} for every product sold between the dates"""
+        product_ids, items = self.line_items(start_date, end_date)
+        if np is not None:
+            units = np.bincount(items['product'], weights=items['quantity'], minlength=len(product_ids))
+            revenue = np.bincount(items['product'], weights=items['total'], minlength=len(product_ids))
+            return {product_ids[code]: (int(units[code]), float(revenue[code])) for code in np.flatnonzero(units)}
+        totals = {}
+        for sale_id, time_us, code, quantity, price, total in items:
+            entry = totals.setdefault(product_ids[code], [0, 0.0])
+            entry[0] += quantity
+            entry[1] += total
+        return {product_id: tuple(entry) for product_id, entry in totals.items()}
+    
+    def top_sellers(self, start_date, end_date, limit=10, by='units'):
+        """[(product_id, units, revenue)] for the best sellers by units or by revenue"""
+        position = 1 if by == 'units' else 2
+        rows = [(product_id, units, revenue) for product_id, (units, revenue) in self.product_totals(start_date, end_date).items()]
+        return heapq.nlargest(limit, rows, key=lambda row: row[position])
+    
+    def revenue_by_product(self, start_date, end_date):
+        totals = self.product_totals(start_date, end_date)
+        return dict(sorted(((product_id, revenue) for product_id, (units, revenue) in totals.items()),
+                           key=lambda entry: entry[1], reverse=True))
+    
+    def units_by_hour(self, start_date, end_date):
+        """{hour of day: units sold} over the dates"""
+        product_ids, items = self.line_items(start_date, end_date)
+        if np is not None:
+            hours = (items['time'] // 3600000000) % 24
+            units = np.bincount(hours, weights=items['quantity'], minlength=24)
+            return {hour: int(units[hour]) for hour in range(24)}
+        units = dict.fromkeys(range(24), 0)
+        for sale_id, time_us, code, quantity, price, total in items:
+            units[time_us // 3600000000 % 24] += quantity
+        return units
+    
+    def decayed_units(self, start_date, end_date, now, tau_days):
+        """{product_id: units sold between the dates, each weighted by exp(-age / tau_days)}"""
+        product_ids, items = self.line_items(start_date, end_date)
+        now_us = epoch_microseconds(now)
+        scale = 86400e6 * tau_days
+        if np is not None:
+            weights = items['quantity'] * np.exp((items['time'] - now_us) / scale)
+            totals = np.bincount(items['product'], weights=weights, minlength=len(product_ids))
+            return {product_ids[code]: float(totals[code]) for code in np.flatnonzero(totals)}
+        totals = {}
+        for sale_id, time_us, code, quantity, price, total in items:
+            product_id = product_ids[code]
+            totals[product_id] = totals.get(product_id, 0.0) + quantity * math.exp((time_us - now_us) / scale)
+        return totals
+    
+    def basket_sizes(self, start_date, end_date):
+        """{units in a sale: number of sales} over the dates"""
+        product_ids, items = self.line_items(start_date, end_date)
+        if np is not None:
+            if len(items) == 0:
+                return {}
+            sales, position = np.unique(items['sale'], return_inverse=True)
+            per_sale = np.bincount(position, weights=items['quantity']).astype(np.int64)
+            sizes, counts = np.unique(per_sale, return_counts=True)
+            return {int(size): int(count) for size, count in zip(sizes, counts)}
+        per_sale = Counter()
+        for sale_id, time_us, code, quantity, price, total in items:
+            per_sale[sale_id] += quantity
+        return dict(sorted(Counter(per_sale.values()).items()))
+
+# Date-partitioned sales: one CSV (optionally gzipped) per month or day plus
+# a manifest of per-partition row counts, datetime bounds and totals.
+SALES_PARTITION_DIR = 'sales_partitions'
+PARTITION_FIELDNAMES = LEDGER_FIELDNAMES
+
+def partition_key(value, granularity):
+    return value.strftime('%Y-%m-%d' if granularity == 'day' else '%Y-%m')
+
+def read_partition_rows(path):
+    """Parse one partition file (plain or gzip) into (sale_id, datetime, total, discount) tuples in datetime order"""
+    opener = gzip.open if path.endswith('.gz') else open
+    rows = []
+    with opener(path, 'rt', newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            try:
+                rows.append((int(row['sale_id']), datetime.fromisoformat(row['datetime']),
+                             float(row['total_amount']), float(row.get('discount', 0))))
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Error parsing sale data in {path}: {e}")
+                continue
+    # Backdated sales are appended wherever they arrive
+    rows.sort(key=lambda row: (row[1], row[0]))
+    return rows
+
+def sales_from_rows(rows):
+    return [Sale([], total_amount, sale_datetime, discount, sale_id)
+            for sale_id, sale_datetime, total_amount, discount in rows]
+
+class PartitionedSalesStorage(CSVSalesStorage):
+    """Sales split into per-month (or per-day) partition files under one directory.
+    
+    manifest.json records each partition's file, row count, first and last
+    datetime and totals, so range queries only open the partitions that
+    overlap and fully covered partitions are totalled from the manifest.
+    Appends, group commit and line items work as for the single CSV ledger.
+    """
+    query_backed = True
+    
+    def __init__(self, directory=SALES_PARTITION_DIR, granularity='month', flush_interval=0, workers=None):
+        super().__init__(os.path.join(directory, 'sales.csv'), flush_interval)
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, 'manifest.json')
+        self.items_file = os.path.join(directory, 'line_items')
+        self.item_ids_file = os.path.join(directory, 'line_items.ids')
+        self.granularity = granularity
+        # Process pool size for full scans (None: one worker per CPU)
+        self.workers = workers
+        self.partitions = {}       # key -> manifest entry
+        self.cache = OrderedDict()  # key -> (file size, sorted sales) for recently read partitions
+        self.cache_size = 8
+        os.makedirs(directory, exist_ok=True)
+        self.load_manifest()
+    
+    def partition_path(self, key, compressed=False):
+        return os.path.join(self.directory, f"sales-{key}.csv" + ('.gz' if compressed else ''))
+    
+    def load_manifest(self):
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r', encoding='utf-8') as file:
+                    manifest = json.load(file)
+                self.granularity = manifest['granularity']
+                self.partitions = manifest['partitions']
+                self.next_sale_id = manifest['next_sale_id']
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error reading sales manifest: {e}; rescanning partitions.")
+                self.partitions = {}
+        
+        # A crash can leave a partition written but not yet in the manifest, or
+        # one half of a compression; rescan or tidy those before trusting it.
+        changed = False
+        for key, entry in list(self.partitions.items()):
+            path = os.path.join(self.directory, entry['file'])
+            if not os.path.exists(path):
+                print(f"Sales partition {entry['file']} is missing; dropping it from the manifest.")
+                del self.partitions[key]
+                changed = True
+            elif os.path.getsize(path) != entry['bytes']:
+                changed = self.rescan(key, path) or changed
+        for name in sorted(os.listdir(self.directory)):
+            if not name.startswith('sales-') or not name.endswith(('.csv', '.csv.gz')):
+                continue
+            key = name[len('sales-'):].split('.')[0]
+            entry = self.partitions.get(key)
+            if entry is None:
+                changed = self.rescan(key, os.path.join(self.directory, name)) or changed
+            elif entry['file'] != name:
+                os.remove(os.path.join(self.directory, name))
+        if changed:
+            self.write_manifest()
+        count = sum(entry['count'] for entry in self.partitions.values())
+        print(f"Opened {count} sales records in {len(self.partitions)} partitions under {self.directory}")
+    
+    def rescan(self, key, path):
+        """Rebuild a partition's manifest entry from its file; False if it cannot be read"""
+        try:
+            rows = read_partition_rows(path)
+        except (OSError, EOFError) as e:
+            print(f"Error reading sales partition {path}: {e}")
+            return False
+        self.partitions[key] = {
+            'file': os.path.basename(path),
+            'bytes': os.path.getsize(path),
+            'count': len(rows),
+            'min': rows[0][1].isoformat() if rows else None,
+            'max': rows[-1][1].isoformat() if rows else None,
+            'gross': sum(row[2] for row in rows),
+            'discount': sum(row[3] for row in rows),
+            'net': sum(row[2] - row[3] for row in rows)
+        }
+        if rows:
+            self.next_sale_id = max(self.next_sale_id, max(row[0] for row in rows) + 1)
+        return True
+    
+    def write_manifest(self):
+        temp_file = self.manifest_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            json.dump({'granularity': self.granularity, 'next_sale_id': self.next_sale_id,
+                       'partitions': self.partitions}, file, indent=1, sort_keys=True)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.manifest_file)
+    
+    def load_sales(self):
+        return PartitionedSaleHistory(self)
+    
+    def save_sales(self, sales):
+        # Partitions are only ever appended to; everything recorded is already there
+        return self.flush()
+    
+    def append_rows(self, sales):
+        """Append sales to their partitions and fold them into the manifest (called with _flush_lock held)"""
+        by_partition = {}
+        for sale in sales:
+            by_partition.setdefault(partition_key(sale.datetime, self.granularity), []).append(sale)
+        for key, group in by_partition.items():
+            entry = self.partitions.get(key)
+            path = os.path.join(self.directory, entry['file']) if entry else self.partition_path(key)
+            text = io.StringIO()
+            writer = csv.DictWriter(text, fieldnames=PARTITION_FIELDNAMES)
+            if not os.path.exists(path):
+                writer.writeheader()
+            for sale in group:
+                writer.writerow(self.sale_row(sale))
+            data = text.getvalue().encode('utf-8')
+            if path.endswith('.gz'):
+                data = gzip.compress(data)  # appended as another gzip member
+            with open(path, 'ab') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            METRICS.count('store_bytes_written_total', 'sales', len(data))
+            
+            if entry is None:
+                entry = self.partitions[key] = {'file': os.path.basename(path), 'count': 0, 'min': None, 'max': None,
+                                                'gross': 0.0, 'discount': 0.0, 'net': 0.0}
+            times = [sale.datetime for sale in group]
+            if entry['min'] is not None:
+                times += [datetime.fromisoformat(entry['min']), datetime.fromisoformat(entry['max'])]
+            entry['min'] = min(times).isoformat()
+            entry['max'] = max(times).isoformat()
+            entry['count'] += len(group)
+            entry['gross'] += sum(sale.total_amount for sale in group)
+            entry['discount'] += sum(sale.discount for sale in group)
+            entry['net'] += sum(sale.final_amount for sale in group)
+            entry['bytes'] = os.path.getsize(path)
+            self.cache.pop(key, None)
+        self.write_manifest()
+    
+    def partition_entries(self):
+        """[(key, entry)] in key (date) order, after writing out pending sales"""
+        self.flush()
+        with self._flush_lock:
+            return sorted((key, dict(entry)) for key, entry in self.partitions.items())
+    
+    def read_partition(self, key, entry):
+        """The partition's sales in datetime order; recently read partitions come from a small cache"""
+        with self._flush_lock:
+            cached = self.cache.get(key)
+            if cached is not None and cached[0] == entry['bytes']:
+                self.cache.move_to_end(key)
+                return cached[1]
+        sales = sales_from_rows(read_partition_rows(os.path.join(self.directory, entry['file'])))
+        with self._flush_lock:
+            self.cache[key] = (entry['bytes'], sales)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return sales
+    
+    def compress_partitions(self, older_than_days=90):
+        """Gzip the partitions whose newest sale is older than older_than_days; returns how many"""
+        cutoff = datetime.now() - timedelta(days=older_than_days)
+        compressed = 0
+        with self._flush_lock:
+            for key, entry in sorted(self.partitions.items()):
+                if entry['file'].endswith('.gz') or entry['max'] is None or datetime.fromisoformat(entry['max']) >= cutoff:
+                    continue
+                source = os.path.join(self.directory, entry['file'])
+                target = self.partition_path(key, compressed=True)
+                try:
+                    with open(source, 'rb') as plain, open(target + '.tmp', 'wb') as raw:
+                        with gzip.GzipFile(fileobj=raw, mode='wb') as packed:
+                            shutil.copyfileobj(plain, packed)
+                        raw.flush()
+                        os.fsync(raw.fileno())
+                    os.replace(target + '.tmp', target)
+                    entry['file'] = os.path.basename(target)
+                    entry['bytes'] = os.path.getsize(target)
+                    self.write_manifest()
+                    os.remove(source)
+                    compressed += 1
+                except OSError as e:
+                    print(f"Error compressing sales partition {entry['file']}: {e}")
+        print(f"Compressed {compressed} sales partitions older than {older_than_days} days")
+        return compressed
+    
+    def sales_index(self):
+        return PartitionedSalesIndex(self)
+
+class PartitionedSaleHistory:
+    """Sequence-like view of every partitioned sale in datetime order.
+    
+    Iterating is a full scan: partitions are parsed in a process pool (a few
+    at a time, so memory stays bounded) and yielded in order.
+    """
+    
+    def __init__(self, storage):
+        self.storage = storage
+    
+    def __len__(self):
+        return sum(entry['count'] for key, entry in self.storage.partition_entries())
+    
+    def __iter__(self):
+        entries = self.storage.partition_entries()
+        if len(entries) < 2 or self.storage.workers == 1:
+            for key, entry in entries:
+                yield from self.storage.read_partition(key, entry)
+            return
+        paths = [os.path.join(self.storage.directory, entry['file']) for key, entry in entries]
+        workers = self.storage.workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+            for path in paths:
+                in_flight.append(executor.submit(read_partition_rows, path))
+                if len(in_flight) >= 2 * workers:
+                    yield from sales_from_rows(in_flight.popleft().result())
+            while in_flight:
+                yield from sales_from_rows(in_flight.popleft().result())
+
+class PartitionedSalesIndex:
+    """Sales queries over PartitionedSalesStorage that skip partitions outside the range"""
+    
+    def __init__(self, storage):
+        self.storage = storage
+        self.sales = PartitionedSaleHistory(storage)
+    
+    def add(self, sale):
+        pass  # the storage appends it; queries flush pending sales first
+    
+    def overlapping(self, start, end):
+        for key, entry in self.storage.partition_entries():
+            if entry['count'] and datetime.fromisoformat(entry['min']) < end and datetime.fromisoformat(entry['max']) >= start:
+                yield key, entry
+    
+    def iter_between(self, start, end):
+        for key, entry in self.overlapping(start, end):
+            sales = self.storage.read_partition(key, entry)
+            keys = [sale.datetime for sale in sales]
+            yield from sales[bisect_left(keys, start):bisect_left(keys, end)]
+    
+    def between(self, start, end):
+        return list(self.iter_between(start, end))
+    
+    def daily_totals(self, start_date, end_date):
+        start = datetime.combine(start_date, datetime.min.time())
+        end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
+        totals = [0, 0.0, 0.0, 0.0]
+        for key, entry in self.overlapping(start, end):
+            if start <= datetime.fromisoformat(entry['min']) and datetime.fromisoformat(entry['max']) < end:
+                # Wholly inside the range: the manifest already has the totals
+                totals[0] += entry['count']
+                totals[1] += entry['gross']
+                totals[2] += entry['discount']
+                totals[3] += entry['net']
+                continue
+            for sale in self.storage.read_partition(key, entry):
+                if start <= sale.datetime < end:
+                    totals[0] += 1
+                    totals[1] += sale.total_amount
+                    totals[2] += sale.discount
+                    totals[3] += sale.final_amount
+        return totals
+    
+    def hourly_totals(self, target_date):
+        start = datetime.combine(target_date, datetime.min.time())
+        hourly = {}
+        for sale in self.iter_between(start, start + timedelta(days=1)):
+            totals = hourly.setdefault(sale.datetime.hour, [0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += sale.total_amount
+            totals[2] += sale.discount
+            totals[3] += sale.final_amount
+        return hourly
+
+def migrate_sales_to_partitions(sales_file='sales.csv', directory=SALES_PARTITION_DIR, granularity='month', chunk_size=50000):
+    """One-shot copy of a sales.csv ledger (and its line items) into partitions; sales.csv is left in place"""
+    if os.path.exists(os.path.join(directory, 'manifest.json')):
+        print(f"{directory} already holds partitioned sales; nothing to migrate.")
+        return False
+    if not os.path.exists(sales_file):
+        print(f"Sales file {sales_file} not found!")
+        return False
+    
+    with redirect_stdout(io.StringIO()):
+        storage = PartitionedSalesStorage(directory, granularity)
+    ledger = CSVSalesStorage(sales_file)
+    sales = []
+    migrated = 0
+    try:
+        # Sale ids come from the ledger; one written before they were stored is
+        # numbered by position the way CSVSalesStorage numbers it (unparseable
+        # rows skipped), so existing line items still match.
+        next_sale_id = 0
+        with open(sales_file, 'rb') as file:
+            for row in csv.DictReader(complete_lines(file)):
+                try:
+                    sale_id = int(row['sale_id']) if 'sale_id' in row else migrated + len(sales)
+                    sale = Sale([], float(row['total_amount']), datetime.fromisoformat(row['datetime']),
+                                float(row.get('discount', 0)), sale_id)
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Error parsing sale data: {e}")
+                    continue
+                sales.append(sale)
+                next_sale_id = max(next_sale_id, sale_id + 1)
+                if len(sales) >= chunk_size:
+                    with storage._flush_lock:
+                        storage.append_rows(sales)
+                    migrated += len(sales)
+                    sales = []
+        with storage._flush_lock:
+            if sales:
+                storage.append_rows(sales)
+                migrated += len(sales)
+            storage.next_sale_id = next_sale_id
+            storage.write_manifest()
+        for source, target in ((ledger.items_file, storage.items_file), (ledger.item_ids_file, storage.item_ids_file)):
+            if os.path.exists(source):
+                shutil.copyfile(source, target)
+    except Exception as e:
+        print(f"Error migrating sales data: {e}")
+        return False
+    
+    print(f"Migrated {migrated} sales from {sales_file} into {len(storage.partitions)} "
+          f"{storage.granularity} partitions under {directory}")
+    return True
+
+# Receipt archive: whole sales (line items, promotions) as JSON lines packed
+# into zlib-compressed blocks, with a slot per sale id pointing at its block.
+RECEIPTS_FILE = 'sales.csv.receipts'
+RECEIPT_INDEX_HEADER = struct.Struct('<8sq')  # magic, first sale id
+RECEIPT_SLOT = struct.Struct('<QII')          # block offset, block length (0 = no receipt), position in block
+RECEIPT_BLOCK = struct.Struct('<QIIqq')       # offset, length, receipts, first and last datetime (microseconds since SNAPSHOT_EPOCH)
+
+class ReceiptArchive:
+    """Append-only archive of checked-out sales for reprints and return checks.
+    
+    <archive_file> holds the compressed blocks, <archive_file>.idx one
+    fixed-width slot per sale id (so finding a receipt is a single read) and
+    <archive_file>.blocks each block's datetime range. The ranges are indexed
+    in memory by start time, so a datetime lookup bisects to the blocks that
+    overlap it. Receipts wait in <archive_file>.tail until block_size of them
+    fill a block, so a lookup only ever decompresses one block.
+    
+    Receipts are added once their ledger rows are durable (see
+    BillingSystem), so every receipt number names a recorded sale.
+    """
+    
+    def __init__(self, archive_file, block_size=256):
+        self.archive_file = archive_file
+        self.index_file = archive_file + '.idx'
+        self.blocks_file = archive_file + '.blocks'
+        self.tail_file = archive_file + '.tail'
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.first_sale_id = None
+        self.blocks = []         # (offset, length, count, first_us, last_us) per sealed block
+        self.block_starts = []   # first_us of every block, ascending
+        self.block_order = []    # position in blocks of each entry of block_starts
+        self.block_reach = []    # running maximum of last_us along block_starts
+        self.sealed_end = 0      # archive_file size covered by sealed blocks
+        self.pending = {}        # sale_id -> receipt dict, not yet in a block
+        self.cache = OrderedDict()  # block offset -> decoded lines, most recently used last
+        self.tail = None
+        self.load()
+    
+    def load(self):
+        try:
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'rb') as file:
+                    header = file.read(RECEIPT_INDEX_HEADER.size)
+                if len(header) == RECEIPT_INDEX_HEADER.size:
+                    magic, first_sale_id = RECEIPT_INDEX_HEADER.unpack(header)
+                    if magic == b'RCPTIDX1':
+                        self.first_sale_id = first_sale_id
+            if os.path.exists(self.blocks_file):
+                with open(self.blocks_file, 'rb') as file:
+                    data = file.read()
+                archive_size = os.path.getsize(self.archive_file) if os.path.exists(self.archive_file) else 0
+                whole = len(data) - len(data) % RECEIPT_BLOCK.size
+                for block in RECEIPT_BLOCK.iter_unpack(data[:whole]):
+                    # A crash between writing a block and its record leaves either
+                    # a torn record or a record for bytes that never reached disk
+                    if block[0] != self.sealed_end or block[0] + block[1] > archive_size:
+                        break
+                    self._add_block(block)
+                if len(self.blocks) * RECEIPT_BLOCK.size != len(data):
+                    with open(self.blocks_file, 'r+b') as file:
+                        file.truncate(len(self.blocks) * RECEIPT_BLOCK.size)
+                if archive_size > self.sealed_end:
+                    with open(self.archive_file, 'r+b') as file:
+                        file.truncate(self.sealed_end)
+            if os.path.exists(self.tail_file):
+                with open(self.tail_file, 'r+b') as file:
+                    data = file.read()
+                    # Drop a line torn by a crash so later appends start on a new line
+                    complete = data.rfind(b'\n') + 1
+                    if complete < len(data):
+                        file.truncate(complete)
+                for line in data[:complete].splitlines():
+                    try:
+                        receipt = json.loads(line)
+                    except ValueError as e:
+                        print(f"Error parsing receipt record: {e}")
+                        continue
+                    if self._slot(receipt['sale_id']) is None:
+                        self.pending[receipt['sale_id']] = receipt
+        except (OSError, struct.error, KeyError) as e:
+            print(f"Error loading receipt archive: {e}")
+    
+    def __len__(self):
+        return sum(block[2] for block in self.blocks) + len(self.pending)
+    
+    def append(self, sales):
+        """Archive checked-out sales (those with a sale_id)"""
+        receipts = [sale.to_dict() for sale in sales if sale.sale_id is not None]
+        if not receipts:
+            return True
+        try:
+            with self.lock:
+                if self.tail is None:
+                    self.tail = open(self.tail_file, 'a', encoding='utf-8')
+                for receipt in receipts:
+                    self.tail.write(json.dumps(receipt) + '\n')
+                    self.pending[receipt['sale_id']] = receipt
+                self.tail.flush()
+                if len(self.pending) >= self.block_size:
+                    self._seal()
+            return True
+        except (OSError, struct.error) as e:
+            print(f"Error archiving receipts: {e}")
+            return False
+    
+    def flush(self):
+        with self.lock:
+            if self.tail is not None:
+                self.tail.flush()
+                os.fsync(self.tail.fileno())
+    
+    def _seal(self):
+        """Compress the pending receipts into blocks and point their slots at them"""
+        receipts = sorted(self.pending.values(), key=lambda receipt: receipt['sale_id'])
+        if self.first_sale_id is None or receipts[0]['sale_id'] < self.first_sale_id:
+            if self.first_sale_id is not None:
+                # Slots are addressed from the first id; earlier ids cannot be indexed
+                print(f"Receipts before sale {self.first_sale_id} cannot be archived; skipping them.")
+                receipts = [receipt for receipt in receipts if receipt['sale_id'] >= self.first_sale_id]
+            else:
+                self.first_sale_id = receipts[0]['sale_id']
+                with open(self.index_file, 'wb') as file:
+                    file.write(RECEIPT_INDEX_HEADER.pack(b'RCPTIDX1', self.first_sale_id))
+        
+        new_blocks = []
+        slots = []
+        with open(self.archive_file, 'ab') as file:
+            for start in range(0, len(receipts), self.block_size):
+                chunk = receipts[start:start + self.block_size]
+                data = zlib.compress(''.join(json.dumps(receipt) + '\n' for receipt in chunk).encode('utf-8'))
+                offset = self.sealed_end + sum(block[1] for block in new_blocks)
+                file.write(data)
+                times = [epoch_microseconds(datetime.fromisoformat(receipt['datetime'])) for receipt in chunk]
+                new_blocks.append((offset, len(data), len(chunk), min(times), max(times)))
+                slots.extend((receipt['sale_id'], offset, len(data), position) for position, receipt in enumerate(chunk))
+            file.flush()
+            os.fsync(file.fileno())
+            METRICS.count('store_bytes_written_total', 'receipts', sum(block[1] for block in new_blocks))
+        with open(self.index_file, 'r+b') as file:
+            for sale_id, offset, length, position in slots:
+                file.seek(RECEIPT_INDEX_HEADER.size + (sale_id - self.first_sale_id) * RECEIPT_SLOT.size)
+                file.write(RECEIPT_SLOT.pack(offset, length, position))
+            file.flush()
+            os.fsync(file.fileno())
+        with open(self.blocks_file, 'ab') as file:
+            for block in new_blocks:
+                file.write(RECEIPT_BLOCK.pack(*block))
+            file.flush()
+            os.fsync(file.fileno())
+        for block in new_blocks:
+            self._add_block(block)
+        # Every pending receipt is now in a block, so the tail starts over
+        self.pending.clear()
+        if self.tail is not None:
+            self.tail.close()
+        self.tail = open(self.tail_file, 'w', encoding='utf-8')
+    
+    def _add_block(self, block):
+        self.blocks.append(block)
+        self.sealed_end = block[0] + block[1]
+        first_us, last_us = block[3], block[4]
+        at = bisect_right(self.block_starts, first_us)
+        self.block_starts.insert(at, first_us)
+        self.block_order.insert(at, len(self.blocks) - 1)
+        # Blocks normally arrive in time order and only extend the running
+        # maximum; a block of backdated sales recomputes it from its position
+        del self.block_reach[at:]
+        reach = self.block_reach[-1] if self.block_reach else last_us
+        for position in self.block_order[at:]:
+            reach = max(reach, self.blocks[position][4])
+            self.block_reach.append(reach)
+    
+    def _slot(self, sale_id):
+        """(offset, length, position) of a sealed receipt, or None"""
+        if self.first_sale_id is None or sale_id < self.first_sale_id:
+            return None
+        with open(self.index_file, 'rb') as file:
+            file.seek(RECEIPT_INDEX_HEADER.size + (sale_id - self.first_sale_id) * RECEIPT_SLOT.size)
+            data = file.read(RECEIPT_SLOT.size)
+        if len(data) < RECEIPT_SLOT.size:
+            return None
+        offset, length, position = RECEIPT_SLOT.unpack(data)
+        if length == 0 or offset + length > self.sealed_end:
+            return None
+        return offset, length, position
+    
+    def _block_lines(self, offset, length):
+        lines = self.cache.get(offset)
+        if lines is None:
+            with open(self.archive_file, 'rb') as file:
+                file.seek(offset)
+                lines = zlib.decompress(file.read(length)).decode('utf-8').splitlines()
+            self.cache[offset] = lines
+            if len(self.cache) > 8:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(offset)
+        return lines
+    
+    def get(self, sale_id):
+        """The receipt for sale_id as a Sale with its line items, or None"""
+        try:
+            with self.lock:
+                receipt = self.pending.get(sale_id)
+                if receipt is None:
+                    slot = self._slot(sale_id)
+                    if slot is None:
+                        return None
+                    offset, length, position = slot
+                    receipt = json.loads(self._block_lines(offset, length)[position])
+            return Sale.from_dict(receipt)
+        except (OSError, zlib.error, ValueError, IndexError) as e:
+            print(f"Error reading receipt {sale_id}: {e}")
+            return None
+    
+    def between(self, start, end):
+        """Receipts with start <= datetime < end, in datetime order; only overlapping blocks are opened"""
+        start_us, end_us = epoch_microseconds(start), epoch_microseconds(end)
+        receipts = []
+        try:
+            with self.lock:
+                # Blocks before low all end before start; blocks from high on start at or after end
+                low = bisect_left(self.block_reach, start_us)
+                high = bisect_left(self.block_starts, end_us)
+                for position in self.block_order[low:high]:
+                    offset, length, count, first_us, last_us = self.blocks[position]
+                    if last_us >= start_us:
+                        receipts.extend(json.loads(line) for line in self._block_lines(offset, length))
+                receipts.extend(self.pending.values())
+        except (OSError, zlib.error, ValueError) as e:
+            print(f"Error reading receipts: {e}")
+            return []
+        sales = [Sale.from_dict(receipt) for receipt in receipts
+                 if start <= datetime.fromisoformat(receipt['datetime']) < end]
+        sales.sort(key=lambda sale: (sale.datetime, sale.sale_id))
+        return sales
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT PRIMARY KEY,
+    id_lower TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    price REAL NOT NULL,
+    stock_quantity INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_name ON products (name_lower, product_id);
+CREATE INDEX IF NOT EXISTS products_price ON products (price, product_id);
+CREATE INDEX IF NOT EXISTS products_stock ON products (stock_quantity, product_id);
+CREATE INDEX IF NOT EXISTS products_value ON products (price * stock_quantity);
+CREATE TABLE IF NOT EXISTS sales (
+    sale_id INTEGER PRIMARY KEY,
+    datetime TEXT NOT NULL,
+    total_amount REAL NOT NULL,
+    discount REAL NOT NULL,
+    final_amount REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sales_datetime ON sales (datetime);
+CREATE TABLE IF NOT EXISTS sale_items (
+    sale_id INTEGER NOT NULL,
+    datetime TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_price REAL NOT NULL,
+    total REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sale_items_datetime ON sale_items (datetime);
+'''
+
+class SQLiteStorage:
+    """Inventory and sales in one SQLite database file, queried in place.
+    
+    Nothing is loaded into memory up front: products are read on lookup,
+    changes are point updates, and searches and reports run as indexed SQL.
+    Pass the same instance to InventoryManager and BillingSystem so that a
+    checkout commits its stock updates and its sale in one transaction.
+    With read_only the file is opened as is, without the WAL and schema setup.
+    """
+    query_backed = True
+    
+    def __init__(self, path='store.db', read_only=False):
+        self.path = path
+        self.lock = threading.RLock()
+        self.depth = 0
+        # Sales inserted since the last commit, passed to each
+        # callback(sales) in committed_subscribers once they are committed
+        self.uncommitted_sales = []
+        self.committed_subscribers = []
+        if read_only:
+            self.connection = sqlite3.connect(Path(path).absolute().as_uri() + '?mode=ro', uri=True,
+                                              check_same_thread=False)
+            return
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SQLITE_SCHEMA)
+        self.connection.commit()
+    
+    @contextmanager
+    def transaction(self):
+        """Group the writes made inside into one commit (nested uses join the outer one)"""
+        with self.lock:
+            self.depth += 1
+            try:
+                yield
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.rollback()
+                    self.uncommitted_sales.clear()
+                raise
+            self.depth -= 1
+            self.commit()
+    
+    def commit(self):
+        with self.lock:
+            if self.depth == 0:
+                self.connection.commit()
+                self._notify_committed()
+    
+    def _notify_committed(self):
+        sales, self.uncommitted_sales = self.uncommitted_sales, []
+        if sales:
+            for callback in self.committed_subscribers:
+                callback(sales)
+    
+    def subscribe_committed(self, callback):
+        self.committed_subscribers.append(callback)
+    
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+    
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params)
+    
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self._notify_committed()
+            self.connection.close()
+    
+    # Inventory backend
+    
+    def load_products(self, products):
+        count = self.query('SELECT COUNT(*) FROM products')[0][0]
+        print(f"Opened {count} products in {self.path}")
+        return SQLiteProductMap(self)
+    
+    def put_product(self, product):
+        self.execute('INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?)',
+                     (product.product_id, product.product_id.lower(), product.name, product.name.lower(),
+                      product.price, product.stock_quantity))
+    
+    def save_products(self, products):
+        return self.compact(products)
+    
+    def compact(self, products):
+        try:
+            self.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Error saving inventory data: {e}")
+            return False
+    
+    def write_changes(self, products, changed=(), deleted=()):
+        try:
+            with self.lock:
+                for product in changed:
+                    self.put_product(product)
+                for product_id in deleted:
+                    self.execute('DELETE FROM products WHERE product_id = ?', (product_id,))
+                self.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Error writing inventory data: {e}")
+            return False
+    
+    def inventory_indexes(self):
+        return SQLiteSearchIndex(self), SQLiteStockIndex(self), SQLiteAggregates(self)
+    
+    def sort_indexes(self):
+        return {'name': SQLiteSortedIndex(self, 'name_lower'),
+                'price': SQLiteSortedIndex(self, 'price'),
+                'stock': SQLiteSortedIndex(self, 'stock_quantity')}
+    
+    # Sales backend
+    
+    def load_sales(self):
+        history = SQLiteSaleHistory(self)
+        print(f"Opened {len(history)} sales records in {self.path}")
+        return history
+    
+    def save_sales(self, sales):
+        return self.flush()
+    
+    def append_sale(self, sale):
+        return self.append_sales([sale])
+    
+    def append_sales(self, sales):
+        try:
+            with self.lock:
+                for sale in sales:
+                    cursor = self.connection.execute(
+                        'INSERT INTO sales (datetime, total_amount, discount, final_amount) VALUES (?, ?, ?, ?)',
+                        (sale.datetime.isoformat(), sale.total_amount, sale.discount, sale.final_amount))
+                    sale.sale_id = cursor.lastrowid
+                self.connection.executemany(
+                    'INSERT INTO sale_items VALUES (?, ?, ?, ?, ?, ?)',
+                    [(sale.sale_id, sale.datetime.isoformat(), item.product.product_id, item.quantity,
+                      item.total / item.quantity, item.total)
+                     for sale in sales for item in sale.items])
+                self.uncommitted_sales.extend(sales)
+                self.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Error appending sales data: {e}")
+            return False
+    
+    def flush(self):
+        try:
+            self.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Error saving sales data: {e}")
+            return False
+    
+    def sales_index(self):
+        return SQLiteSalesIndex(self)
+    
+    def line_item_analytics(self):
+        return SQLiteLineItemAnalytics(self)
 
-class Product:
-    def __init__(self, product_id, name, price, stock_quantity):
-        self.product_id = product_id
-        self.name = name
-        self.price = price
-        self.stock_quantity = stock_quantity
+class SQLiteProductMap(MutableMapping):
+    """{product_id: Product} view of the products table; each lookup is a query"""
     
-    def to_dict(self):
-        return {
-            'product_id': self.product_id,
-            'name': self.name,
-            'price': self.price,
-            'stock_quantity': self.stock_quantity
-        }
+    COLUMNS = 'product_id, name, price, stock_quantity'
     
-    def __str__(self):
-        return f"{self.product_id}: {self.name} - ${self.price:.2f} (Stock: {self.stock_quantity})"
+    def __init__(self, storage, batch_size=1000):
+        self.storage = storage
+        self.batch_size = batch_size
+    
+    def __getitem__(self, product_id):
+        rows = self.storage.query(f'SELECT {self.COLUMNS} FROM products WHERE product_id = ?', (product_id,))
+        if not rows:
+            raise KeyError(product_id)
+        return Product(*rows[0])
+    
+    def __setitem__(self, product_id, product):
+        self.storage.put_product(product)
+    
+    def __delitem__(self, product_id):
+        if self.storage.execute('DELETE FROM products WHERE product_id = ?', (product_id,)).rowcount == 0:
+            raise KeyError(product_id)
+    
+    def __contains__(self, product_id):
+        return bool(self.storage.query('SELECT 1 FROM products WHERE product_id = ?', (product_id,)))
+    
+    def __len__(self):
+        return self.storage.query('SELECT COUNT(*) FROM products')[0][0]
+    
+    def __iter__(self):
+        return (product.product_id for product in self.values())
+    
+    def values(self):
+        """Iterate all products in batches without holding them in memory"""
+        last_id = None
+        while True:
+            if last_id is None:
+                rows = self.storage.query(f'SELECT {self.COLUMNS} FROM products ORDER BY product_id LIMIT ?',
+                                          (self.batch_size,))
+            else:
+                rows = self.storage.query(f'SELECT {self.COLUMNS} FROM products WHERE product_id > ? '
+                                          f'ORDER BY product_id LIMIT ?', (last_id, self.batch_size))
+            for row in rows:
+                yield Product(*row)
+            if len(rows) < self.batch_size:
+                return
+            last_id = rows[-1][0]
 
-class OrderItem:
-    def __init__(self, product, quantity):
-        self.product = product
-        self.quantity = quantity
-        self.total = product.price * quantity
+def sale_from_row(row):
+    sale_datetime, total_amount, discount, sale_id = row
+    return Sale([], total_amount, datetime.fromisoformat(sale_datetime), discount, sale_id)
+
+class SQLiteSaleHistory:
+    """Sequence-like view of the sales table in datetime order"""
     
-    def to_dict(self):
-        return {
-            'product_id': self.product.product_id,
-            'name': self.product.name,
-            'price': self.product.price,
-            'quantity': self.quantity,
-            'total': self.total
-        }
+    def __init__(self, storage, batch_size=1000):
+        self.storage = storage
+        self.batch_size = batch_size
+    
+    def __len__(self):
+        return self.storage.query('SELECT COUNT(*) FROM sales')[0][0]
+    
+    def __iter__(self):
+        last = ('', 0)
+        while True:
+            rows = self.storage.query('SELECT datetime, total_amount, discount, sale_id FROM sales '
+                                      'WHERE (datetime, sale_id) > (?, ?) ORDER BY datetime, sale_id LIMIT ?',
+                                      (*last, self.batch_size))
+            for row in rows:
+                yield sale_from_row(row)
+            if len(rows) < self.batch_size:
+                return
+            last = (rows[-1][0], rows[-1][3])
 
-class Sale:
-    def __init__(self, items, total_amount, sale_datetime, discount=0):
-        self.items = items
-        self.total_amount = total_amount
-        self.datetime = sale_datetime
-        self.discount = discount
-        self.final_amount = total_amount - discount
+class SQLiteIndex:
+    """Base for query objects over SQLiteStorage; the database keeps its own indexes current"""
     
-    def to_dict(self):
-        return {
-            'datetime': self.datetime.isoformat(),
-            'items': [item.to_dict() for item in self.items],
-            'total_amount': self.total_amount,
-            'discount': self.discount,
-            'final_amount': self.final_amount
-        }
+    def __init__(self, storage):
+        self.storage = storage
+    
+    def add(self, item):
+        pass
+    
+    def discard(self, key):
+        pass
+    
+    def clear(self):
+        pass
+    
+    def rebuild(self, items):
+        pass
+
+class SQLiteSearchIndex(SQLiteIndex):
+    def search(self, keyword, limit=None, offset=0):
+        keyword = keyword.lower()
+        rows = self.storage.query(
+            '''SELECT product_id FROM products
+               WHERE id_lower = :keyword OR instr(name_lower, :keyword) > 0
+               ORDER BY CASE
+                   WHEN id_lower = :keyword THEN 0
+                   WHEN name_lower = :keyword THEN 1
+                   WHEN instr(' ' || name_lower || ' ', ' ' || :keyword || ' ') > 0 THEN 2
+                   WHEN substr(name_lower, 1, length(:keyword)) = :keyword THEN 3
+                   ELSE 4 END,
+                   length(name_lower), name_lower, product_id
+               LIMIT :limit OFFSET :offset''',
+            {'keyword': keyword, 'limit': -1 if limit is None else limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+class SQLiteStockIndex(SQLiteIndex):
+    def at_or_below(self, threshold):
+        rows = self.storage.query('SELECT product_id FROM products WHERE stock_quantity <= ? '
+                                  'ORDER BY stock_quantity, product_id', (threshold,))
+        return [row[0] for row in rows]
+    
+    def count_at_or_below(self, threshold):
+        return self.storage.query('SELECT COUNT(*) FROM products WHERE stock_quantity <= ?', (threshold,))[0][0]
+
+class SQLiteSortedIndex(SQLiteIndex):
+    def __init__(self, storage, column, batch_size=500):
+        super().__init__(storage)
+        self.column = column
+        self.batch_size = batch_size
+    
+    def _bounds(self, low, high):
+        conditions, params = [], []
+        if low is not None:
+            conditions.append(f'{self.column} >= ?')
+            params.append(low)
+        if high is not None:
+            conditions.append(f'{self.column} <= ?')
+            params.append(high)
+        return conditions, params
+    
+    def count(self, low=None, high=None):
+        conditions, params = self._bounds(low, high)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        return self.storage.query(f'SELECT COUNT(*) FROM products{where}', params)[0][0]
+    
+    def scan(self, after=None, descending=False, low=None, high=None, filters=()):
+        """Yield (value, product_id) in order using keyset queries on the (column, product_id) index.
+        
+        Ranges in filters are added to the query, so SQLite does the intersection.
+        """
+        column = self.column
+        bounds, bound_params = self._bounds(low, high)
+        for index, index_low, index_high in filters:
+            conditions, params = index._bounds(index_low, index_high)
+            bounds.extend(conditions)
+            bound_params.extend(params)
+        order = 'DESC' if descending else 'ASC'
+        while True:
+            conditions, params = list(bounds), list(bound_params)
+            if after is not None:
+                conditions.append(f'({column}, product_id) {"<" if descending else ">"} (?, ?)')
+                params.extend(after)
+            where = f'WHERE {" AND ".join(conditions)} ' if conditions else ''
+            rows = self.storage.query(f'SELECT {column}, product_id FROM products {where}'
+                                      f'ORDER BY {column} {order}, product_id {order} LIMIT ?',
+                                      (*params, self.batch_size))
+            for row in rows:
+                yield tuple(row)
+            if len(rows) < self.batch_size:
+                return
+            after = rows[-1]
+
+class SQLiteAggregates(SQLiteIndex):
+    low_stock_threshold = 5
+    
+    @property
+    def total_stock_value(self):
+        return self.storage.query('SELECT total(price * stock_quantity) FROM products')[0][0]
+    
+    @property
+    def low_stock_count(self):
+        return self.storage.query('SELECT COUNT(*) FROM products WHERE stock_quantity <= ?',
+                                  (self.low_stock_threshold,))[0][0]
+    
+    @property
+    def out_of_stock_count(self):
+        return self.storage.query('SELECT COUNT(*) FROM products WHERE stock_quantity = 0')[0][0]
+    
+    def top(self, k=5):
+        rows = self.storage.query('SELECT product_id, price * stock_quantity FROM products '
+                                  'ORDER BY price * stock_quantity DESC LIMIT ?', (k,))
+        return [(product_id, stock_value) for product_id, stock_value in rows]
+
+class SQLiteSalesIndex(SQLiteIndex):
+    def __init__(self, storage):
+        super().__init__(storage)
+        self.sales = SQLiteSaleHistory(storage)
+    
+    def between(self, start, end):
+        rows = self.storage.query('SELECT datetime, total_amount, discount, sale_id FROM sales '
+                                  'WHERE datetime >= ? AND datetime < ? ORDER BY datetime, sale_id',
+                                  (start.isoformat(), end.isoformat()))
+        return [sale_from_row(row) for row in rows]
+    
+    def iter_between(self, start, end, batch_size=1000):
+        last = (start.isoformat(), 0)
+        while True:
+            rows = self.storage.query('SELECT datetime, total_amount, discount, sale_id FROM sales '
+                                      'WHERE (datetime, sale_id) > (?, ?) AND datetime >= ? AND datetime < ? '
+                                      'ORDER BY datetime, sale_id LIMIT ?',
+                                      (*last, start.isoformat(), end.isoformat(), batch_size))
+            for row in rows:
+                yield sale_from_row(row)
+            if len(rows) < batch_size:
+                return
+            last = (rows[-1][0], rows[-1][3])
+    
+    def daily_totals(self, start_date, end_date):
+        start = datetime.combine(start_date, datetime.min.time())
+        end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
+        row = self.storage.query('SELECT COUNT(*), total(total_amount), total(discount), total(final_amount) '
+                                 'FROM sales WHERE datetime >= ? AND datetime < ?',
+                                 (start.isoformat(), end.isoformat()))[0]
+        return list(row)
+    
+    def hourly_totals(self, target_date):
+        start = datetime.combine(target_date, datetime.min.time())
+        rows = self.storage.query('SELECT CAST(substr(datetime, 12, 2) AS INTEGER), COUNT(*), total(total_amount), '
+                                  'total(discount), total(final_amount) FROM sales '
+                                  'WHERE datetime >= ? AND datetime < ? GROUP BY 1',
+                                  (start.isoformat(), (start + timedelta(days=1)).isoformat()))
+        return {row[0]: list(row[1:]) for row in rows}
+
+class SQLiteLineItemAnalytics(LineItemAnalytics):
+    """The LineItemAnalytics queries answered by SQL over the sale_items table"""
+    
+    def date_range(self, start_date, end_date):
+        start = datetime.combine(start_date, datetime.min.time())
+        return start.isoformat(), datetime.combine(end_date + timedelta(days=1), datetime.min.time()).isoformat()
+    
+    def product_totals(self, start_date, end_date):
+        rows = self.storage.query('SELECT product_id, SUM(quantity), total(total) FROM sale_items '
+                                  'WHERE datetime >= ? AND datetime < ? GROUP BY product_id',
+                                  self.date_range(start_date, end_date))
+        return {product_id: (units, revenue) for product_id, units, revenue in rows}
+    
+    def units_by_hour(self, start_date, end_date):
+        units = dict.fromkeys(range(24), 0)
+        rows = self.storage.query('SELECT CAST(substr(datetime, 12, 2) AS INTEGER), SUM(quantity) FROM sale_items '
+                                  'WHERE datetime >= ? AND datetime < ? GROUP BY 1',
+                                  self.date_range(start_date, end_date))
+        units.update(rows)
+        return units
+    
+    def decayed_units(self, start_date, end_date, now, tau_days):
+        # SQLite has no exp() by default: sum per product and hour, then weight in Python
+        rows = self.storage.query('SELECT product_id, substr(datetime, 1, 13), SUM(quantity) FROM sale_items '
+                                  'WHERE datetime >= ? AND datetime < ? GROUP BY 1, 2',
+                                  self.date_range(start_date, end_date))
+        totals = {}
+        for product_id, hour, units in rows:
+            age = (now - datetime.fromisoformat(hour + ':30')) / timedelta(days=1)
+            totals[product_id] = totals.get(product_id, 0.0) + units * math.exp(-age / tau_days)
+        return totals
+    
+    def basket_sizes(self, start_date, end_date):
+        rows = self.storage.query('SELECT units, COUNT(*) FROM (SELECT SUM(quantity) AS units FROM sale_items '
+                                  'WHERE datetime >= ? AND datetime < ? GROUP BY sale_id) GROUP BY units ORDER BY units',
+                                  self.date_range(start_date, end_date))
+        return dict(rows)
+
+class ReorderForecaster:
+    """Exponentially weighted sales velocity per product, for reorder suggestions.
+    
+    Each product keeps a rate in units/day and the time it was last updated;
+    a sale decays the rate to the sale time and adds quantity / tau, so the
+    rate is a continuous-time EWMA with the given half-life. State starts
+    from the recorded line items on first use and is then kept up to date
+    by every checkout.
+    """
+    
+    def __init__(self, analytics, half_life_days=7.0, lead_time_days=3.0, safety_days=2.0, cover_days=14.0):
+        self.analytics = analytics
+        self.tau = half_life_days / math.log(2)
+        self.lead_time_days = lead_time_days
+        self.safety_days = safety_days
+        self.cover_days = cover_days
+        self.lock = threading.Lock()
+        self.rows = {}              # product_id -> position in the arrays below
+        self.product_ids = []
+        self.rates = array('d')     # units/day as of updated[row]
+        self.updated = array('d')   # days since SNAPSHOT_EPOCH
+        self.seeded = False
+    
+    @staticmethod
+    def epoch_days(value):
+        return epoch_microseconds(value) / 86400e6
+    
+    def _row(self, product_id):
+        row = self.rows.get(product_id)
+        if row is None:
+            row = self.rows[product_id] = len(self.product_ids)
+            self.product_ids.append(product_id)
+            self.rates.append(0.0)
+            self.updated.append(0.0)
+        return row
+    
+    def _add(self, product_id, quantity, when):
+        row = self._row(product_id)
+        last = self.updated[row]
+        if when >= last:
+            self.rates[row] = self.rates[row] * math.exp((last - when) / self.tau) + quantity / self.tau
+            self.updated[row] = when
+        else:
+            # A backdated sale only adds its decayed contribution
+            self.rates[row] += quantity / self.tau * math.exp((when - last) / self.tau)
+    
+    def _seed(self):
+        # Sales older than eight half-lives weigh under 0.4% each
+        now = datetime.now()
+        window = timedelta(days=math.ceil(8 * self.tau * math.log(2)))
+        totals = self.analytics.decayed_units(now.date() - window, now.date(), now, self.tau)
+        today = self.epoch_days(now)
+        for product_id, units in totals.items():
+            row = self._row(product_id)
+            self.rates[row] = units / self.tau
+            self.updated[row] = today
+        self.seeded = True
+    
+    def record_sale(self, sale):
+        when = self.epoch_days(sale.datetime)
+        with self.lock:
+            if not self.seeded:
+                self._seed()
+            for item in sale.items:
+                self._add(item.product.product_id, item.quantity, when)
+    
+    def velocities(self, now=None):
+        """(product_ids, units/day as of now) for every product that has sold"""
+        now = self.epoch_days(now or datetime.now())
+        with self.lock:
+            if not self.seeded:
+                self._seed()
+            product_ids = list(self.product_ids)
+            if np is not None:
+                rates = np.frombuffer(self.rates, dtype=np.float64).copy()
+                updated = np.frombuffer(self.updated, dtype=np.float64).copy()
+                return product_ids, rates * np.exp(np.minimum(updated - now, 0) / self.tau)
+            return product_ids, [rate * math.exp(min(last - now, 0) / self.tau)
+                                 for rate, last in zip(self.rates, self.updated)]
+    
+    def forecast(self, inventory_manager, now=None, reorder_only=True):
+        """Days of cover and suggested order quantity per product, most urgent first.
+        
+        A product needs reordering once its stock covers no more than the lead
+        time plus safety days; the suggestion tops it up to cover_days of sales.
+        """
+        product_ids, velocity = self.velocities(now)
+        stock = [0] * len(product_ids)
+        for row, product_id in enumerate(product_ids):
+            product = inventory_manager.get_product(product_id)
+            stock[row] = product.stock_quantity if product else -1  # -1 marks deleted products
+        
+        reorder_at = self.lead_time_days + self.safety_days
+        target = self.lead_time_days + self.cover_days
+        if np is not None:
+            stock_levels = np.array(stock, dtype=np.float64)
+            with np.errstate(divide='ignore'):
+                cover = np.where(velocity > 0, np.maximum(stock_levels, 0) / velocity, np.inf)
+            suggested = np.maximum(np.ceil(velocity * target) - np.maximum(stock_levels, 0), 0)
+            due = (cover <= reorder_at) & (stock_levels >= 0)
+            rows = np.flatnonzero(due if reorder_only else stock_levels >= 0)
+            rows = rows[np.argsort(cover[rows], kind='stable')]
+            cover, suggested, velocity = cover.tolist(), suggested.tolist(), velocity.tolist()
+        else:
+            cover = [max(level, 0) / rate if rate > 0 else math.inf for level, rate in zip(stock, velocity)]
+            suggested = [max(math.ceil(rate * target) - max(level, 0), 0) for level, rate in zip(stock, velocity)]
+            rows = [row for row in range(len(product_ids))
+                    if stock[row] >= 0 and (cover[row] <= reorder_at or not reorder_only)]
+            rows.sort(key=lambda row: cover[row])
+        
+        return [{
+            'product_id': product_ids[row],
+            'stock_quantity': stock[row],
+            'velocity': velocity[row],
+            'days_of_cover': cover[row],
+            'suggested_quantity': int(suggested[row])
+        } for row in rows]
 
 class InventoryManager:
-    def __init__(self, data_file='inventory.csv'):
+    def __init__(self, data_file='inventory.csv', journal=False, compact_threshold=1000, default_reorder_point=None,
+                 store='dict', snapshot=False, storage=None, reservation_ttl=900, lock_stripes=64, changes_file=None):
         self.data_file = data_file
+        # 'dict' keeps one Product object per SKU; 'columnar' uses ColumnarProductStore
+        self.store = store
+        # The CSV file (with the journal and snapshot options) unless another backend is given
+        if storage is None:
+            storage = CSVInventoryStorage(data_file, journal, compact_threshold, snapshot)
+        self.storage = storage
+        # Secondary indexes kept in step with self.products; each one offers
+        # add(product) (insert or refresh), discard(product_id), clear() and
+        # rebuild(products) for bulk loading. Query-backed storage answers
+        # the same calls from its own indexes.
+        if storage.query_backed:
+            self.search_index, self.stock_index, self.aggregates = storage.inventory_indexes()
+            self.sort_indexes = storage.sort_indexes()
+        else:
+            self.search_index = ProductSearchIndex()
+            self.stock_index = StockLevelIndex()
+            self.aggregates = InventoryAggregates()
+            # Catalog orderings for cursor paging (see catalog_page)
+            self.sort_indexes = {'name': SortedAttributeIndex('name', str.lower),
+                                 'price': SortedAttributeIndex('price'),
+                                 'stock': self.stock_index}
+        self.indexes = [self.search_index, self.stock_index, self.aggregates]
+        self.indexes.extend(index for index in self.sort_indexes.values() if index is not self.stock_index)
+        # With changes_file, every mutation is versioned for changes_since()
+        self.changes = None
+        if changes_file is not None:
+            self.changes = InventoryChangeFeed(changes_file)
+            self.indexes.append(self.changes)
+        # Several carts can share this inventory: stock checks and decrements
+        # lock only the stripes of the products involved, while the shared
+        # indexes and storage writes take short locks of their own.
+        self.reservations = StockReservations(reservation_ttl)
+        self.stock_locks = [threading.RLock() for _ in range(lock_stripes)]
+        self._index_lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        # Writes queued while another thread's persist() is writing; the next
+        # writer takes them all in one storage call (group commit)
+        self._persist_queue = []
+        self._persist_writing = False
+        self._persist_ready = threading.Condition()
+        # Subscribers are called as callback(product, reorder_point) when a
+        # checkout takes a product from above its reorder point to at or below it.
+        self.default_reorder_point = default_reorder_point
+        self.reorder_points = {}
+        self.low_stock_subscribers = []
         self.products = self.load_data()
+        self.rebuild_indexes()
+    
+    def rebuild_indexes(self):
+        for index in self.indexes:
+            index.rebuild(self.products.values())
+    
+    def _product_changed(self, product):
+        with self._index_lock:
+            for index in self.indexes:
+                index.add(product)
+    
+    def _product_added(self, product_id, name, price, stock_quantity):
+        if self.storage.query_backed:
+            # A database write takes the storage lock, which comes before the index lock
+            put_product(self.products, product_id, name, price, stock_quantity)
+            product = self.products[product_id]
+            self._product_changed(product)
+            return product
+        # In memory, keys change under the index lock so readers copying the
+        # catalog under it never see the dict change size
+        with self._index_lock:
+            put_product(self.products, product_id, name, price, stock_quantity)
+            product = self.products[product_id]
+            for index in self.indexes:
+                index.add(product)
+        return product
+    
+    def _product_removed(self, product_id):
+        query_backed = self.storage.query_backed
+        if query_backed:
+            self.products.pop(product_id, None)
+        with self._index_lock:
+            if not query_backed:
+                self.products.pop(product_id, None)
+            for index in self.indexes:
+                index.discard(product_id)
+    
+    @contextmanager
+    def locked(self, product_ids):
+        """Hold the stock locks for product_ids, taken in a fixed order to avoid deadlock"""
+        stripes = sorted({hash(product_id) % len(self.stock_locks) for product_id in product_ids})
+        for stripe in stripes:
+            self.stock_locks[stripe].acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self.stock_locks[stripe].release()
+    
+    def available_stock(self, product_id, session_id=None):
+        """Stock not reserved by other sessions"""
+        with self.locked([product_id]):
+            product = self.get_product(product_id)
+            if product is None:
+                return 0
+            return product.stock_quantity - self.reservations.reserved(product_id, exclude_session=session_id)
     
+    def reserve_stock(self, product_id, session_id, quantity):
+        """Set the session's hold on a product to quantity if that much is available"""
+        with self.locked([product_id]):
+            if self.available_stock(product_id, session_id) < quantity:
+                return False
+            self.reservations.hold(product_id, session_id, quantity)
+            return True
+    
+    def release_stock(self, product_id, session_id):
+        with self.locked([product_id]):
+            self.reservations.release(product_id, session_id)
+    
+    def _new_product_store(self):
+        return ColumnarProductStore() if self.store == 'columnar' else {}
+    
+    @instrumented('load_data')
     def load_data(self):
-        products = {}
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r', newline='', encoding='utf-8') as file:
-                    reader = csv.DictReader(file)
-                    for row in reader:
-                        try:
-                            product = Product(
-                                row['product_id'],
-                                row['name'],
-                                float(row['price']),
-                                int(row['stock_quantity'])
-                            )
-                            products[product.product_id] = product
-                        except (ValueError, KeyError) as e:
-                            print(f"Error parsing product data: {e}")
-                            continue
-                print(f"Loaded {len(products)} products from {self.data_file}")
-            except Exception as e:
-                print(f"Error loading inventory data: {e}")
-        else:
-            print("No existing inventory file found. Starting with empty inventory.")
-        return products
+        return self.storage.load_products(self._new_product_store())
     
+    def _flush_changes(self):
+        # Change records go to disk before the data they describe, so a crash
+        # can leave a version for an unsaved change but never the reverse.
+        if self.changes is not None:
+            self.changes.flush()
+    
+    @instrumented('save_data')
     def save_data(self):
+        self._flush_changes()
+        return self.storage.save_products(self.products)
+    
+    @instrumented('compact')
+    def compact(self):
+        """Write all of memory back to storage (folding in the CSV journal)"""
+        with self._persist_lock:
+            self._flush_changes()
+            return self.storage.compact(self.products)
+    
+    @instrumented('persist')
+    def persist(self, changed=(), deleted=()):
+        """Record changed products and deleted product IDs in storage.
+        
+        With file storage, calls that arrive while a write is in progress are
+        queued and written together by the next caller, so concurrent
+        checkouts share one journal fsync. Database writes join the caller's
+        transaction and are written directly.
+        """
+        if self.storage.query_backed:
+            with self._persist_lock:
+                return self.storage.write_changes(self.products, changed, deleted)
+        
+        request = {'changed': changed, 'deleted': deleted, 'saved': None}
+        with self._persist_ready:
+            self._persist_queue.append(request)
+            while request['saved'] is None and self._persist_writing:
+                self._persist_ready.wait()
+            if request['saved'] is not None:
+                return request['saved']
+            self._persist_writing = True
+            requests, self._persist_queue = self._persist_queue, []
+        
+        # Merge in arrival order; products are read when written, so each
+        # record carries the newest state even if requests are reordered
+        changed, deleted = {}, {}
+        for queued in requests:
+            for product in queued['changed']:
+                deleted.pop(product.product_id, None)
+                changed[product.product_id] = product
+            for product_id in queued['deleted']:
+                changed.pop(product_id, None)
+                deleted[product_id] = None
+        saved = False
         try:
-            with open(self.data_file, 'w', newline='', encoding='utf-8') as file:
-                fieldnames = ['product_id', 'name', 'price', 'stock_quantity']
-                writer = csv.DictWriter(file, fieldnames=fieldnames)
-                writer.writeheader()
-                for product in self.products.values():
-                    writer.writerow(product.to_dict())
-            return True
-        except Exception as e:
-            print(f"Error saving inventory data: {e}")
-            return False
+            with self._persist_lock:
+                self._flush_changes()
+                saved = self.storage.write_changes(self.products, list(changed.values()), list(deleted))
+        finally:
+            with self._persist_ready:
+                for queued in requests:
+                    queued['saved'] = saved
+                self._persist_writing = False
+                self._persist_ready.notify_all()
+        return saved
+    
+    def changes_since(self, version=0, limit=None):
+        """Products added, updated or deleted after version, oldest change first.
+        
+        Returns {'version', 'full_resync', 'more', 'changed', 'deleted'}; pass the
+        returned version next time. With full_resync the feed no longer reaches
+        back to version, and changed is the whole catalog to replace the copy with.
+        None if the change feed is off (see changes_file).
+        """
+        if self.changes is None:
+            print("Change feed is not enabled!")
+            return None
+        if version < self.changes.floor:
+            # In memory, writers change the catalog and record its version under
+            # the index lock, so the copy matches current exactly
+            with nullcontext() if self.storage.query_backed else self._index_lock, self.changes.lock:
+                current = self.changes.version
+                products = list(self.products.values())
+            return {'version': current, 'full_resync': True, 'more': False, 'changed': products, 'deleted': []}
+        
+        current, changes = self.changes.changes_since(version)
+        more = limit is not None and len(changes) > limit
+        if more:
+            changes = changes[:limit]
+        changed, deleted = [], []
+        for change_version, op, product_id in changes:
+            product = self.products.get(product_id) if op == 'put' else None
+            if product is None:
+                deleted.append(product_id)
+            else:
+                changed.append(product)
+        return {'version': changes[-1][0] if more else current, 'full_resync': False, 'more': more,
+                'changed': changed, 'deleted': deleted}
+    
+    def export_changes(self, output_file, version=0, limit=None, file_format=None):
+        """Write changes_since(version) to a CSV or JSON-lines file; returns the result or None"""
+        if file_format is None:
+            file_format = 'jsonl' if output_file.lower().endswith(('.jsonl', '.json')) else 'csv'
+        if file_format not in ('csv', 'jsonl'):
+            print("Invalid export format! Use 'csv' or 'jsonl'.")
+            return None
+        result = self.changes_since(version, limit)
+        if result is None:
+            return None
+        
+        temp_file = output_file + '.tmp'
+        try:
+            with open(temp_file, 'w', newline='', encoding='utf-8') as file:
+                rows = [{'op': 'put', **product.to_dict()} for product in result['changed']]
+                rows += [{'op': 'del', 'product_id': product_id} for product_id in result['deleted']]
+                if file_format == 'csv':
+                    writer = csv.DictWriter(file, fieldnames=['op', 'product_id', 'name', 'price', 'stock_quantity'])
+                    writer.writeheader()
+                    writer.writerows(rows)
+                else:
+                    for row in rows:
+                        file.write(json.dumps(row) + '\n')
+            os.replace(temp_file, output_file)
+        except OSError as e:
+            print(f"Error exporting changes: {e}")
+            return None
+        
+        if result['full_resync']:
+            print(f"Version {version} is older than the retained history; exported the full catalog "
+                  f"({len(result['changed'])} products). Replace the downstream copy with it.")
+        else:
+            print(f"Exported {len(result['changed'])} changed and {len(result['deleted'])} deleted products "
+                  f"to {output_file}")
+        print(f"Next export: --since {result['version']}" + (" (more changes pending)" if result['more'] else ""))
+        return result
     
     def add_product(self, product_id, name, price, stock_quantity):
         if product_id in self.products:
@@ -108,8 +3132,8 @@ class InventoryManager:
             print("Stock quantity cannot be negative!")
             return False
         
-        self.products[product_id] = Product(product_id, name, price, stock_quantity)
-        if self.save_data():
+        product = self._product_added(product_id, name, price, stock_quantity)
+        if self.persist(changed=[product]):
             print("Product added successfully!")
             return True
         return False
@@ -119,21 +3143,23 @@ class InventoryManager:
             print("Product not found!")
             return False
         
+        if price is not None and price <= 0:
+            print("Price must be greater than zero!")
+            return False
+        if stock_quantity is not None and stock_quantity < 0:
+            print("Stock quantity cannot be negative!")
+            return False
+        
         product = self.products[product_id]
         if name is not None:
             product.name = name
         if price is not None:
-            if price <= 0:
-                print("Price must be greater than zero!")
-                return False
             product.price = price
         if stock_quantity is not None:
-            if stock_quantity < 0:
-                print("Stock quantity cannot be negative!")
-                return False
             product.stock_quantity = stock_quantity
+        self._product_changed(product)
         
-        if self.save_data():
+        if self.persist(changed=[product]):
             print("Product updated successfully!")
             return True
         return False
@@ -143,37 +3169,186 @@ class InventoryManager:
             print("Product not found!")
             return False
         
-        del self.products[product_id]
-        if self.save_data():
+        self._product_removed(product_id)
+        if self.persist(deleted=[product_id]):
             print("Product deleted successfully!")
             return True
         return False
     
-    def search_product(self, keyword):
-        results = []
-        for product in self.products.values():
-            if (keyword.lower() in product.name.lower() or 
-                keyword.lower() == product.product_id.lower()):
-                results.append(product)
-        return results
+    @instrumented('search')
+    def search_product(self, keyword, limit=None, offset=0):
+        # In-memory indexes are read under the lock their writers take
+        with nullcontext() if self.storage.query_backed else self._index_lock:
+            product_ids = self.search_index.search(keyword, limit, offset)
+            return [self.products[product_id] for product_id in product_ids]
+    
+    def decrement_stock(self, product_id, quantity):
+        product = self.products[product_id]
+        old_quantity = product.stock_quantity
+        product.stock_quantity -= quantity
+        self._product_changed(product)
+        
+        reorder_point = self.reorder_points.get(product_id, self.default_reorder_point)
+        if reorder_point is not None and old_quantity > reorder_point >= product.stock_quantity:
+            for callback in self.low_stock_subscribers:
+                callback(product, reorder_point)
+        return product
+    
+    def set_reorder_point(self, product_id, reorder_point):
+        if reorder_point is None:
+            self.reorder_points.pop(product_id, None)
+        else:
+            self.reorder_points[product_id] = reorder_point
+    
+    def subscribe_low_stock(self, callback):
+        self.low_stock_subscribers.append(callback)
+    
+    def get_low_stock_products(self, threshold=5):
+        with nullcontext() if self.storage.query_backed else self._index_lock:
+            return [self.products[product_id] for product_id in self.stock_index.at_or_below(threshold)]
+    
+    def most_valuable_products(self, k=5):
+        """(product, stock_value) pairs for the k products with the highest stock value"""
+        with nullcontext() if self.storage.query_backed else self._index_lock:
+            return [(self.products[product_id], stock_value) for product_id, stock_value in self.aggregates.top(k)]
     
     def get_product(self, product_id):
         return self.products.get(product_id)
     
-    def view_all_products(self):
+    def catalog_page(self, sort='name', descending=False, cursor=None, page_size=20, name=None,
+                     min_price=None, max_price=None, min_stock=None, max_stock=None):
+        """One page of products in sort order ('name', 'price' or 'stock'), resuming after cursor.
+        
+        Returns (products, next_cursor); next_cursor is None on the last page. Ranges are inclusive,
+        name matches a substring case-insensitively.
+        """
+        if sort not in self.sort_indexes:
+            raise ValueError(f"Unknown sort order {sort!r}; expected one of {', '.join(self.sort_indexes)}")
+        index = self.sort_indexes[sort]
+        # The sort index is scanned within its own range; the other ranges are
+        # intersected through their indexes before any product is fetched.
+        ranges = {'price': (min_price, max_price), 'stock': (min_stock, max_stock)}
+        low, high = ranges.pop(sort, (None, None))
+        filters = [(self.sort_indexes[key], *bounds) for key, bounds in ranges.items() if bounds != (None, None)]
+        name = name.lower() if name else None
+        
+        page = []
+        last_entry = next_cursor = None
+        # Query-backed indexes read the database, which has its own locking
+        with nullcontext() if self.storage.query_backed else self._index_lock:
+            for entry in index.scan(cursor, descending, low, high, filters):
+                product = self.products.get(entry[1])
+                if product is None or (name is not None and name not in product.name.lower()):
+                    continue
+                if len(page) == page_size:
+                    next_cursor = last_entry
+                    break
+                page.append(product)
+                last_entry = entry
+        return page, next_cursor
+    
+    def iter_catalog(self, sort='name', descending=False, page_size=100, **filters):
+        """Walk the catalog page by page; yields lists of at most page_size products"""
+        cursor = None
+        while True:
+            page, cursor = self.catalog_page(sort, descending, cursor, page_size, **filters)
+            if page:
+                yield page
+            if cursor is None:
+                return
+    
+    def find_products(self, min_price=None, max_price=None, min_stock=None, max_stock=None,
+                      order=None, descending=False, batch_size=500):
+        """Stream the products whose price and stock fall in the given inclusive ranges.
+        
+        Results come in order of order ('name', 'price' or 'stock'); without one,
+        the range matching the fewest products drives the scan. Products are
+        fetched batch_size at a time and the indexes are only locked per batch.
+        """
+        if order is None:
+            ranges = {'price': (min_price, max_price), 'stock': (min_stock, max_stock)}
+            bounded = [key for key, bounds in ranges.items() if bounds != (None, None)]
+            order = 'price'
+            if bounded:
+                order = min(bounded, key=lambda key: self.sort_indexes[key].count(*ranges[key]))
+        for page in self.iter_catalog(order, descending, batch_size, min_price=min_price, max_price=max_price,
+                                      min_stock=min_stock, max_stock=max_stock):
+            yield from page
+    
+    def render_catalog_page(self, products, title="ALL PRODUCTS", footer=None):
+        """Write a page of the catalog to stdout in a single buffered write"""
+        lines = ["", "="*60, title, "="*60,
+                 f"{'ID':<10} {'Name':<20} {'Price':<10} {'Stock':<10}", "-"*60]
+        for product in products:
+            lines.append(f"{product.product_id:<10} {product.name:<20} ${product.price:<9.2f} {product.stock_quantity:<10}")
+        if not products:
+            lines.append("No products match the current filter.")
+        lines.append("="*60)
+        if footer:
+            lines.append(footer)
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+    
+    def view_all_products(self, page_size=20):
         if not self.products:
             print("No products available!")
             return
         
-        print("\n" + "="*60)
-        print("ALL PRODUCTS")
-        print("="*60)
-        print(f"{'ID':<10} {'Name':<20} {'Price':<10} {'Stock':<10}")
-        print("-"*60)
-        for product in self.products.values():
-            print(f"{product.product_id:<10} {product.name:<20} ${product.price:<9.2f} {product.stock_quantity:<10}")
-        print("="*60)
+        sort, descending, filters = 'name', False, {}
+        cursors = [None]  # cursors[i] resumes the catalog at page i + 1
+        while True:
+            products, next_cursor = self.catalog_page(sort, descending, cursors[-1], page_size, **filters)
+            order = f"{sort}, {'descending' if descending else 'ascending'}"
+            if filters:
+                order += "; filter: " + ", ".join(f"{key}={value}" for key, value in filters.items())
+            single_page = next_cursor is None and len(cursors) == 1 and not filters
+            footer = None if single_page else "[n]ext  [p]revious  [s]ort  [f]ilter  [q]uit"
+            self.render_catalog_page(products, f"ALL PRODUCTS - page {len(cursors)} ({order})", footer)
+            if single_page:
+                return
+            
+            choice = input("Enter choice: ").strip().lower()
+            if choice in ('', 'n'):
+                if next_cursor is None:
+                    print("Already on the last page.")
+                else:
+                    cursors.append(next_cursor)
+            elif choice == 'p':
+                if len(cursors) > 1:
+                    cursors.pop()
+            elif choice == 's':
+                new_sort = input(f"Sort by ({'/'.join(self.sort_indexes)}): ").strip().lower()
+                if new_sort not in self.sort_indexes:
+                    print("Invalid sort order!")
+                    continue
+                sort = new_sort
+                descending = input("Descending? (y/n): ").strip().lower() == 'y'
+                cursors = [None]
+            elif choice == 'f':
+                try:
+                    filters = self._read_catalog_filters()
+                except ValueError:
+                    print("Invalid input! Prices and stock levels must be numbers.")
+                    continue
+                cursors = [None]
+            elif choice == 'q':
+                return
+            else:
+                print("Invalid choice! Please try again.")
     
+    def _read_catalog_filters(self):
+        filters = {}
+        name = input("Name contains (blank for any): ").strip()
+        if name:
+            filters['name'] = name
+        for key, prompt, parse in (('min_price', "Minimum price", float), ('max_price', "Maximum price", float),
+                                   ('min_stock', "Minimum stock", int), ('max_stock', "Maximum stock", int)):
+            value = input(f"{prompt} (blank for any): ").strip()
+            if value:
+                filters[key] = parse(value)
+        return filters
+    
+    @instrumented('import_products')
     def import_products(self, import_file):
         if not os.path.exists(import_file):
             print(f"Import file {import_file} not found!")
@@ -202,93 +3377,452 @@ class InventoryManager:
                             print(f"Invalid stock quantity for product {product_id}. Skipping.")
                             continue
                         
-                        self.products[product_id] = Product(product_id, name, price, stock_quantity)
+                        self._product_added(product_id, name, price, stock_quantity)
                         imported_count += 1
                     except (ValueError, KeyError) as e:
                         print(f"Error parsing product data: {e}. Skipping row.")
                         continue
+                METRICS.count('store_rows_parsed_total', 'import', reader.line_num - 1)
             
-            if self.save_data():
+            if self.compact():
                 print(f"Successfully imported {imported_count} products from {import_file}")
                 return True
             return False
         except Exception as e:
             print(f"Error importing products: {e}")
             return False
+    
+    @instrumented('bulk_import', failure=None)
+    def bulk_import(self, import_file, mode='skip', chunk_size=50000, workers=None, error_file=None):
+        """Stream a large CSV in chunks validated by a process pool.
+        
+        mode is 'skip' to keep existing products or 'upsert' to overwrite them.
+        Rejected rows are written to error_file (default <import_file>.errors.csv).
+        """
+        if mode not in ('skip', 'upsert'):
+            print("Invalid import mode! Use 'skip' or 'upsert'.")
+            return None
+        if not os.path.exists(import_file):
+            print(f"Import file {import_file} not found!")
+            return None
+        if error_file is None:
+            error_file = import_file + '.errors.csv'
+        
+        stats = {'inserted': 0, 'updated': 0, 'skipped': 0, 'rejected': 0}
+        max_in_flight = 2 * (workers or os.cpu_count() or 1)
+        start = time.perf_counter()
+        try:
+            with open(import_file, 'r', newline='', encoding='utf-8') as file, \
+                 open(error_file, 'w', newline='', encoding='utf-8') as errors, \
+                 ProcessPoolExecutor(max_workers=workers) as pool:
+                reader = csv.reader(file)
+                columns = next(reader, [])
+                error_writer = csv.writer(errors)
+                error_writer.writerow(['row', 'product_id', 'reason'])
+                
+                def validated_chunks():
+                    # Keep a bounded number of chunks in flight so memory stays flat,
+                    # and yield results in file order so the later row wins on duplicate IDs.
+                    in_flight = deque()
+                    while True:
+                        chunk = [(reader.line_num, row) for row in islice(reader, chunk_size)]
+                        if chunk:
+                            in_flight.append(pool.submit(validate_import_chunk, columns, chunk))
+                        if in_flight and (not chunk or len(in_flight) > max_in_flight):
+                            yield in_flight.popleft().result()
+                        elif not chunk:
+                            return
+                
+                for valid, rejects in validated_chunks():
+                    for line_num, product_id, reason in rejects:
+                        error_writer.writerow([line_num, product_id, reason])
+                    stats['rejected'] += len(rejects)
+                    for line_num, product_id, name, price, stock_quantity in valid:
+                        product = self.products.get(product_id)
+                        if product is None:
+                            self._product_added(product_id, name, price, stock_quantity)
+                            stats['inserted'] += 1
+                        elif mode == 'upsert':
+                            product.name = name
+                            product.price = price
+                            product.stock_quantity = stock_quantity
+                            # Write back for stores that hand out copies
+                            self.products[product_id] = product
+                            self._product_changed(product)
+                            stats['updated'] += 1
+                        else:
+                            error_writer.writerow([line_num, product_id, "product already exists"])
+                            stats['skipped'] += 1
+        except Exception as e:
+            print(f"Error importing products: {e}")
+            return None
+        
+        if not self.compact():
+            return None
+        
+        elapsed = time.perf_counter() - start
+        rows = sum(stats.values())
+        METRICS.count('store_rows_parsed_total', 'import', rows)
+        stats['rows_per_second'] = rows / elapsed if elapsed > 0 else 0.0
+        stats['peak_memory_mb'] = peak_memory_mb()
+        print(f"Imported {rows} rows from {import_file} in {elapsed:.2f}s ({stats['rows_per_second']:.0f} rows/s): "
+              f"{stats['inserted']} inserted, {stats['updated']} updated, "
+              f"{stats['skipped']} skipped, {stats['rejected']} rejected")
+        if stats['peak_memory_mb'] is not None:
+            print(f"Peak memory: {stats['peak_memory_mb']:.1f} MB")
+        if stats['skipped'] or stats['rejected']:
+            print(f"Skipped and rejected rows written to {error_file}")
+        return stats
 
-class BillingSystem:
-    def __init__(self, inventory_manager, sales_file='sales.csv'):
-        self.inventory_manager = inventory_manager
-        self.sales_file = sales_file
-        self.cart = []
-        self.current_discount = 0
-        self.sales = self.load_sales()
+# Promotions. Each rule lists the products it covers (for a bundle, the
+# products making up the category) and may be limited to a [start, end) window.
+PROMOTIONS_FILE = 'promotions.json'
+PROMOTION_KINDS = ('markdown', 'buy_x_get_y', 'bundle')
+
+class Promotion:
+    """One promotion rule.
     
-    def load_sales(self):
-        sales = []
-        if os.path.exists(self.sales_file):
+    markdown: percent or amount off each unit, or a new unit price
+    buy_x_get_y: of every buy + get units, the get cheapest are free (or percent off)
+    bundle: every quantity units from the products cost price together (or percent off)
+    """
+    
+    def __init__(self, promotion_id, kind, product_ids, name=None, start=None, end=None,
+                 percent=None, amount=None, price=None, buy=None, get=None, quantity=None):
+        if not promotion_id:
+            raise ValueError("no promotion_id")
+        if kind not in PROMOTION_KINDS:
+            raise ValueError(f"unknown kind {kind!r}")
+        if not product_ids:
+            raise ValueError("no product_ids")
+        if start is not None and end is not None and start >= end:
+            raise ValueError("start must be before end")
+        if percent is not None and not 0 < percent <= 100:
+            raise ValueError("percent must be between 0 and 100")
+        if kind == 'markdown' and sum(value is not None for value in (percent, amount, price)) != 1:
+            raise ValueError("markdown needs exactly one of percent, amount or price")
+        if kind == 'buy_x_get_y':
+            if not (isinstance(buy, int) and isinstance(get, int) and buy >= 1 and get >= 1):
+                raise ValueError("buy_x_get_y needs whole buy and get counts of at least 1")
+            if percent is None:
+                percent = 100
+        if kind == 'bundle':
+            if not (isinstance(quantity, int) and quantity >= 2):
+                raise ValueError("bundle needs a whole quantity of at least 2")
+            if (price is None) == (percent is None):
+                raise ValueError("bundle needs exactly one of price or percent")
+        for value in (amount, price):
+            if value is not None and value < 0:
+                raise ValueError("amounts and prices cannot be negative")
+        self.promotion_id = promotion_id
+        self.kind = kind
+        self.product_ids = [str(product_id) for product_id in product_ids]
+        self.name = name or promotion_id
+        self.start = start
+        self.end = end
+        self.percent = percent
+        self.amount = amount
+        self.price = price
+        self.buy = buy
+        self.get = get
+        self.quantity = quantity
+    
+    @classmethod
+    def from_dict(cls, data):
+        fields = dict(data)
+        for key in ('start', 'end'):
+            if fields.get(key) is not None:
+                fields[key] = datetime.fromisoformat(fields[key])
+        return cls(str(fields.pop('promotion_id', fields.pop('id', ''))), fields.pop('kind', None),
+                   fields.pop('product_ids', None), **fields)
+    
+    def to_dict(self):
+        data = {'promotion_id': self.promotion_id, 'kind': self.kind, 'name': self.name,
+                'product_ids': self.product_ids}
+        for key in ('start', 'end'):
+            if getattr(self, key) is not None:
+                data[key] = getattr(self, key).isoformat()
+        for key in ('percent', 'amount', 'price', 'buy', 'get', 'quantity'):
+            if getattr(self, key) is not None:
+                data[key] = getattr(self, key)
+        return data
+    
+    def active_at(self, when):
+        return (self.start is None or self.start <= when) and (self.end is None or when < self.end)
+    
+    def markdown(self, unit_price):
+        """Saving on one unit"""
+        if self.percent is not None:
+            return unit_price * self.percent / 100
+        if self.amount is not None:
+            return min(self.amount, unit_price)
+        return max(unit_price - self.price, 0)
+    
+    def multi_buy(self, runs):
+        """(saving, {product_id: units used}) over runs of (unit_price, product_id, quantity), dearest first"""
+        units = sum(quantity for unit_price, product_id, quantity in runs)
+        used = {}
+        saving = 0.0
+        if self.kind == 'buy_x_get_y':
+            group = self.buy + self.get
+            limit = units // group * group
+            def discounted(a):
+                # units at positions p < a (dearest first) with p % group >= buy are discounted
+                return a // group * self.get + max(0, a % group - self.buy)
+            
+            position = 0
+            for unit_price, product_id, quantity in runs:
+                first, last = min(position, limit), min(position + quantity, limit)
+                if last > first:
+                    saving += (discounted(last) - discounted(first)) * unit_price * self.percent / 100
+                    used[product_id] = last - first
+                position += quantity
+            return saving, used
+        
+        # Bundles: the dearest units are grouped first, and grouping stops once a
+        # bundle would no longer save anything (every later one is cheaper still).
+        size = self.quantity
+        bundle_total, bundle_count, bundle_used = 0.0, 0, []
+        for unit_price, product_id, quantity in runs:
+            remaining = quantity
+            while remaining:
+                if bundle_count == 0 and remaining >= size:
+                    # Whole bundles of this product at once
+                    bundles = remaining // size
+                    bundle_saving = self._bundle_saving(size * unit_price)
+                    if bundle_saving <= 0:
+                        return saving, used
+                    saving += bundles * bundle_saving
+                    used[product_id] = used.get(product_id, 0) + bundles * size
+                    remaining -= bundles * size
+                    continue
+                take = min(remaining, size - bundle_count)
+                bundle_total += take * unit_price
+                bundle_count += take
+                bundle_used.append((product_id, take))
+                remaining -= take
+                if bundle_count == size:
+                    bundle_saving = self._bundle_saving(bundle_total)
+                    if bundle_saving <= 0:
+                        return saving, used
+                    saving += bundle_saving
+                    for used_id, count in bundle_used:
+                        used[used_id] = used.get(used_id, 0) + count
+                    bundle_total, bundle_count, bundle_used = 0.0, 0, []
+        return saving, used
+    
+    def _bundle_saving(self, bundle_total):
+        if self.percent is not None:
+            return bundle_total * self.percent / 100
+        return bundle_total - self.price
+
+class PromotionEngine:
+    """Active promotions compiled into product_id -> rules tables, one per time window.
+    
+    The start and end times of all rules cut the timeline into windows in which
+    the set of active rules does not change; a window's table is built the
+    first time a cart is priced in it, so pricing a cart only looks at the
+    rules of the products in the cart.
+    """
+    
+    def __init__(self, promotions=(), max_tables=16):
+        self.promotions = {}
+        self.max_tables = max_tables
+        self.lock = threading.Lock()
+        self.compiled = ([], {})  # (sorted window boundaries, window position -> table)
+        for promotion in promotions:
+            self.promotions[promotion.promotion_id] = promotion
+        self._recompile()
+    
+    def __len__(self):
+        return len(self.promotions)
+    
+    def _recompile(self):
+        boundaries = sorted({when for promotion in self.promotions.values()
+                             for when in (promotion.start, promotion.end) if when is not None})
+        self.compiled = (boundaries, {})
+    
+    def add(self, promotion):
+        with self.lock:
+            self.promotions[promotion.promotion_id] = promotion
+            self._recompile()
+    
+    def remove(self, promotion_id):
+        with self.lock:
+            if self.promotions.pop(promotion_id, None) is None:
+                return False
+            self._recompile()
+            return True
+    
+    def load(self, promotions_file=PROMOTIONS_FILE):
+        """Replace the rules with those in a JSON file (a list of rule objects); returns the count or False"""
+        try:
+            with open(promotions_file, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Error loading promotions: {e}")
+            return False
+        promotions = {}
+        for i, entry in enumerate(data if isinstance(data, list) else [], 1):
             try:
-                with open(self.sales_file, 'r', newline='', encoding='utf-8') as file:
-                    reader = csv.DictReader(file)
-                    for row in reader:
-                        try:
-                            total_amount = float(row['total_amount'])
-                            discount = float(row.get('discount', 0))
-                            sale_datetime = datetime.fromisoformat(row['datetime'])
-                            
-                            sale = Sale([], total_amount, sale_datetime, discount)
-                            sales.append(sale)
-                        except (ValueError, KeyError) as e:
-                            print(f"Error parsing sale data: {e}")
-                            continue
-                print(f"Loaded {len(sales)} sales records from {self.sales_file}")
-            except Exception as e:
-                print(f"Error loading sales data: {e}")
-        else:
-            print("No existing sales file found. Starting with empty sales history.")
-        return sales
+                promotion = Promotion.from_dict(entry)
+            except (ValueError, TypeError, AttributeError) as e:
+                print(f"Skipping promotion {i} in {promotions_file}: {e}")
+                continue
+            promotions[promotion.promotion_id] = promotion
+        with self.lock:
+            self.promotions = promotions
+            self._recompile()
+        print(f"Loaded {len(promotions)} promotions from {promotions_file}")
+        return len(promotions)
     
-    def save_sales(self):
+    def save(self, promotions_file=PROMOTIONS_FILE):
+        temp_file = promotions_file + '.tmp'
         try:
-            with open(self.sales_file, 'w', newline='', encoding='utf-8') as file:
-                fieldnames = ['datetime', 'total_amount', 'discount', 'final_amount']
-                writer = csv.DictWriter(file, fieldnames=fieldnames)
-                writer.writeheader()
-                for sale in self.sales:
-                    writer.writerow({
-                        'datetime': sale.datetime.isoformat(),
-                        'total_amount': sale.total_amount,
-                        'discount': sale.discount,
-                        'final_amount': sale.final_amount
-                    })
+            with open(temp_file, 'w', encoding='utf-8') as file:
+                json.dump([promotion.to_dict() for promotion in self.promotions.values()], file, indent=2)
+            os.replace(temp_file, promotions_file)
             return True
-        except Exception as e:
-            print(f"Error saving sales data: {e}")
+        except OSError as e:
+            print(f"Error saving promotions: {e}")
             return False
     
+    def table_at(self, when):
+        """{product_id: [active promotions]} for the window containing when"""
+        boundaries, tables = self.compiled
+        position = bisect_right(boundaries, when)
+        table = tables.get(position)
+        if table is None:
+            with self.lock:
+                table = {}
+                for promotion in self.promotions.values():
+                    if promotion.active_at(when):
+                        for product_id in promotion.product_ids:
+                            table.setdefault(product_id, []).append(promotion)
+                if len(tables) >= self.max_tables:
+                    tables.clear()
+                tables[position] = table
+        return table
+    
+    def active(self, when=None):
+        return [promotion for promotion in self.promotions.values() if promotion.active_at(when or datetime.now())]
+    
+    def evaluate(self, items, when=None):
+        """(discount, applied) for a cart's OrderItems priced at when.
+        
+        Each item gets its best markdown; buy-x-get-y and bundle rules then
+        apply to the marked-down prices, best saving first, each unit counting
+        towards at most one of them. applied has one dict per rule used.
+        """
+        table = self.table_at(when or datetime.now())
+        unit_prices = {}
+        quantities = {}
+        for item in items:
+            product_id = item.product.product_id
+            unit_prices[product_id] = item.price
+            quantities[product_id] = quantities.get(product_id, 0) + item.quantity
+        
+        applied = {}
+        multi_buys = {}  # promotion_id -> (promotion, cart product_ids it covers)
+        for product_id, quantity in quantities.items():
+            best, best_saving = None, 0
+            for promotion in table.get(product_id, ()):
+                if promotion.kind != 'markdown':
+                    multi_buys.setdefault(promotion.promotion_id, (promotion, []))[1].append(product_id)
+                    continue
+                saving = promotion.markdown(unit_prices[product_id])
+                if saving > best_saving:
+                    best, best_saving = promotion, saving
+            if best is not None:
+                unit_prices[product_id] -= best_saving
+                self._record(applied, best, quantity, best_saving * quantity)
+        
+        remaining = dict(quantities)
+        candidates = list(multi_buys.values())
+        while candidates:
+            best = None
+            for candidate in candidates:
+                promotion, product_ids = candidate
+                runs = sorted(((unit_prices[product_id], product_id, remaining[product_id])
+                               for product_id in product_ids if remaining[product_id]), reverse=True)
+                saving, used = promotion.multi_buy(runs)
+                if saving > 0 and (best is None or saving > best[0]):
+                    best = (saving, used, candidate)
+            if best is None:
+                break
+            saving, used, candidate = best
+            for product_id, units in used.items():
+                remaining[product_id] -= units
+            self._record(applied, candidate[0], sum(used.values()), saving)
+            candidates.remove(candidate)
+        
+        applied = list(applied.values())
+        for entry in applied:
+            entry['discount'] = round(entry['discount'], 2)
+        return round(sum(entry['discount'] for entry in applied), 2), applied
+    
+    def _record(self, applied, promotion, units, discount):
+        entry = applied.setdefault(promotion.promotion_id, {
+            'promotion_id': promotion.promotion_id, 'name': promotion.name, 'kind': promotion.kind,
+            'units': 0, 'discount': 0.0})
+        entry['units'] += units
+        entry['discount'] += discount
+
+class SaleBatch:
+    """Sales and stock changes from several checkouts, written to storage together"""
+    
+    def __init__(self):
+        self.sales = []
+        self.changed = {}  # product_id -> product, last state wins
+
+class CartSession:
+    """One till's cart and discount; cart quantities are reserved in the shared inventory"""
+    
+    def __init__(self, billing_system, session_id):
+        self.billing_system = billing_system
+        self.inventory_manager = billing_system.inventory_manager
+        self.session_id = session_id
+        self.cart = []
+        self.current_discount = 0
+        # quiet sessions (batch processing) keep messages out of stdout;
+        # the reason for the last refusal is kept in last_error either way
+        self.quiet = False
+        self.last_error = None
+    
+    def _say(self, message):
+        if not self.quiet:
+            print(message)
+    
+    def _fail(self, message):
+        self.last_error = message
+        self._say(message)
+    
+    @instrumented('add_to_cart')
     def add_to_cart(self, product_id, quantity):
         product = self.inventory_manager.get_product(product_id)
         if not product:
-            print("Product not found!")
+            self._fail("Product not found!")
             return False
         
         if quantity <= 0:
-            print("Quantity must be greater than zero!")
+            self._fail("Quantity must be greater than zero!")
             return False
         
-        if product.stock_quantity < quantity:
-            print(f"Insufficient stock! Only {product.stock_quantity} available.")
+        item = next((item for item in self.cart if item.product.product_id == product_id), None)
+        held = item.quantity if item else 0
+        if not self.inventory_manager.reserve_stock(product_id, self.session_id, held + quantity):
+            available = self.inventory_manager.available_stock(product_id, self.session_id) - held
+            self._fail(f"Insufficient stock! Only {max(available, 0)} available.")
             return False
         
-        for item in self.cart:
-            if item.product.product_id == product_id:
-                item.quantity += quantity
-                item.total = item.product.price * item.quantity
-                print("Item quantity updated in cart!")
-                return True
+        if item:
+            item.quantity += quantity
+            item.reprice()
+            self._say("Item quantity updated in cart!")
+            return True
         
         self.cart.append(OrderItem(product, quantity))
-        print("Item added to cart!")
+        self._say("Item added to cart!")
         return True
     
     def remove_from_cart(self, product_id, quantity=None):
@@ -296,13 +3830,15 @@ class BillingSystem:
             if item.product.product_id == product_id:
                 if quantity is None or quantity >= item.quantity:
                     self.cart.pop(i)
-                    print("Item removed from cart!")
+                    self.inventory_manager.release_stock(product_id, self.session_id)
+                    self._say("Item removed from cart!")
                 else:
                     item.quantity -= quantity
-                    item.total = item.product.price * item.quantity
-                    print("Item quantity updated in cart!")
+                    item.reprice()
+                    self.inventory_manager.reserve_stock(product_id, self.session_id, item.quantity)
+                    self._say("Item quantity updated in cart!")
                 return True
-        print("Item not found in cart!")
+        self._fail("Item not found in cart!")
         return False
     
     def view_cart(self):
@@ -315,132 +3851,500 @@ class BillingSystem:
         print("="*60)
         total = 0
         for i, item in enumerate(self.cart, 1):
-            print(f"{i}. {item.product.name} - {item.quantity} x ${item.product.price:.2f} = ${item.total:.2f}")
+            print(f"{i}. {item.name} - {item.quantity} x ${item.price:.2f} = ${item.total:.2f}")
             total += item.total
         
         print("-"*60)
         print(f"Subtotal: ${total:.2f}")
+        promotion_discount, promotions = self.billing_system.promotions.evaluate(self.cart)
+        for promotion in promotions:
+            print(f"  {promotion['name']}: -${promotion['discount']:.2f}")
         if self.current_discount > 0:
             print(f"Discount: -${self.current_discount:.2f}")
-            print(f"Final Total: ${total - self.current_discount:.2f}")
+        if promotion_discount > 0 or self.current_discount > 0:
+            print(f"Final Total: ${total - promotion_discount - self.current_discount:.2f}")
         else:
             print(f"Total: ${total:.2f}")
         print("="*60)
     
     def apply_discount(self, discount_type, value):
         if not self.cart:
-            print("Cart is empty!")
+            self._fail("Cart is empty!")
             return False
         
-        total = sum(item.total for item in self.cart)
+        # Manual discounts come off what is left after promotions, which is
+        # also what checkout checks them against
+        promotion_discount, promotions = self.billing_system.promotions.evaluate(self.cart)
+        total = sum(item.total for item in self.cart) - promotion_discount
         
         if discount_type == "percentage":
             if value < 0 or value > 100:
-                print("Discount percentage must be between 0 and 100!")
+                self._fail("Discount percentage must be between 0 and 100!")
                 return False
             self.current_discount = total * (value / 100)
         elif discount_type == "fixed":
             if value < 0 or value > total:
-                print(f"Fixed discount must be between 0 and {total}!")
+                self._fail(f"Fixed discount must be between 0 and {total:.2f}!")
                 return False
             self.current_discount = value
         else:
-            print("Invalid discount type! Use 'percentage' or 'fixed'.")
+            self._fail("Invalid discount type! Use 'percentage' or 'fixed'.")
             return False
         
-        print(f"Discount applied: ${self.current_discount:.2f}")
+        self._say(f"Discount applied: ${self.current_discount:.2f}")
         return True
     
     def clear_discount(self):
         self.current_discount = 0
-        print("Discount cleared!")
+        self._say("Discount cleared!")
     
-    def checkout(self):
+    @instrumented('checkout', failure=None)
+    def checkout(self, batch=None, sale_datetime=None):
         if not self.cart:
-            print("Cart is empty!")
+            self._fail("Cart is empty!")
             return None
         
-        total = sum(item.total for item in self.cart)
-        
-        if self.current_discount < 0 or self.current_discount > total:
-            print("Invalid discount amount!")
+        sale = self.billing_system.commit_sale(self, batch, sale_datetime)
+        if sale is None:
             return None
         
-        sale = Sale(self.cart.copy(), total, datetime.now(), self.current_discount)
-        self.sales.append(sale)
-        self.save_sales()
+        self.cart.clear()
+        self.current_discount = 0
         
+        self._say("Checkout completed successfully!")
+        return sale
+    
+    def release(self):
+        """Empty the cart and give its reserved stock back"""
         for item in self.cart:
-            product = self.inventory_manager.get_product(item.product.product_id)
-            product.stock_quantity -= item.quantity
-        self.inventory_manager.save_data()
-        
+            self.inventory_manager.release_stock(item.product.product_id, self.session_id)
         self.cart.clear()
         self.current_discount = 0
+
+class BillingSystem:
+    def __init__(self, inventory_manager, sales_file='sales.csv', flush_interval=0, snapshot=False, storage=None,
+                 receipts_file=None):
+        self.inventory_manager = inventory_manager
+        self.sales_file = sales_file
+        # The CSV ledger (with group commit and snapshot options) unless another backend is given
+        if storage is None:
+            storage = CSVSalesStorage(sales_file, flush_interval, snapshot)
+        self.storage = storage
+        self._sales_lock = threading.Lock()
+        self._session_count = 0
+        # cart, current_discount and the cart methods act on this default session
+        self.session = CartSession(self, 'default')
+        if storage.query_backed:
+            self.sales_index = storage.sales_index()
+        else:
+            self.sales_index = SalesIndex(self.load_sales())
+        self.sales = self.sales_index.sales
+        self.analytics = storage.line_item_analytics()
+        self.forecaster = ReorderForecaster(self.analytics)
+        # Promotion rules priced into every checkout; open_store() loads promotions.json
+        self.promotions = PromotionEngine()
+        # Full receipts of checked-out sales for reprints, if an archive is given.
+        # A receipt is filed once the storage has made its sale durable, under
+        # the sale id the storage assigned.
+        self.receipts = None
+        if receipts_file:
+            self.receipts = ReceiptArchive(receipts_file)
+            storage.subscribe_committed(self.receipts.append)
+    
+    @instrumented('load_sales')
+    def load_sales(self):
+        return self.storage.load_sales()
+    
+    @instrumented('save_sales')
+    def save_sales(self):
+        return self.storage.save_sales(self.sales)
+    
+    def append_sale(self, sale):
+        return self.storage.append_sale(sale)
+    
+    def append_sales(self, sales):
+        return self.storage.append_sales(sales)
+    
+    @instrumented('flush_sales')
+    def flush_sales(self):
+        saved = self.storage.flush()
+        if self.receipts is not None:
+            self.receipts.flush()
+        return saved
+    
+    @property
+    def cart(self):
+        return self.session.cart
+    
+    @cart.setter
+    def cart(self, cart):
+        self.session.cart = cart
+    
+    @property
+    def current_discount(self):
+        return self.session.current_discount
+    
+    @current_discount.setter
+    def current_discount(self, discount):
+        self.session.current_discount = discount
+    
+    def open_session(self):
+        """Start another independent cart against the shared inventory"""
+        with self._sales_lock:
+            self._session_count += 1
+            return CartSession(self, f"till-{self._session_count}")
+    
+    def add_to_cart(self, product_id, quantity):
+        return self.session.add_to_cart(product_id, quantity)
+    
+    def remove_from_cart(self, product_id, quantity=None):
+        return self.session.remove_from_cart(product_id, quantity)
+    
+    def view_cart(self):
+        self.session.view_cart()
+    
+    def apply_discount(self, discount_type, value):
+        return self.session.apply_discount(discount_type, value)
+    
+    def clear_discount(self):
+        self.session.clear_discount()
+    
+    def checkout(self):
+        return self.session.checkout()
+    
+    def commit_sale(self, session, batch=None, sale_datetime=None):
+        """Deduct a session's cart from stock and record the sale; None if it cannot be filled.
         
-        print("Checkout completed successfully!")
+        With a SaleBatch the writes are left for commit_batch() instead.
+        """
+        total = sum(item.total for item in session.cart)
+        sale_datetime = sale_datetime or datetime.now()
+        promotion_discount, promotions = self.promotions.evaluate(session.cart, sale_datetime)
+        
+        if session.current_discount < 0 or session.current_discount > total - promotion_discount:
+            session._fail("Invalid discount amount!")
+            return None
+        
+        inventory_manager = self.inventory_manager
+        product_ids = [item.product.product_id for item in session.cart]
+        # A database write joins the transaction taken under the stock locks.
+        # Files are written after the locks are released, so other tills can
+        # sell the same products meanwhile and share the journal fsync.
+        write_after = batch is None and not inventory_manager.storage.query_backed
+        with inventory_manager.locked(product_ids), self.storage.transaction():
+            # Reservations normally guarantee this, but they may have expired
+            for item in session.cart:
+                product_id = item.product.product_id
+                available = inventory_manager.available_stock(product_id, session.session_id)
+                if available < item.quantity:
+                    session._fail(f"Insufficient stock for {item.product.name}! Only {max(available, 0)} available.")
+                    return None
+            
+            changed = []
+            for item in session.cart:
+                product = inventory_manager.decrement_stock(item.product.product_id, item.quantity)
+                inventory_manager.reservations.release(item.product.product_id, session.session_id)
+                changed.append(product)
+            
+            sale = Sale(session.cart.copy(), total, sale_datetime, promotion_discount + session.current_discount,
+                        promotions=promotions)
+            with self._sales_lock:
+                self.sales_index.add(sale)
+            self.forecaster.record_sale(sale)
+            if batch is None:
+                if not write_after:
+                    self.append_sale(sale)
+                    inventory_manager.persist(changed=changed)
+            else:
+                batch.sales.append(sale)
+                if inventory_manager.storage.query_backed:
+                    # Later orders read stock back from the database, so write it
+                    # now; it lands in the batch's open transaction.
+                    inventory_manager.persist(changed=changed)
+                else:
+                    for product in changed:
+                        batch.changed[product.product_id] = product
+        
+        if write_after:
+            # The ledger row still goes first (see main())
+            self.append_sale(sale)
+            inventory_manager.persist(changed=changed)
         return sale
     
+    def commit_batch(self, batch):
+        inventory_manager = self.inventory_manager
+        with inventory_manager.locked(batch.changed), self.storage.transaction():
+            saved = self.append_sales(batch.sales)
+            if batch.changed:
+                saved = inventory_manager.persist(changed=list(batch.changed.values())) and saved
+        return saved
+    
+    @contextmanager
+    def _batch_scope(self):
+        if not (self.storage.query_backed and self.storage is self.inventory_manager.storage):
+            yield
+            return
+        # One database transaction per batch. Take every stock stripe first so
+        # the lock order matches commit_sale (stripes, then the database).
+        inventory_manager = self.inventory_manager
+        for lock in inventory_manager.stock_locks:
+            lock.acquire()
+        try:
+            with self.storage.transaction():
+                yield
+        finally:
+            for lock in reversed(inventory_manager.stock_locks):
+                lock.release()
+    
+    def _run_order(self, session, line, batch):
+        """Put one JSON order through the cart rules; returns the rejection reason or None"""
+        try:
+            order = json.loads(line)
+            sale_datetime = datetime.fromisoformat(order['datetime']) if order.get('datetime') else None
+            for item in order['items']:
+                if not session.add_to_cart(str(item['product_id']), int(item['quantity'])):
+                    return session.last_error
+            discount = order.get('discount')
+            if discount and not session.apply_discount(discount['type'], float(discount['value'])):
+                return session.last_error
+            if session.checkout(batch, sale_datetime) is None:
+                return session.last_error
+            return None
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return f"Invalid order: {e}"
+        finally:
+            session.release()
+    
+    @instrumented('process_orders')
+    def process_orders(self, lines, rejects=None, batch_size=1000):
+        """Run JSON-lines orders through add_to_cart/apply_discount/checkout.
+        
+        Each line looks like {"items": [{"product_id": "101", "quantity": 2}],
+        "discount": {"type": "percentage", "value": 10}, "datetime": "..."}
+        with discount and datetime optional. Stock and sales are written once
+        per batch_size orders; rejected orders go to the rejects file object.
+        """
+        session = self.open_session()
+        session.quiet = True
+        stats = {'orders': 0, 'completed': 0, 'rejected': 0}
+        numbered = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+        start = time.perf_counter()
+        while True:
+            chunk = list(islice(numbered, batch_size))
+            if not chunk:
+                break
+            batch = SaleBatch()
+            with self._batch_scope():
+                for number, line in chunk:
+                    error = self._run_order(session, line, batch)
+                    if error is not None:
+                        stats['rejected'] += 1
+                        if rejects is not None:
+                            rejects.write(json.dumps({'line': number, 'order': line.strip(), 'error': error}) + '\n')
+                if not self.commit_batch(batch):
+                    print(f"Error committing batch ending at line {chunk[-1][0]}")
+            stats['orders'] += len(chunk)
+            stats['completed'] += len(batch.sales)
+        
+        elapsed = time.perf_counter() - start
+        stats['orders_per_second'] = stats['orders'] / elapsed if elapsed > 0 else 0.0
+        print(f"Processed {stats['orders']} orders in {elapsed:.2f}s ({stats['orders_per_second']:.0f} orders/s): "
+              f"{stats['completed']} completed, {stats['rejected']} rejected")
+        return stats
+    
     def display_bill(self, sale):
         """Display bill in terminal instead of generating file"""
         print("\n" + "="*50)
         print("BILL")
         print("="*50)
+        if sale.sale_id is not None:
+            print(f"Receipt #: {sale.sale_id}")
         print(f"Date: {sale.datetime.strftime('%Y-%m-%d %H:%M:%S')}")
         print("-"*50)
         print("Items:")
         for item in sale.items:
-            print(f"  {item.product.name} - {item.quantity} x ${item.product.price:.2f} = ${item.total:.2f}")
+            print(f"  {item.name} - {item.quantity} x ${item.price:.2f} = ${item.total:.2f}")
         print("-"*50)
         print(f"Subtotal: ${sale.total_amount:.2f}")
-        if sale.discount > 0:
-            print(f"Discount: -${sale.discount:.2f}")
+        for promotion in sale.promotions:
+            print(f"  {promotion['name']}: -${promotion['discount']:.2f}")
+        manual_discount = sale.discount - sum(promotion['discount'] for promotion in sale.promotions)
+        if manual_discount > 0.005:
+            print(f"Discount: -${manual_discount:.2f}")
         print(f"Total: ${sale.final_amount:.2f}")
         print("="*50)
         print("Thank you for your purchase!")
     
+    @instrumented('receipt_lookup')
+    def get_receipt(self, sale_id):
+        """The archived sale with its line items, or None"""
+        if self.receipts is None:
+            print("No receipt archive is configured.")
+            return None
+        self.storage.flush()  # file sales still waiting for group commit
+        return self.receipts.get(sale_id)
+    
+    @instrumented('receipt_lookup')
+    def find_receipts(self, start_date=None, end_date=None):
+        """Archived sales between two dates (inclusive), oldest first"""
+        if self.receipts is None:
+            print("No receipt archive is configured.")
+            return []
+        if start_date is None:
+            start_date = datetime.now().date() - timedelta(days=7)
+        if end_date is None:
+            end_date = datetime.now().date()
+        start = datetime.combine(start_date, datetime.min.time())
+        end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
+        self.storage.flush()
+        return self.receipts.between(start, end)
+    
+    def reprint_receipt(self, sale_id):
+        sale = self.get_receipt(sale_id)
+        if sale is None:
+            print(f"Receipt {sale_id} not found!")
+            return False
+        print("REPRINT")
+        self.display_bill(sale)
+        return True
+    
+    @instrumented('daily_sales')
     def get_daily_sales(self, target_date=None):
         if target_date is None:
             target_date = datetime.now().date()
         
-        daily_sales = []
-        for sale in self.sales:
-            if sale.datetime.date() == target_date:
-                daily_sales.append(sale)
+        start = datetime.combine(target_date, datetime.min.time())
+        return self.sales_index.between(start, start + timedelta(days=1))
+    
+    @instrumented('hourly_sales')
+    def get_hourly_sales(self, target_date=None):
+        if target_date is None:
+            target_date = datetime.now().date()
         
-        return daily_sales
+        hourly = {}
+        for hour, totals in sorted(self.sales_index.hourly_totals(target_date).items()):
+            hourly[hour] = dict(zip(('count', 'gross', 'discount', 'net'), totals))
+        return hourly
     
+    @instrumented('sales_report')
     def get_sales_report(self, start_date=None, end_date=None):
         if start_date is None:
             start_date = datetime.now().date() - timedelta(days=7)
         if end_date is None:
             end_date = datetime.now().date()
         
+        count, gross, discount, net = self.sales_index.daily_totals(start_date, end_date)
+        start = datetime.combine(start_date, datetime.min.time())
+        end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
         report = {
             'start_date': start_date,
             'end_date': end_date,
-            'total_sales': 0,
-            'total_amount': 0,
-            'transactions': []
+            'total_sales': count,
+            'total_amount': net,
+            'transactions': self.sales_index.between(start, end)
         }
         
-        for sale in self.sales:
-            if start_date <= sale.datetime.date() <= end_date:
-                report['transactions'].append(sale)
-                report['total_sales'] += 1
-                report['total_amount'] += sale.final_amount
-        
         return report
     
     def get_low_stock_products(self, threshold=5):
-        low_stock = []
-        for product in self.inventory_manager.products.values():
-            if product.stock_quantity <= threshold:
-                low_stock.append(product)
-        return low_stock
+        return self.inventory_manager.get_low_stock_products(threshold)
+    
+    def iter_sales(self, start_date=None, end_date=None):
+        """Yield the sales between the dates (inclusive) in datetime order, one at a time"""
+        if start_date is None:
+            start_date = datetime.now().date() - timedelta(days=7)
+        if end_date is None:
+            end_date = datetime.now().date()
+        start = datetime.combine(start_date, datetime.min.time())
+        end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
+        return self.sales_index.iter_between(start, end)
+    
+    @instrumented('sales_report_stream')
+    def stream_sales_report(self, start_date=None, end_date=None, sink=None, preview=5):
+        """Summarize the sales between the dates in one pass, in constant memory.
+        
+        Every sale is passed to sink (if given) as it is read; only the last
+        preview sales are kept, for display.
+        """
+        if start_date is None:
+            start_date = datetime.now().date() - timedelta(days=7)
+        if end_date is None:
+            end_date = datetime.now().date()
+        
+        recent = deque(maxlen=preview)
+        count = 0
+        gross = discount = net = 0.0
+        for sale in self.iter_sales(start_date, end_date):
+            if sink is not None:
+                sink(sale)
+            count += 1
+            gross += sale.total_amount
+            discount += sale.discount
+            net += sale.final_amount
+            recent.append(sale)
+        
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            'total_sales': count,
+            'gross_amount': gross,
+            'total_discount': discount,
+            'total_amount': net,
+            'recent': list(recent)
+        }
+    
+    def export_sales_report(self, output_file, start_date=None, end_date=None, file_format=None):
+        """Stream the sales between the dates to a CSV or JSON-lines file; returns the summary or None.
+        
+        The format follows the file extension (.jsonl/.json for JSON lines)
+        unless file_format is 'csv' or 'jsonl'.
+        """
+        if file_format is None:
+            file_format = 'jsonl' if output_file.lower().endswith(('.jsonl', '.json')) else 'csv'
+        if file_format not in ('csv', 'jsonl'):
+            print("Invalid export format! Use 'csv' or 'jsonl'.")
+            return None
+        
+        def write_row(sale):
+            writer.writerow(CSVSalesStorage.sale_row(sale))
+        
+        def write_record(sale):
+            record = sale.to_dict()
+            if not sale.items:
+                # Sales read back from storage carry no line items; the receipt
+                # archive has them, and a sale missing there is exported without
+                receipt = self.receipts.get(sale.sale_id) if self.receipts is not None and sale.sale_id is not None else None
+                if receipt is None:
+                    del record['items'], record['promotions']
+                else:
+                    record['items'] = [item.to_dict() for item in receipt.items]
+                    record['promotions'] = receipt.promotions
+            for key in ('total_amount', 'discount', 'final_amount'):
+                record[key] = float(record[key])
+            file.write(json.dumps(record) + '\n')
+        
+        if file_format == 'jsonl' and self.receipts is not None:
+            self.storage.flush()  # file receipts of sales still waiting for group commit
+        temp_file = output_file + '.tmp'
+        try:
+            with open(temp_file, 'w', newline='', encoding='utf-8') as file:
+                if file_format == 'csv':
+                    writer = csv.DictWriter(file, fieldnames=LEDGER_FIELDNAMES)
+                    writer.writeheader()
+                    sink = write_row
+                else:
+                    sink = write_record
+                report = self.stream_sales_report(start_date, end_date, sink)
+            os.replace(temp_file, output_file)
+        except Exception as e:
+            print(f"Error exporting sales report: {e}")
+            return None
+        
+        print(f"Exported {report['total_sales']} sales ({report['start_date']} to {report['end_date']}) to {output_file}")
+        return report
     
     def display_sales_report(self, start_date=None, end_date=None):
-        report = self.get_sales_report(start_date, end_date)
+        report = self.stream_sales_report(start_date, end_date)
         
         print("\n" + "="*60)
         print("SALES REPORT")
@@ -449,18 +4353,482 @@ class BillingSystem:
         print(f"Total Transactions: {report['total_sales']}")
         print(f"Total Revenue: ${report['total_amount']:.2f}")
         
-        if report['transactions']:
+        if report['recent']:
             print("\nRecent Transactions:")
             print("-"*60)
-            for i, sale in enumerate(report['transactions'][-5:], 1):  # Show last 5 transactions
+            for i, sale in enumerate(report['recent'], 1):  # Show last 5 transactions
                 print(f"{i}. {sale.datetime.strftime('%Y-%m-%d %H:%M')} - ${sale.final_amount:.2f}")
         
         print("="*60)
+    
+    def get_reorder_forecast(self, reorder_only=True):
+        return self.forecaster.forecast(self.inventory_manager, reorder_only=reorder_only)
+    
+    def display_reorder_forecast(self):
+        forecast = self.get_reorder_forecast()
+        forecaster = self.forecaster
+        print("\n" + "="*70)
+        print("REORDER FORECAST")
+        print("="*70)
+        print(f"Reorder when stock covers {forecaster.lead_time_days + forecaster.safety_days:g} days or less; "
+              f"order up to {forecaster.lead_time_days + forecaster.cover_days:g} days of sales")
+        if not forecast:
+            print("No products need reordering.")
+            print("="*70)
+            return
+        
+        print(f"{'ID':<10} {'Name':<20} {'Stock':>6} {'Per day':>8} {'Days left':>10} {'Order':>7}")
+        print("-"*70)
+        for entry in forecast:
+            product = self.inventory_manager.get_product(entry['product_id'])
+            print(f"{entry['product_id']:<10} {product.name[:20]:<20} {entry['stock_quantity']:>6} "
+                  f"{entry['velocity']:>8.2f} {entry['days_of_cover']:>10.1f} {entry['suggested_quantity']:>7}")
+        print("="*70)
+    
+    def display_product_analytics(self, start_date=None, end_date=None, limit=10):
+        if start_date is None:
+            start_date = datetime.now().date() - timedelta(days=7)
+        if end_date is None:
+            end_date = datetime.now().date()
+        
+        top = self.analytics.top_sellers(start_date, end_date, limit)
+        print("\n" + "="*60)
+        print("PRODUCT SALES ANALYTICS")
+        print("="*60)
+        print(f"Period: {start_date} to {end_date}")
+        if not top:
+            print("No line items recorded for this period.")
+            print("="*60)
+            return
+        
+        print(f"\nTop {len(top)} Products (by units sold):")
+        print("-"*60)
+        for i, (product_id, units, revenue) in enumerate(top, 1):
+            product = self.inventory_manager.get_product(product_id)
+            name = product.name if product else product_id
+            print(f"{i}. {name} ({product_id}) - {units} units, ${revenue:.2f}")
+        
+        print("\nUnits Sold by Hour:")
+        print("-"*60)
+        for hour, units in self.analytics.units_by_hour(start_date, end_date).items():
+            if units:
+                print(f"{hour:02d}:00 - {units}")
+        
+        print("\nBasket Size (units per sale):")
+        print("-"*60)
+        for size, count in self.analytics.basket_sizes(start_date, end_date).items():
+            print(f"{size} units: {count} sales")
+        print("="*60)
+
+def print_reorder_alert(product, reorder_point):
+    print(f"REORDER ALERT: {product.name} ({product.product_id}) is down to {product.stock_quantity} "
+          f"(reorder point {reorder_point})")
+
+def stress_test_checkout(threads=16, orders_per_thread=200, product_count=20, stock=300, seed=0):
+    """Run many tills checking out concurrently against one inventory.
+    
+    Checks that stock never goes negative, that every unit sold was deducted
+    exactly once, and that the journal and ledger on disk agree with memory.
+    """
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull:
+        data_file = os.path.join(directory, 'inventory.csv')
+        sales_file = os.path.join(directory, 'sales.csv')
+        with redirect_stdout(devnull):
+            inventory_manager = InventoryManager(data_file, journal=True)
+            for i in range(product_count):
+                inventory_manager.add_product(f"P{i}", f"Product {i}", 1.0 + i, stock)
+            billing_system = BillingSystem(inventory_manager, sales_file, flush_interval=0.05)
+        
+        sold = Counter()
+        completed = []
+        lock = threading.Lock()
+        
+        def till(number):
+            rng = random.Random(seed + number)
+            session = billing_system.open_session()
+            my_sold = Counter()
+            my_completed = 0
+            for _ in range(orders_per_thread):
+                for _ in range(rng.randint(1, 3)):
+                    session.add_to_cart(f"P{rng.randrange(product_count)}", rng.randint(1, 5))
+                sale = session.checkout()
+                if sale is None:
+                    session.release()
+                    continue
+                my_completed += 1
+                for item in sale.items:
+                    my_sold[item.product.product_id] += item.quantity
+            with lock:
+                sold.update(my_sold)
+                completed.append(my_completed)
+        
+        start = time.perf_counter()
+        with redirect_stdout(devnull):
+            workers = [threading.Thread(target=till, args=(n,)) for n in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            billing_system.flush_sales()
+        elapsed = time.perf_counter() - start
+        
+        failures = []
+        for product in inventory_manager.products.values():
+            if product.stock_quantity < 0:
+                failures.append(f"{product.product_id} stock is negative: {product.stock_quantity}")
+            if product.stock_quantity != stock - sold[product.product_id]:
+                failures.append(f"{product.product_id} stock {product.stock_quantity} does not match "
+                                f"{stock} - {sold[product.product_id]} sold")
+        with redirect_stdout(devnull):
+            reloaded = InventoryManager(data_file, journal=True)
+            ledger = BillingSystem(reloaded, sales_file)
+        for product in inventory_manager.products.values():
+            if reloaded.products[product.product_id].stock_quantity != product.stock_quantity:
+                failures.append(f"{product.product_id} stock on disk differs from memory")
+        if len(ledger.sales) != sum(completed):
+            failures.append(f"ledger has {len(ledger.sales)} sales, expected {sum(completed)}")
+    
+    attempted = threads * orders_per_thread
+    print(f"{threads} tills, {attempted} orders, {sum(completed)} completed in {elapsed:.2f}s "
+          f"({attempted / elapsed:.0f} orders/s)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK: stock never went negative and matches units sold")
+    return not failures
+
+def open_inventory(db_path=None, directory=''):
+    """The inventory manager open_store() uses, with the change feed next to the data"""
+    if db_path:
+        return InventoryManager(default_reorder_point=5, storage=SQLiteStorage(db_path),
+                                changes_file=db_path + '.changes')
+    data_file = os.path.join(directory, 'inventory.csv')
+    return InventoryManager(data_file, journal=True, default_reorder_point=5, snapshot=True,
+                            changes_file=data_file + '.changes')
+
+def open_store(db_path=None, directory='', flush_interval=1.0):
+    """Create the inventory manager and billing system over CSV files or an SQLite database.
+    
+    The CSV files and sales partitions are looked for in directory (see StoreChain).
+    Sales are group-committed every flush_interval seconds; 0 writes each one
+    before its stock change is journalled.
+    """
+    inventory_manager = open_inventory(db_path, directory)
+    if db_path:
+        billing_system = BillingSystem(inventory_manager, storage=inventory_manager.storage,
+                                       receipts_file=db_path + '.receipts')
+    else:
+        receipts_file = os.path.join(directory, RECEIPTS_FILE)
+        partitions = os.path.join(directory, SALES_PARTITION_DIR)
+        if os.path.exists(os.path.join(partitions, 'manifest.json')):
+            # Set up by the migrate-sales command
+            billing_system = BillingSystem(inventory_manager, storage=PartitionedSalesStorage(partitions, flush_interval),
+                                           receipts_file=receipts_file)
+        else:
+            billing_system = BillingSystem(inventory_manager, os.path.join(directory, 'sales.csv'),
+                                           flush_interval, snapshot=True, receipts_file=receipts_file)
+    promotions_file = os.path.join(directory, PROMOTIONS_FILE)
+    if os.path.exists(promotions_file):
+        billing_system.promotions.load(promotions_file)
+    inventory_manager.subscribe_low_stock(print_reorder_alert)
+    return inventory_manager, billing_system
+
+# Store chains: one directory per store under a root, each laid out like a
+# single store (inventory.csv, sales.csv or sales_partitions/, or store.db).
+STORE_DB_FILE = 'store.db'
 
-def main():
-    inventory_manager = InventoryManager()
-    billing_system = BillingSystem(inventory_manager)
+def shard_storage(directory):
+    """(inventory storage, sales storage) for the store kept in directory.
+    
+    Shards are read concurrently by report workers, so the CSV storages are
+    opened without snapshots and a database read-only: reading never writes
+    into the store.
+    """
+    db_path = os.path.join(directory, STORE_DB_FILE)
+    if os.path.exists(db_path):
+        storage = SQLiteStorage(db_path, read_only=True)
+        return storage, storage
+    inventory_storage = CSVInventoryStorage(os.path.join(directory, 'inventory.csv'), journal=True)
+    partitions = os.path.join(directory, SALES_PARTITION_DIR)
+    if os.path.exists(os.path.join(partitions, 'manifest.json')):
+        return inventory_storage, PartitionedSalesStorage(partitions, workers=1)
+    return inventory_storage, CSVSalesStorage(os.path.join(directory, 'sales.csv'))
+
+def scan_inventory_shard(directory, low_stock_threshold=5, top_k=5, include_stock=False):
+    """Partial product statistics (and optionally every stock level) for one store; runs in a worker process"""
+    inventory_storage = shard_storage(directory)[0]
+    with redirect_stdout(io.StringIO()):
+        products = inventory_storage.load_products({})
+    count = low_stock_count = out_of_stock_count = 0
+    stock_values = []
+    stock = []
+    for product in products.values():
+        count += 1
+        if product.stock_quantity <= low_stock_threshold:
+            low_stock_count += 1
+        if product.stock_quantity == 0:
+            out_of_stock_count += 1
+        stock_values.append((product.price * product.stock_quantity, product.product_id, product.name))
+        if include_stock:
+            stock.append((product.product_id, product.name, product.stock_quantity))
+    if isinstance(inventory_storage, SQLiteStorage):
+        inventory_storage.close()
+    return {
+        'total_products': count,
+        'total_stock_value': math.fsum(value for value, product_id, name in stock_values),
+        'low_stock_count': low_stock_count,
+        'out_of_stock_count': out_of_stock_count,
+        'top': heapq.nlargest(top_k, stock_values),
+        'stock': stock
+    }
+
+def shard_sales_totals(directory, start_date, end_date):
+    """[count, gross, discount, net] of one store's sales between the dates; runs in a worker process"""
+    sales_storage = shard_storage(directory)[1]
+    with redirect_stdout(io.StringIO()):
+        if sales_storage.query_backed:
+            totals = sales_storage.sales_index().daily_totals(start_date, end_date)
+        else:
+            totals = sales_storage.sales_totals(start_date, end_date)
+    if isinstance(sales_storage, SQLiteStorage):
+        sales_storage.close()
+    return list(totals)
+
+class ChainStockIndex:
+    """Stock of each product across the stores of a chain: product_id -> {store_id: stock_quantity}"""
+    
+    def __init__(self):
+        self.stock = {}
+        self.names = {}
+        self.store_products = {}  # store_id -> set of product_ids it stocks
+        self.lock = threading.Lock()
+    
+    def set_store(self, store_id, rows):
+        """Replace one store's entries with (product_id, name, stock_quantity) rows"""
+        with self.lock:
+            for product_id in self.store_products.pop(store_id, ()):
+                self._remove(store_id, product_id)
+            product_ids = self.store_products[store_id] = set()
+            for product_id, name, stock_quantity in rows:
+                self.stock.setdefault(product_id, {})[store_id] = stock_quantity
+                self.names[product_id] = name
+                product_ids.add(product_id)
+    
+    def update(self, store_id, product_id, name, stock_quantity):
+        with self.lock:
+            self.stock.setdefault(product_id, {})[store_id] = stock_quantity
+            self.names[product_id] = name
+            self.store_products.setdefault(store_id, set()).add(product_id)
+    
+    def remove(self, store_id, product_id):
+        with self.lock:
+            self.store_products.get(store_id, set()).discard(product_id)
+            self._remove(store_id, product_id)
+    
+    def _remove(self, store_id, product_id):
+        stores = self.stock.get(product_id)
+        if stores is not None:
+            stores.pop(store_id, None)
+            if not stores:
+                del self.stock[product_id]
+                self.names.pop(product_id, None)
+    
+    def lookup(self, product_id):
+        """{store_id: stock_quantity} for every store that lists the product"""
+        with self.lock:
+            return dict(sorted(self.stock.get(product_id, {}).items()))
+    
+    def stores_with(self, product_id, quantity=1):
+        """Store IDs holding at least quantity units, most stock first"""
+        stores = self.lookup(product_id)
+        return sorted((store_id for store_id, stock_quantity in stores.items() if stock_quantity >= quantity),
+                      key=lambda store_id: -stores[store_id])
+    
+    def shard(self, store_id):
+        return ChainShardIndex(self, store_id)
+
+class ChainShardIndex:
+    """Inventory index (add/discard/clear/rebuild) that keeps one store's part of a ChainStockIndex current"""
+    
+    def __init__(self, chain_index, store_id):
+        self.chain_index = chain_index
+        self.store_id = store_id
+    
+    def add(self, product):
+        self.chain_index.update(self.store_id, product.product_id, product.name, product.stock_quantity)
+    
+    def discard(self, product_id):
+        self.chain_index.remove(self.store_id, product_id)
+    
+    def clear(self):
+        self.chain_index.set_store(self.store_id, ())
+    
+    def rebuild(self, products):
+        self.chain_index.set_store(self.store_id, ((product.product_id, product.name, product.stock_quantity)
+                                                   for product in products))
+
+class StoreChain:
+    """The stores of a chain, one single-store directory each under root.
+    
+    Chain-wide reports send one task per store to a process pool and merge the
+    partial totals, so they scale with cores rather than with store count.
+    """
+    
+    def __init__(self, root='stores', workers=None, low_stock_threshold=5):
+        self.root = root
+        self.workers = workers
+        self.low_stock_threshold = low_stock_threshold
+        self.stock_index = ChainStockIndex()
+        self.indexed = False
+        self.open_stores = {}  # store_id -> (inventory_manager, billing_system)
+    
+    def store_ids(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir())
+    
+    def directory(self, store_id):
+        return os.path.join(self.root, store_id)
+    
+    def add_store(self, store_id):
+        os.makedirs(self.directory(store_id), exist_ok=True)
+    
+    def open_store(self, store_id):
+        """(inventory_manager, billing_system) for one store, or None if there is no such store.
+        
+        Stock changes made through it are reflected in the merged stock index.
+        """
+        if store_id in self.open_stores:
+            return self.open_stores[store_id]
+        directory = self.directory(store_id)
+        if not os.path.isdir(directory):
+            print(f"Store {store_id} not found!")
+            return None
+        db_path = os.path.join(directory, STORE_DB_FILE)
+        inventory_manager, billing_system = open_store(db_path if os.path.exists(db_path) else None, directory)
+        index = self.stock_index.shard(store_id)
+        index.rebuild(inventory_manager.products.values())
+        inventory_manager.indexes.append(index)
+        self.open_stores[store_id] = inventory_manager, billing_system
+        return inventory_manager, billing_system
+    
+    def close(self):
+        for inventory_manager, billing_system in self.open_stores.values():
+            billing_system.flush_sales()
+            inventory_manager.compact()
+        self.open_stores.clear()
+    
+    def fan_out(self, function, *args):
+        """{store_id: function(store directory, *args)}, one process pool task per store"""
+        # Workers read the files, so write out sales still waiting for a group commit
+        for inventory_manager, billing_system in self.open_stores.values():
+            billing_system.flush_sales()
+        store_ids = self.store_ids()
+        directories = [self.directory(store_id) for store_id in store_ids]
+        if self.workers == 1 or len(store_ids) < 2:
+            return {store_id: function(directory, *args) for store_id, directory in zip(store_ids, directories)}
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(function, directory, *args) for directory in directories]
+            return {store_id: future.result() for store_id, future in zip(store_ids, futures)}
+    
+    def refresh_stock_index(self):
+        """Rebuild the merged stock index from every store's files"""
+        for store_id, partial in self.fan_out(scan_inventory_shard, self.low_stock_threshold, 0, True).items():
+            # Stores open in this process already keep their entries current
+            if store_id not in self.open_stores:
+                self.stock_index.set_store(store_id, partial['stock'])
+        self.indexed = True
+    
+    def stock_lookup(self, product_id):
+        """{store_id: stock_quantity} for the product across the chain"""
+        if not self.indexed:
+            self.refresh_stock_index()
+        return self.stock_index.lookup(product_id)
     
+    @instrumented('chain_sales_report')
+    def get_sales_report(self, start_date=None, end_date=None):
+        if start_date is None:
+            start_date = datetime.now().date() - timedelta(days=7)
+        if end_date is None:
+            end_date = datetime.now().date()
+        
+        partials = self.fan_out(shard_sales_totals, start_date, end_date)
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            'total_sales': sum(totals[0] for totals in partials.values()),
+            'gross_amount': math.fsum(totals[1] for totals in partials.values()),
+            'total_discount': math.fsum(totals[2] for totals in partials.values()),
+            'total_amount': math.fsum(totals[3] for totals in partials.values()),
+            'stores': {store_id: {'total_sales': totals[0], 'total_amount': totals[3]}
+                       for store_id, totals in partials.items()}
+        }
+    
+    @instrumented('chain_product_statistics')
+    def get_product_statistics(self, top_k=5):
+        partials = self.fan_out(scan_inventory_shard, self.low_stock_threshold, top_k)
+        top = heapq.nlargest(top_k, ((stock_value, store_id, product_id, name)
+                                     for store_id, partial in partials.items()
+                                     for stock_value, product_id, name in partial['top']))
+        return {
+            'stores': len(partials),
+            'total_products': sum(partial['total_products'] for partial in partials.values()),
+            'total_stock_value': math.fsum(partial['total_stock_value'] for partial in partials.values()),
+            'low_stock_count': sum(partial['low_stock_count'] for partial in partials.values()),
+            'out_of_stock_count': sum(partial['out_of_stock_count'] for partial in partials.values()),
+            'top': [(store_id, product_id, name, stock_value) for stock_value, store_id, product_id, name in top]
+        }
+    
+    def display_sales_report(self, start_date=None, end_date=None):
+        report = self.get_sales_report(start_date, end_date)
+        lines = ["", "="*60, "CHAIN SALES REPORT",
+                 f"Period: {report['start_date']} to {report['end_date']}", "="*60,
+                 f"{'Store':<20} {'Sales':>10} {'Amount':>15}", "-"*60]
+        for store_id, totals in report['stores'].items():
+            amount = f"${totals['total_amount']:.2f}"
+            lines.append(f"{store_id:<20} {totals['total_sales']:>10} {amount:>15}")
+        amount = f"${report['total_amount']:.2f}"
+        lines.extend(["-"*60,
+                      f"{'All stores':<20} {report['total_sales']:>10} {amount:>15}",
+                      f"Total Discount: ${report['total_discount']:.2f}", "="*60])
+        sys.stdout.write("\n".join(lines) + "\n")
+    
+    def display_product_statistics(self, top_k=5):
+        stats = self.get_product_statistics(top_k)
+        lines = ["", "="*50, "CHAIN PRODUCT STATISTICS", "="*50,
+                 f"Stores: {stats['stores']}",
+                 f"Total Products (summed over stores): {stats['total_products']}",
+                 f"Total Stock Value: ${stats['total_stock_value']:.2f}",
+                 f"Low Stock Items: {stats['low_stock_count']}",
+                 f"Out of Stock Items: {stats['out_of_stock_count']}",
+                 "", f"Top {top_k} Most Valuable Stock Holdings:", "-"*50]
+        for i, (store_id, product_id, name, stock_value) in enumerate(stats['top'], 1):
+            lines.append(f"{i}. {name} ({product_id}) at {store_id} - ${stock_value:.2f}")
+        sys.stdout.write("\n".join(lines) + "\n")
+    
+    def display_stock(self, product_id):
+        stores = self.stock_lookup(product_id)
+        if not stores:
+            print(f"Product {product_id} is not stocked in any store.")
+            return
+        print(f"\n{self.stock_index.names.get(product_id, product_id)} ({product_id}):")
+        for store_id, stock_quantity in stores.items():
+            print(f"  {store_id:<20} {stock_quantity:>8}")
+        print(f"  {'Total':<20} {sum(stores.values()):>8}")
+
+def main(db_path=None):
+    # No group commit here: a till may be closed at any moment, and the
+    # ledger row must be on disk before the stock change is journalled
+    inventory_manager, billing_system = open_store(db_path, flush_interval=0)
+    try:
+        store_menu(billing_system, inventory_manager)
+    except (EOFError, KeyboardInterrupt):
+        print()
+    finally:
+        billing_system.flush_sales()
+        inventory_manager.compact()
+
+def store_menu(billing_system, inventory_manager):
     while True:
         print("\n" + "="*60)
         print("STORE MANAGEMENT SYSTEM")
@@ -496,10 +4864,11 @@ def inventory_menu(inventory_manager):
         print("4. Delete Product")
         print("5. Search Product")
         print("6. Import Products from CSV")
-        print("7. Back to Main Menu")
+        print("7. Bulk Import Products from CSV")
+        print("8. Back to Main Menu")
         print("-"*60)
         
-        choice = input("Enter your choice (1-7): ").strip()
+        choice = input("Enter your choice (1-8): ").strip()
         
         if choice == '1':
             inventory_manager.view_all_products()
@@ -538,6 +4907,10 @@ def inventory_menu(inventory_manager):
             filename = input("Enter CSV filename to import: ")
             inventory_manager.import_products(filename)
         elif choice == '7':
+            filename = input("Enter CSV filename to import: ")
+            mode = input("Update existing products? (y/N): ").strip().lower()
+            inventory_manager.bulk_import(filename, mode='upsert' if mode == 'y' else 'skip')
+        elif choice == '8':
             break
         else:
             print("Invalid choice! Please try again.")
@@ -553,10 +4926,11 @@ def billing_menu(billing_system):
         print("4. Apply Discount")
         print("5. Clear Discount")
         print("6. Checkout")
-        print("7. Back to Main Menu")
+        print("7. Reprint Receipt")
+        print("8. Back to Main Menu")
         print("-"*60)
         
-        choice = input("Enter your choice (1-7): ").strip()
+        choice = input("Enter your choice (1-8): ").strip()
         
         if choice == '1':
             billing_system.view_cart()
@@ -587,6 +4961,11 @@ def billing_menu(billing_system):
                 print(f"\nSale completed! Final amount: ${sale.final_amount:.2f}")
                 billing_system.display_bill(sale)  # Display bill in terminal instead of file
         elif choice == '7':
+            try:
+                billing_system.reprint_receipt(int(input("Enter receipt number: ")))
+            except ValueError:
+                print("Invalid receipt number! Please enter a number.")
+        elif choice == '8':
             break
         else:
             print("Invalid choice! Please try again.")
@@ -600,10 +4979,13 @@ def reports_menu(billing_system, inventory_manager):
         print("2. Daily Sales")
         print("3. Low Stock Alert")
         print("4. Product Statistics")
-        print("5. Back to Main Menu")
+        print("5. Product Sales Analytics")
+        print("6. Reorder Forecast")
+        print("7. Export Sales Report")
+        print("8. Back to Main Menu")
         print("-"*60)
         
-        choice = input("Enter your choice (1-5): ").strip()
+        choice = input("Enter your choice (1-8): ").strip()
         
         if choice == '1':
             try:
@@ -651,33 +5033,232 @@ def reports_menu(billing_system, inventory_manager):
                 print("Invalid threshold! Please enter a number.")
         elif choice == '4':
             # Product Statistics
-            products = inventory_manager.products.values()
-            if products:
-                total_products = len(products)
-                total_stock_value = sum(p.price * p.stock_quantity for p in products)
-                low_stock_count = len([p for p in products if p.stock_quantity <= 5])
-                
+            aggregates = inventory_manager.aggregates
+            if inventory_manager.products:
                 print("\n" + "="*50)
                 print("PRODUCT STATISTICS")
                 print("="*50)
-                print(f"Total Products: {total_products}")
-                print(f"Total Stock Value: ${total_stock_value:.2f}")
-                print(f"Low Stock Items: {low_stock_count}")
-                print(f"Out of Stock Items: {len([p for p in products if p.stock_quantity == 0])}")
+                print(f"Total Products: {len(inventory_manager.products)}")
+                print(f"Total Stock Value: ${aggregates.total_stock_value:.2f}")
+                print(f"Low Stock Items: {aggregates.low_stock_count}")
+                print(f"Out of Stock Items: {aggregates.out_of_stock_count}")
                 
                 # Top 5 most valuable products by stock value
-                valuable_products = sorted(products, key=lambda p: p.price * p.stock_quantity, reverse=True)[:5]
                 print("\nTop 5 Most Valuable Products (by stock value):")
                 print("-"*50)
-                for i, product in enumerate(valuable_products, 1):
-                    stock_value = product.price * product.stock_quantity
+                for i, (product, stock_value) in enumerate(inventory_manager.most_valuable_products(5), 1):
                     print(f"{i}. {product.name} - ${stock_value:.2f}")
             else:
                 print("No products available for statistics!")
         elif choice == '5':
+            try:
+                start_input = input("Enter start date (YYYY-MM-DD) or press Enter for last 7 days: ")
+                end_input = input("Enter end date (YYYY-MM-DD) or press Enter for today: ")
+                
+                start_date = datetime.strptime(start_input, '%Y-%m-%d').date() if start_input else None
+                end_date = datetime.strptime(end_input, '%Y-%m-%d').date() if end_input else None
+                
+                billing_system.display_product_analytics(start_date, end_date)
+            except ValueError:
+                print("Invalid date format! Please use YYYY-MM-DD.")
+        elif choice == '6':
+            billing_system.display_reorder_forecast()
+        elif choice == '7':
+            try:
+                start_input = input("Enter start date (YYYY-MM-DD) or press Enter for last 7 days: ")
+                end_input = input("Enter end date (YYYY-MM-DD) or press Enter for today: ")
+                
+                start_date = datetime.strptime(start_input, '%Y-%m-%d').date() if start_input else None
+                end_date = datetime.strptime(end_input, '%Y-%m-%d').date() if end_input else None
+            except ValueError:
+                print("Invalid date format! Please use YYYY-MM-DD.")
+                continue
+            output_file = input("Enter output file (.csv or .jsonl): ").strip()
+            if output_file:
+                billing_system.export_sales_report(output_file, start_date, end_date)
+            else:
+                print("No output file given!")
+        elif choice == '8':
             break
         else:
             print("Invalid choice! Please try again.")
 
+def parse_date_arg(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date {value!r}, use YYYY-MM-DD")
+
+def run_command(argv):
+    parser = argparse.ArgumentParser(description="Store management system; runs the interactive menus without a command")
+    parser.add_argument('--db', help="use this SQLite database instead of inventory.csv and sales.csv")
+    parser.add_argument('--metrics-file', help="record operation metrics and write them here (Prometheus text format)")
+    parser.add_argument('--metrics-interval', type=float, default=15.0, help="seconds between metrics file updates")
+    parser.add_argument('--profile-slow', type=float, metavar='SECONDS',
+                        help="sample stacks of operations slower than this into slow_operations.folded")
+    commands = parser.add_subparsers(dest='command')
+    
+    memory_parser = commands.add_parser('memory-report', help="compare memory per SKU of the product stores")
+    memory_parser.add_argument('--skus', type=int, default=100000)
+    
+    stress_parser = commands.add_parser('stress-checkout', help="check concurrent checkouts never oversell")
+    stress_parser.add_argument('--threads', type=int, default=16)
+    stress_parser.add_argument('--orders', type=int, default=200, help="orders per thread")
+    stress_parser.add_argument('--products', type=int, default=20)
+    stress_parser.add_argument('--stock', type=int, default=300)
+    
+    orders_parser = commands.add_parser('process-orders', help="run a JSON-lines file of orders through checkout")
+    orders_parser.add_argument('orders', help="JSON-lines order file, or - for stdin")
+    orders_parser.add_argument('--rejects', help="where rejected orders go (default <orders>.rejects.jsonl)")
+    orders_parser.add_argument('--batch-size', type=int, default=1000)
+    
+    export_parser = commands.add_parser('export-sales', help="stream sales in a date range to CSV or JSON lines")
+    export_parser.add_argument('output', help="output file; .jsonl or .json for JSON lines, otherwise CSV")
+    export_parser.add_argument('--start', type=parse_date_arg, help="first day (YYYY-MM-DD), default 7 days ago")
+    export_parser.add_argument('--end', type=parse_date_arg, help="last day (YYYY-MM-DD), default today")
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'])
+    
+    migrate_parser = commands.add_parser('migrate-sales', help=f"split sales.csv into date partitions under {SALES_PARTITION_DIR}/")
+    migrate_parser.add_argument('--granularity', choices=['month', 'day'], default='month')
+    
+    compress_parser = commands.add_parser('compress-sales', help="gzip sales partitions whose newest sale is old")
+    compress_parser.add_argument('--older-than', type=int, default=90, metavar='DAYS')
+    
+    find_parser = commands.add_parser('find-products', help="write products in a price/stock range as CSV")
+    find_parser.add_argument('--min-price', type=float)
+    find_parser.add_argument('--max-price', type=float)
+    find_parser.add_argument('--min-stock', type=int)
+    find_parser.add_argument('--max-stock', type=int)
+    find_parser.add_argument('--sort', choices=['name', 'price', 'stock'])
+    find_parser.add_argument('--descending', action='store_true')
+    
+    changes_parser = commands.add_parser('export-changes', help="write the products changed since a version")
+    changes_parser.add_argument('output', help="output file; .jsonl or .json for JSON lines, otherwise CSV")
+    changes_parser.add_argument('--since', type=int, default=0, help="version from the previous export (0 for everything)")
+    changes_parser.add_argument('--limit', type=int, help="export at most this many changes")
+    changes_parser.add_argument('--format', choices=['csv', 'jsonl'])
+    
+    compact_changes_parser = commands.add_parser('compact-changes', help="drop change records at or below a version")
+    compact_changes_parser.add_argument('--before', type=int,
+                                        help="also drop changes up to this version, the oldest any consumer still syncs from")
+    
+    chain_report_parser = commands.add_parser('chain-report', help="sales report and product statistics over every store")
+    chain_report_parser.add_argument('--root', default='stores', help="directory holding one subdirectory per store")
+    chain_report_parser.add_argument('--start', type=parse_date_arg, help="first day (YYYY-MM-DD), default 7 days ago")
+    chain_report_parser.add_argument('--end', type=parse_date_arg, help="last day (YYYY-MM-DD), default today")
+    chain_report_parser.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    
+    chain_stock_parser = commands.add_parser('chain-stock', help="stock of a product in every store")
+    chain_stock_parser.add_argument('product_id')
+    chain_stock_parser.add_argument('--root', default='stores', help="directory holding one subdirectory per store")
+    chain_stock_parser.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    
+    receipt_parser = commands.add_parser('receipts', help="print archived receipts as JSON lines")
+    receipt_parser.add_argument('sale_ids', nargs='*', type=int, metavar='SALE_ID')
+    receipt_parser.add_argument('--start', type=parse_date_arg, help="first day (YYYY-MM-DD) when no SALE_ID is given, default 7 days ago")
+    receipt_parser.add_argument('--end', type=parse_date_arg, help="last day (YYYY-MM-DD), default today")
+    
+    serve_parser = commands.add_parser('serve', help="run the HTTP/JSON store API")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--workers', type=int, default=8, help="threads for disk and lock work")
+    
+    args = parser.parse_args(argv)
+    if args.metrics_file or args.profile_slow is not None or args.command == 'serve':
+        METRICS.enable(args.profile_slow)
+    if args.metrics_file:
+        METRICS.write_every(args.metrics_file, args.metrics_interval)
+    try:
+        dispatch_command(args)
+    finally:
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+        METRICS.disable()
+
+def dispatch_command(args):
+    if args.command is None:
+        main(args.db)
+    elif args.command == 'memory-report':
+        report = product_memory_report(args.skus)
+        print(f"Memory per SKU over {args.skus} products:")
+        print(f"  Product objects in a dict: {report['dict']:.0f} bytes")
+        print(f"  Columnar store:            {report['columnar']:.0f} bytes")
+        print(f"  Saving: {1 - report['columnar'] / report['dict']:.0%}")
+    elif args.command == 'process-orders':
+        inventory_manager, billing_system = open_store(args.db)
+        rejects_file = args.rejects or ('rejected_orders.jsonl' if args.orders == '-' else args.orders + '.rejects.jsonl')
+        with (sys.stdin if args.orders == '-' else open(args.orders, 'r', encoding='utf-8')) as orders, \
+             open(rejects_file, 'w', encoding='utf-8') as rejects:
+            stats = billing_system.process_orders(orders, rejects, args.batch_size)
+        billing_system.flush_sales()
+        inventory_manager.compact()
+        if stats['rejected']:
+            print(f"Rejected orders written to {rejects_file}")
+    elif args.command == 'export-sales':
+        inventory_manager, billing_system = open_store(args.db)
+        if billing_system.export_sales_report(args.output, args.start, args.end, args.format) is None:
+            sys.exit(1)
+    elif args.command == 'migrate-sales':
+        if not migrate_sales_to_partitions(granularity=args.granularity):
+            sys.exit(1)
+    elif args.command == 'compress-sales':
+        if not os.path.exists(os.path.join(SALES_PARTITION_DIR, 'manifest.json')):
+            print("No partitioned sales found; run migrate-sales first.")
+            sys.exit(1)
+        PartitionedSalesStorage().compress_partitions(args.older_than)
+    elif args.command == 'find-products':
+        with redirect_stdout(sys.stderr):
+            inventory_manager = open_inventory(args.db)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['product_id', 'name', 'price', 'stock_quantity'])
+        for product in inventory_manager.find_products(args.min_price, args.max_price, args.min_stock,
+                                                       args.max_stock, args.sort, args.descending):
+            writer.writerow([product.product_id, product.name, product.price, product.stock_quantity])
+    elif args.command == 'chain-report':
+        chain = StoreChain(args.root, args.workers)
+        if not chain.store_ids():
+            print(f"No stores found under {args.root}/")
+            sys.exit(1)
+        chain.display_sales_report(args.start, args.end)
+        chain.display_product_statistics()
+    elif args.command == 'chain-stock':
+        StoreChain(args.root, args.workers).display_stock(args.product_id)
+    elif args.command == 'export-changes':
+        with redirect_stdout(io.StringIO()):
+            inventory_manager = open_inventory(args.db)
+        if inventory_manager.export_changes(args.output, args.since, args.limit, args.format) is None:
+            sys.exit(1)
+    elif args.command == 'compact-changes':
+        with redirect_stdout(io.StringIO()):
+            inventory_manager = open_inventory(args.db)
+        if not inventory_manager.changes.compact(args.before):
+            sys.exit(1)
+        print(f"Change feed compacted; history now starts after version {inventory_manager.changes.floor}")
+    elif args.command == 'receipts':
+        # Only the archive is opened, so a lookup reads one index slot and one block
+        receipts = ReceiptArchive(args.db + '.receipts' if args.db else RECEIPTS_FILE)
+        if args.sale_ids:
+            sales = [receipts.get(sale_id) for sale_id in args.sale_ids]
+        else:
+            end_date = args.end or datetime.now().date()
+            start_date = args.start or end_date - timedelta(days=7)
+            sales = receipts.between(datetime.combine(start_date, datetime.min.time()),
+                                     datetime.combine(end_date, datetime.min.time()) + timedelta(days=1))
+        for sale_id, sale in zip(args.sale_ids or [None] * len(sales), sales):
+            if sale is None:
+                print(f"Receipt {sale_id} not found!", file=sys.stderr)
+            else:
+                print(json.dumps(sale.to_dict()))
+        if None in sales:
+            sys.exit(1)
+    elif args.command == 'serve':
+        from server import run_server
+        run_server(args.host, args.port, args.db, args.workers)
+    elif args.command == 'stress-checkout':
+        if not stress_test_checkout(args.threads, args.orders, args.products, args.stock):
+            sys.exit(1)
+
 if __name__ == "__main__":
-    main()
+    # Let server.py's "from main import ..." reuse this module rather than load a second copy
+    sys.modules.setdefault('main', sys.modules[__name__])
+    run_command(sys.argv[1:])
@@ -0,0 +1,421 @@
+import json
+import time
+import signal
+import asyncio
+from urllib.parse import urlsplit, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from main import open_store, METRICS
+
+# A small HTTP/1.1 JSON front end over InventoryManager and BillingSystem.
+#
+#   GET    /products/<id>                      product lookup
+#   GET    /products?q=<keyword>&limit=&offset= search
+#   GET    /changes?since=<version>&limit=     products changed since a version (see changes_since)
+#   GET    /receipts/<sale_id>                 archived receipt of a sale, with its line items
+#   POST   /carts                              open a cart -> {"session_id": ...}
+#   GET    /carts/<id>                         cart contents
+#   DELETE /carts/<id>                         abandon a cart, releasing its reservations
+#   POST   /carts/<id>/items                   {"product_id": "101", "quantity": 2}
+#   DELETE /carts/<id>/items/<product_id>      optional ?quantity=
+#   PUT    /carts/<id>/discount                {"type": "percentage", "value": 10}
+#   DELETE /carts/<id>/discount
+#   POST   /carts/<id>/checkout                -> the sale
+#   GET    /reports/sales?start=&end=          dates as YYYY-MM-DD
+#   GET    /reports/daily?date=
+#   GET    /reports/low-stock?threshold=
+#   GET    /metrics                            operation metrics, Prometheus text format
+#
+# Everything that takes a lock or touches storage, including reads of the
+# shared indexes, runs on a small thread pool, so a journal append, SQLite
+# commit or index update never holds up the event loop. Carts left idle for the
+# inventory's reservation_ttl are dropped and their reservations released.
+
+MAX_HEADER_BYTES = 16384
+MAX_BODY_BYTES = 1 << 20
+PIPELINE_DEPTH = 16
+
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class Request:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.version = version
+        self.headers = headers
+        self.body = body
+        parts = urlsplit(target)
+        self.path = [unquote(part) for part in parts.path.split('/') if part]
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'{}')
+        except ValueError as e:
+            raise HTTPError(400, f"Invalid JSON body: {e}")
+
+async def read_request(reader):
+    """Parse one request off the stream; None once the client has closed the connection"""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise HTTPError(400, "Incomplete request")
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(413, "Request headers too large")
+
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return Request(method, target, version, headers, body)
+
+def encode_response(status, payload, keep_alive):
+    # Text payloads (the metrics page) go out as they are; everything else is JSON
+    if isinstance(payload, str):
+        body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+    else:
+        body, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+def parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPError(400, f"Invalid {name} date, use YYYY-MM-DD")
+
+def parse_number(value, name, kind=int):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"Invalid {name}")
+
+def cart_to_dict(session):
+    total = sum(item.total for item in session.cart)
+    promotion_discount, promotions = session.billing_system.promotions.evaluate(session.cart)
+    return {
+        'session_id': session.session_id,
+        'items': [item.to_dict() for item in session.cart],
+        'subtotal': total,
+        'promotions': promotions,
+        'discount': session.current_discount,
+        'total': total - promotion_discount - session.current_discount
+    }
+
+class StoreService:
+    """Route HTTP requests to an inventory manager and billing system"""
+
+    def __init__(self, inventory_manager, billing_system, workers=8):
+        self.inventory_manager = inventory_manager
+        self.billing_system = billing_system
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='store-io')
+        self.sessions = {}  # session_id -> (CartSession, asyncio.Lock)
+        self.last_used = {}  # session_id -> time.monotonic() of its last request
+        self.session_ttl = inventory_manager.reservations.ttl
+        self.connections = set()
+        self.reading = set()  # connections waiting on their next request
+        self.closing = False
+
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def expire_sessions(self):
+        """Drop carts idle for longer than session_ttl, releasing what they reserved"""
+        while True:
+            await asyncio.sleep(max(self.session_ttl / 4, 1.0))
+            cutoff = time.monotonic() - self.session_ttl
+            for session_id, used in list(self.last_used.items()):
+                # Skip carts used or deleted while an earlier release was awaited
+                if used > cutoff or self.last_used.get(session_id) != used:
+                    continue
+                entry = self.sessions.get(session_id)
+                if entry is None:
+                    continue
+                session, lock = entry
+                if lock.locked():
+                    continue
+                self.sessions.pop(session_id, None)
+                self.last_used.pop(session_id, None)
+                try:
+                    await self.run_blocking(session.release)
+                except Exception as e:
+                    # Keep sweeping; the reservations still lapse after their own ttl
+                    print(f"Error releasing idle cart {session_id}: {type(e).__name__}: {e}")
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        # Requests are read ahead and handled concurrently; responses go out in request order
+        responses = asyncio.Queue(PIPELINE_DEPTH)
+        sender = asyncio.create_task(self.send_responses(responses, writer))
+        try:
+            while not self.closing:
+                self.reading.add(task)
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    await responses.put(self.error_response(e.status, e.message))
+                    break
+                finally:
+                    self.reading.discard(task)
+                if request is None:
+                    break
+                await responses.put(asyncio.create_task(self.respond(request)))
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            await responses.put(None)
+            await sender
+            writer.close()
+            self.connections.discard(task)
+
+    async def send_responses(self, responses, writer):
+        broken = False
+        while True:
+            pending = await responses.get()
+            if pending is None:
+                break
+            data = await pending if isinstance(pending, asyncio.Task) else pending
+            if broken:
+                continue  # keep draining so the reader never blocks on a full queue
+            try:
+                writer.write(data)
+                if responses.empty():
+                    await writer.drain()
+            except ConnectionError:
+                broken = True
+
+    def error_response(self, status, message):
+        return encode_response(status, {'error': message}, False)
+
+    async def respond(self, request):
+        keep_alive = request.keep_alive and not self.closing
+        try:
+            status, payload = await self.dispatch(request)
+        except HTTPError as e:
+            status, payload = e.status, {'error': e.message}
+        except Exception as e:
+            status, payload = 500, {'error': f"{type(e).__name__}: {e}"}
+        return encode_response(status, payload, keep_alive)
+
+    async def dispatch(self, request):
+        path = request.path
+        if not path:
+            raise HTTPError(404, "Not found")
+        if path[0] == 'products':
+            return await self.products(request, path[1:])
+        if path[0] == 'carts':
+            return await self.carts(request, path[1:])
+        if path == ['changes'] and request.method == 'GET':
+            return await self.changes(request)
+        if path[0] == 'receipts' and len(path) == 2 and request.method == 'GET':
+            return await self.receipt(path[1])
+        if path == ['metrics'] and request.method == 'GET':
+            return 200, METRICS.render()
+        if path[0] == 'reports' and len(path) == 2:
+            return await self.reports(request, path[1])
+        raise HTTPError(404, "Not found")
+
+    async def products(self, request, path):
+        if request.method != 'GET':
+            raise HTTPError(405, "Method not allowed")
+        if len(path) == 1:
+            product = await self.run_blocking(self.inventory_manager.get_product, path[0])
+            if product is None:
+                raise HTTPError(404, "Product not found!")
+            return 200, product.to_dict()
+        if path:
+            raise HTTPError(404, "Not found")
+        keyword = request.query.get('q', '')
+        limit = parse_number(request.query.get('limit', 50), 'limit')
+        offset = parse_number(request.query.get('offset', 0), 'offset')
+        results = await self.run_blocking(self.inventory_manager.search_product, keyword, limit, offset)
+        return 200, {'results': [product.to_dict() for product in results]}
+
+    async def changes(self, request):
+        since = parse_number(request.query.get('since', 0), 'since')
+        limit = parse_number(request.query.get('limit', 1000), 'limit')
+        result = await self.run_blocking(self.inventory_manager.changes_since, since, limit)
+        if result is None:
+            raise HTTPError(404, "Change feed is not enabled")
+        return 200, {**result, 'changed': [product.to_dict() for product in result['changed']]}
+
+    async def receipt(self, sale_id):
+        sale = await self.run_blocking(self.billing_system.get_receipt, parse_number(sale_id, 'sale id'))
+        if sale is None:
+            raise HTTPError(404, "Receipt not found!")
+        return 200, sale.to_dict()
+
+    async def carts(self, request, path):
+        method = request.method
+        if not path:
+            if method != 'POST':
+                raise HTTPError(405, "Method not allowed")
+            session = self.billing_system.open_session()
+            session.quiet = True
+            self.sessions[session.session_id] = (session, asyncio.Lock())
+            self.last_used[session.session_id] = time.monotonic()
+            return 201, cart_to_dict(session)
+
+        if path[0] not in self.sessions:
+            raise HTTPError(404, "Cart not found")
+        session, lock = self.sessions[path[0]]
+        self.last_used[session.session_id] = time.monotonic()
+        action = path[1:]
+        # One request at a time per cart, even when a client pipelines several
+        async with lock:
+            if not action:
+                if method == 'GET':
+                    return 200, cart_to_dict(session)
+                if method == 'DELETE':
+                    await self.run_blocking(session.release)
+                    self.sessions.pop(session.session_id, None)
+                    self.last_used.pop(session.session_id, None)
+                    return 200, {'session_id': session.session_id, 'released': True}
+            elif action == ['items'] and method == 'POST':
+                body = request.json()
+                if 'product_id' not in body:
+                    raise HTTPError(400, "product_id is required")
+                quantity = parse_number(body.get('quantity'), 'quantity')
+                ok = await self.run_blocking(session.add_to_cart, str(body['product_id']), quantity)
+                return self.cart_result(session, ok, 409)
+            elif len(action) == 2 and action[0] == 'items' and method == 'DELETE':
+                quantity = request.query.get('quantity')
+                if quantity is not None:
+                    quantity = parse_number(quantity, 'quantity')
+                ok = await self.run_blocking(session.remove_from_cart, action[1], quantity)
+                return self.cart_result(session, ok, 404)
+            elif action == ['discount'] and method == 'PUT':
+                body = request.json()
+                value = parse_number(body.get('value'), 'discount value', float)
+                ok = session.apply_discount(str(body.get('type', '')), value)
+                return self.cart_result(session, ok, 400)
+            elif action == ['discount'] and method == 'DELETE':
+                session.clear_discount()
+                return 200, cart_to_dict(session)
+            elif action == ['checkout'] and method == 'POST':
+                sale = await self.run_blocking(session.checkout)
+                if sale is None:
+                    raise HTTPError(409, session.last_error)
+                return 200, sale.to_dict()
+            else:
+                raise HTTPError(404, "Not found")
+        raise HTTPError(405, "Method not allowed")
+
+    def cart_result(self, session, ok, failure_status):
+        if not ok:
+            raise HTTPError(failure_status, session.last_error)
+        return 200, cart_to_dict(session)
+
+    async def reports(self, request, name):
+        if request.method != 'GET':
+            raise HTTPError(405, "Method not allowed")
+        query = request.query
+        billing_system = self.billing_system
+        if name == 'sales':
+            start = parse_date(query['start'], 'start') if 'start' in query else None
+            end = parse_date(query['end'], 'end') if 'end' in query else None
+            report = await self.run_blocking(billing_system.get_sales_report, start, end)
+            return 200, {
+                'start_date': report['start_date'].isoformat(),
+                'end_date': report['end_date'].isoformat(),
+                'total_sales': report['total_sales'],
+                'total_amount': report['total_amount'],
+                'transactions': [sale.to_dict() for sale in report['transactions']]
+            }
+        if name == 'daily':
+            target = parse_date(query['date'], 'date') if 'date' in query else None
+            sales = await self.run_blocking(billing_system.get_daily_sales, target)
+            return 200, {
+                'total_sales': len(sales),
+                'total_amount': sum(sale.final_amount for sale in sales),
+                'transactions': [sale.to_dict() for sale in sales]
+            }
+        if name == 'low-stock':
+            threshold = parse_number(query.get('threshold', 5), 'threshold')
+            products = await self.run_blocking(billing_system.get_low_stock_products, threshold)
+            return 200, {'products': [product.to_dict() for product in products]}
+        raise HTTPError(404, "Not found")
+
+    async def shutdown(self, server, grace=10.0):
+        """Stop accepting, let open requests finish, then flush everything to disk"""
+        self.closing = True
+        server.close()
+        await server.wait_closed()
+        # Idle keep-alive connections go now; responses already queued are still sent
+        for task in list(self.reading):
+            task.cancel()
+        if self.connections:
+            _, stuck = await asyncio.wait(self.connections, timeout=grace)
+            for task in stuck:
+                task.cancel()
+        for session, _ in list(self.sessions.values()):
+            session.release()
+        self.sessions.clear()
+        self.last_used.clear()
+        await self.run_blocking(self.billing_system.flush_sales)
+        await self.run_blocking(self.inventory_manager.compact)
+        self.executor.shutdown(wait=True)
+
+async def serve(host='127.0.0.1', port=8080, db_path=None, workers=8):
+    inventory_manager, billing_system = open_store(db_path)
+    service = StoreService(inventory_manager, billing_system, workers)
+    server = await asyncio.start_server(service.handle_connection, host, port,
+                                        limit=MAX_HEADER_BYTES, backlog=1024)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows event loops
+            pass
+    print(f"Serving store API on http://{host}:{port} (Ctrl+C to stop)")
+    expiry = asyncio.create_task(service.expire_sessions())
+    try:
+        await stop.wait()
+    finally:
+        print("Shutting down, flushing pending writes...")
+        expiry.cancel()
+        await service.shutdown(server)
+        print("Store API stopped.")
+
+def run_server(host='127.0.0.1', port=8080, db_path=None, workers=8):
+    try:
+        asyncio.run(serve(host, port, db_path, workers))
+    except KeyboardInterrupt:
+        pass